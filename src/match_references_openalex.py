@@ -18,6 +18,10 @@ from bs4 import BeautifulSoup
 from datetime import datetime, time
 from multiprocessing import Pool
 from collections import OrderedDict
+from pipeline_log import (
+    open_log, close_log, start_paper_log, end_paper_log, start_stage,
+    end_stage
+)
 
 ARXIV_URL_PATT = re.compile(
     r'arxiv\.org\/[a-z0-9-]{1,10}\/(([a-z0-9-]{1,15}\/)?[\d\.]{4,9}\d)',
@@ -340,7 +344,7 @@ def map_ids_from_openalexdb_match_to_dict(matched_pub_from_db):
 
 
 def extend_parsed_arxiv_chunk(params):
-    jsonl_file_path, output_root_dir, match_db_host, meta_db_uri, grobid_host = params
+    jsonl_file_path, output_root_dir, match_db_host, meta_db_uri, grobid_host, timing = params
     i = 0
     bib_item_counter = 0
     bib_item_no_title_error_counter = 0
@@ -369,13 +373,24 @@ def extend_parsed_arxiv_chunk(params):
     if not os.path.exists(year_dir_path):
         os.makedirs(year_dir_path)
 
+    # per paper timings (see pipeline_log.py)
+    if timing and not os.path.exists(output_root_dir + "logs"):
+        os.makedirs(output_root_dir + "logs")
+    timing_log = open_log(output_root_dir + "logs", enabled=timing)
+
     with open(enriched_chunk_fp, "w", encoding="utf-8") as output_chunk:
         with open(jsonl_file_path, 'r', encoding='utf-8') as chunk:
             print("Worker reading file ", jsonl_file_path, "..")
             output_chunk_temp = ""
             for publication in chunk:
+                ppr_log = start_paper_log(
+                    None, 'match', archive=chunk_fn, timing=timing
+                )
                 try:
+                    started = start_stage(ppr_log)
                     json_data = json.loads(publication)
+                    end_stage(ppr_log, 'json_decode', started, num_bytes=len(publication))
+                    ppr_log['paper_id'] = json_data.get('paper_id')
 
                     # iterate through all bib_entries of current paper
                     # entries have form:
@@ -421,15 +436,19 @@ def extend_parsed_arxiv_chunk(params):
                                             aid_year = aid_m.group(2)
                                             aid_month = aid_m.group(3)
 
+                                            started = start_stage(ppr_log)
                                             title_from_arxive_meta_db = title_lookup_in_arxiv_metadata_db(
                                                 aid, cursor_arxiv, aid_year, aid_month)
+                                            end_stage(ppr_log, 'arxiv_meta_lookup', started)
                                     else:
                                         aid_m = ARXIV_ID_PATT_DATE.match(str(bib_entry_aid))
                                         aid_year = aid_m.group(2)
                                         aid_month = aid_m.group(3)
+                                        started = start_stage(ppr_log)
                                         title_from_arxive_meta_db = title_lookup_in_arxiv_metadata_db(
                                             str(bib_entry_aid),
                                             cursor_arxiv, aid_year, aid_month)
+                                        end_stage(ppr_log, 'arxiv_meta_lookup', started)
 
                                     if title_from_arxive_meta_db is not None:
                                         if len(title_from_arxive_meta_db) != 0:
@@ -468,6 +487,7 @@ def extend_parsed_arxiv_chunk(params):
                                 if aps_doi is not None:
                                     doi_candidates = [aps_doi] + doi_candidates
                                 # work with DOIs found
+                                started = start_stage(ppr_log)
                                 try:
                                     for doi_candi in doi_candidates:
                                         if title is not None:
@@ -506,6 +526,7 @@ def extend_parsed_arxiv_chunk(params):
                                 except psycopg2.IntegrityError as ie:
                                     print(ie)
                                     pass
+                                end_stage(ppr_log, 'crossref', started)
 
                             # find title with GROBID in ref string
                             if title is None:
@@ -525,6 +546,9 @@ def extend_parsed_arxiv_chunk(params):
                                     for m in match:
                                         formula_ref_string = m.group(0)
                                         formula_ref_key = formula_ref_string.replace("{{formula:", "").replace("}}", "")
+                                        # (formulae within bib entries are
+                                        # never interned, see
+                                        # parse_latex_tralics.py)
                                         bib_item_ref_string_clean = bib_item_ref_string_clean.replace(
                                             formula_ref_string,
                                             json_data['ref_entries'][
@@ -532,8 +556,10 @@ def extend_parsed_arxiv_chunk(params):
                                                 'latex'])
 
                                 # get title from GROBID API
+                                started = start_stage(ppr_log)
                                 grobid_bibstruct_xml = find_title_with_grobid_in_string(grobid_host,
                                                                                         bib_item_ref_string_clean)
+                                end_stage(ppr_log, 'grobid', started)
 
                                 if grobid_bibstruct_xml:
                                     grobid_returned_data_xml = BeautifulSoup(grobid_bibstruct_xml, 'lxml')
@@ -570,10 +596,12 @@ def extend_parsed_arxiv_chunk(params):
                                 # look at "left" 1000 characters in normalized title for lookup using index
                                 openalexdb_title_query = 'SELECT * from openalex WHERE ("left"(normalized_title::text, 1000)) = %s'
 
+                                started = start_stage(ppr_log)
                                 matching_openalex_pub = match_title_in_openalexdb(openalexdb_title_query,
                                                                                   bib_item_title_norm,
                                                                                   bib_item_ref_string, cursor,
                                                                                   grobid_flag)
+                                end_stage(ppr_log, 'openalex_match', started)
 
                                 if matching_openalex_pub is None:
                                     bib_item_title_not_in_openalex_error_counter += 1
@@ -609,7 +637,11 @@ def extend_parsed_arxiv_chunk(params):
                     pass
 
                 finally:
-                    output_chunk_temp = output_chunk_temp + json.dumps(json_data) + "\n"
+                    started = start_stage(ppr_log)
+                    output_line = json.dumps(json_data) + "\n"
+                    end_stage(ppr_log, 'serialize', started, num_bytes=len(output_line))
+                    output_chunk_temp = output_chunk_temp + output_line
+                    end_paper_log(timing_log, ppr_log)
 
             output_chunk.write(output_chunk_temp)
 
@@ -662,12 +694,14 @@ def extend_parsed_arxiv_chunk(params):
 
             chunk.close()
         output_chunk.close()
+    close_log(timing_log)
     conn.close()
     connection_arxiv_db.close()
 
 
 def match(
-        in_dir, out_dir, match_db_host, meta_db_uri, grobid_host, num_workers
+        in_dir, out_dir, match_db_host, meta_db_uri, grobid_host, num_workers,
+        timing=False
 ):
     # get list of JSONLs already processed
     matching_log_dir = 'logs'
@@ -703,7 +737,8 @@ def match(
                 out_dir,
                 match_db_host,
                 meta_db_uri,
-                grobid_host
+                grobid_host,
+                timing
             )
         )
 
@@ -720,19 +755,23 @@ def match(
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 7:
+    timing = '--timing' in sys.argv
+    args = [arg for arg in sys.argv if arg != '--timing']
+    if len(args) != 7:
         print((
             'Usage: python3 match_references_openalex.py <in_dir> <out_dir> '
-            '<match_db_host> <meta_db_uri> <grobid_host> <num_workers>'
+            '<match_db_host> <meta_db_uri> <grobid_host> <num_workers> '
+            '[--timing]'
         ))
         sys.exit()
 
-    in_dir = sys.argv[1]
-    out_dir = sys.argv[2]
-    match_db_host = sys.argv[3]
-    meta_db_uri = sys.argv[4]
-    grobid_host = sys.argv[5]
-    num_workers = int(sys.argv[6])
+    in_dir = args[1]
+    out_dir = args[2]
+    match_db_host = args[3]
+    meta_db_uri = args[4]
+    grobid_host = args[5]
+    num_workers = int(args[6])
     match(
-        in_dir, out_dir, match_db_host, meta_db_uri, grobid_host, num_workers
+        in_dir, out_dir, match_db_host, meta_db_uri, grobid_host, num_workers,
+        timing=timing
     )
@@ -14,11 +14,17 @@ import magic
 import os
 import re
 import shutil
-import subprocess
 import sys
 import tarfile
 import tempfile
 from hashlib import sha1
+from pipeline_log import (
+    open_log, close_log, start_paper_log, end_paper_log, start_stage,
+    end_stage
+)
+from resource_limits import (
+    DEFAULT_LIMITS, run_limited, get_limit_failure, append_output
+)
 
 
 MAIN_TEX_PATT = re.compile(r'(\\begin\s*\{\s*document\s*\})', re.I)
@@ -108,11 +114,21 @@ def _source_file_hash(fp):
     return source_file_hash
 
 
-def normalize(in_dir, out_dir, write_logs=True):
-    def log(msg):
-        if write_logs:
-            with open(os.path.join(out_dir, 'log.txt'), 'a') as f:
-                f.write('{}\n'.format(msg))
+def normalize(
+        in_dir, out_dir, write_logs=True, archive=None, timing=False,
+        log_dir=None, limits=None
+):
+    """ Normalize the arXiv source files in in_dir to single LaTeX files
+        in out_dir.
+
+        Per paper log records (see pipeline_log.py, with paper IDs in
+        their file name version, e.g. hep-th0309136) and the output of
+        latexpand are written to log_dir (default: out_dir) if write_logs
+        is True. With timing=True log records include per stage timings
+        (and archive, if given, is noted in each record). latexpand runs
+        with the resource limits given in limits (see resource_limits.py,
+        default: DEFAULT_LIMITS).
+    """
 
     if not os.path.isdir(in_dir):
         print('dump directory does not exist')
@@ -120,123 +136,175 @@ def normalize(in_dir, out_dir, write_logs=True):
 
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
+    if log_dir is None:
+        log_dir = out_dir
+    log = open_log(log_dir, enabled=write_logs or timing)
+    if limits is None:
+        limits = DEFAULT_LIMITS
+    if write_logs:
+        latexpand_log_fp = os.path.join(log_dir, 'log_latexpand.txt')
+    else:
+        latexpand_log_fp = os.devnull
+    err = open(latexpand_log_fp, 'a')
 
     source_file_info = dict()
 
-    for fn in os.listdir(in_dir):
-        path = os.path.join(in_dir, fn)
-        aid_fn_safe, ext = os.path.splitext(fn)
-        source_file_info[aid_fn_safe] = {
-            'name': fn,
-            'hash': _source_file_hash(path)
-        }
-        if PDF_EXT_PATT.match(ext):
-            # copy over pdf file as is
-            dest = os.path.join(out_dir, fn)
-            shutil.copyfile(path, dest)
-        elif GZ_EXT_PATT.match(ext):
-            if tarfile.is_tarfile(path):
-                with tempfile.TemporaryDirectory() as tmp_dir_path:
-                    # extract archive contents
-                    tar = tarfile.open(path)
-                    fnames = tar.getnames()
-                    tar.extractall(path=tmp_dir_path)
-                    # identify main tex file
-                    main_tex_path = None
-                    ignored_names = []
-                    # check .tex files first
-                    for tfn in fnames:
-                        if not TEX_EXT_PATT.match(os.path.splitext(tfn)[1]):
-                            ignored_names.append(tfn)
-                            continue
-                        tmp_file_path = os.path.join(tmp_dir_path, tfn)
-                        if os.path.isdir(tmp_file_path):
-                            continue
-                        try:
-                            cntnt = read_file(tmp_file_path)
-                        except:
-                            continue
-                        if re.search(MAIN_TEX_PATT, cntnt) is not None:
-                            main_tex_path = tmp_file_path
-                    # try other files
-                    if main_tex_path is None:
-                        for tfn in ignored_names:
+    try:
+        for fn in os.listdir(in_dir):
+            path = os.path.join(in_dir, fn)
+            aid_fn_safe, ext = os.path.splitext(fn)
+            ppr_log = start_paper_log(
+                aid_fn_safe, 'normalize', archive=archive, timing=timing
+            )
+            started = start_stage(ppr_log)
+            source_file_info[aid_fn_safe] = {
+                'name': fn,
+                'hash': _source_file_hash(path)
+            }
+            if started is not None:
+                end_stage(
+                    ppr_log, 'hash', started, num_bytes=os.path.getsize(path)
+                )
+            if PDF_EXT_PATT.match(ext):
+                # copy over pdf file as is
+                dest = os.path.join(out_dir, fn)
+                shutil.copyfile(path, dest)
+            elif GZ_EXT_PATT.match(ext):
+                if tarfile.is_tarfile(path):
+                    with tempfile.TemporaryDirectory() as tmp_dir_path:
+                        # extract archive contents
+                        started = start_stage(ppr_log)
+                        tar = tarfile.open(path)
+                        fnames = tar.getnames()
+                        tar.extractall(path=tmp_dir_path)
+                        end_stage(ppr_log, 'extract', started)
+                        # identify main tex file
+                        started = start_stage(ppr_log)
+                        main_tex_path = None
+                        ignored_names = []
+                        # check .tex files first
+                        for tfn in fnames:
+                            if not TEX_EXT_PATT.match(os.path.splitext(tfn)[1]):
+                                ignored_names.append(tfn)
+                                continue
                             tmp_file_path = os.path.join(tmp_dir_path, tfn)
-                            if NON_TEXT_PATT.match(os.path.splitext(tfn)[1]):
+                            if os.path.isdir(tmp_file_path):
                                 continue
                             try:
                                 cntnt = read_file(tmp_file_path)
-                                if re.search(MAIN_TEX_PATT, cntnt) is not None:
-                                    main_tex_path = tmp_file_path
                             except:
                                 continue
-                    # give up
-                    if main_tex_path is None:
-                        log(('couldn\'t find main tex file in dump archive {}'
-                             '').format(fn))
-                        continue
-                    # "identify" bbl file
-                    # https://arxiv.org/help/submit_tex#bibtex
-                    main_tex_fn = os.path.normpath(
-                        main_tex_path).split(os.sep)[-1]
-                    fn_base = os.path.splitext(main_tex_path)[0]
-                    bbl_fn = '{}.bbl'.format(fn_base)
-                    if os.path.isfile(os.path.join(tmp_dir_path, bbl_fn)):
-                        latexpand_args = ['latexpand',
-                                          '--expand-bbl',
-                                          bbl_fn,
-                                          main_tex_fn]
-                    else:
-                        latexpand_args = ['latexpand',
-                                          main_tex_fn]
-                    # flatten to single tex file and save
-                    new_tex_fn = '{}.tex'.format(aid_fn_safe)
-                    tmp_dest = os.path.join(tmp_dir_path, new_tex_fn)
-                    out = open(tmp_dest, mode='w')
-                    if write_logs:
-                        err = open(
-                            os.path.join(out_dir, 'log_latexpand.txt'), 'a'
+                            if re.search(MAIN_TEX_PATT, cntnt) is not None:
+                                main_tex_path = tmp_file_path
+                        # try other files
+                        if main_tex_path is None:
+                            for tfn in ignored_names:
+                                tmp_file_path = os.path.join(tmp_dir_path, tfn)
+                                if NON_TEXT_PATT.match(os.path.splitext(tfn)[1]):
+                                    continue
+                                try:
+                                    cntnt = read_file(tmp_file_path)
+                                    if re.search(MAIN_TEX_PATT, cntnt) is not None:
+                                        main_tex_path = tmp_file_path
+                                except:
+                                    continue
+                        end_stage(ppr_log, 'find_main_tex', started)
+                        # give up
+                        if main_tex_path is None:
+                            end_paper_log(log, ppr_log, failure='no_main_tex')
+                            continue
+                        # "identify" bbl file
+                        # https://arxiv.org/help/submit_tex#bibtex
+                        main_tex_fn = os.path.normpath(
+                            main_tex_path).split(os.sep)[-1]
+                        fn_base = os.path.splitext(main_tex_path)[0]
+                        bbl_fn = '{}.bbl'.format(fn_base)
+                        if os.path.isfile(os.path.join(tmp_dir_path, bbl_fn)):
+                            latexpand_args = ['latexpand',
+                                              '--expand-bbl',
+                                              bbl_fn,
+                                              main_tex_fn]
+                        else:
+                            latexpand_args = ['latexpand',
+                                              main_tex_fn]
+                        # flatten to single tex file and save
+                        new_tex_fn = '{}.tex'.format(aid_fn_safe)
+                        tmp_dest = os.path.join(tmp_dir_path, new_tex_fn)
+                        out = open(tmp_dest, mode='w')
+                        err.write('\n------------- {} -------------\n'.format(aid_fn_safe))
+                        err.flush()
+                        started = start_stage(ppr_log)
+                        # (latexpand’s errors go to a per paper file first, so
+                        # that the output limit doesn’t apply to the log file)
+                        tmp_err_path = os.path.join(
+                            tmp_dir_path, '_latexpand_stderr.txt'
+                        )
+                        with open(tmp_err_path, 'w') as tmp_err:
+                            proc = run_limited(latexpand_args, limits, stdout=out,
+                                               stderr=tmp_err, cwd=tmp_dir_path)
+                        out.close()
+                        append_output(tmp_err_path, err)
+                        end_stage(ppr_log, 'latexpand', started)
+                        limit_failure = get_limit_failure(
+                            'latexpand', proc, limits, tmp_err_path
+                        )
+                        if limit_failure is not None:
+                            end_paper_log(
+                                log, ppr_log, failure=limit_failure,
+                                failure_detail='exit status {}'.format(
+                                    proc.returncode
+                                )
                             )
-                    else:
-                        err = open(os.devnull, 'w')
-                    err.write('\n------------- {} -------------\n'.format(aid_fn_safe))
-                    err.flush()
-                    subprocess.run(latexpand_args, stdout=out, stderr=err,
-                                   cwd=tmp_dir_path)
-                    out.close()
-                    err.close()
-                    # re-read and write to ensure utf-8 b/c latexpand doesn't
-                    # behave
-                    cntnt = read_file(tmp_dest)
+                            continue
+                        # re-read and write to ensure utf-8 b/c latexpand doesn't
+                        # behave
+                        started = start_stage(ppr_log)
+                        cntnt = read_file(tmp_dest)
+                        if PRE_FIX_NATBIB:
+                            cntnt = NATBIB_PATT.sub(r'\\cite{\3}', cntnt)
+                        if PRE_FIX_BIBOPT:
+                            cntnt = BIBOPT_PATT.sub(r'\\bibitem', cntnt)
+                        if PRE_FILTER_MATH:
+                            cntnt = remove_math(cntnt)
+                        dest = os.path.join(out_dir, new_tex_fn)
+                        with open(dest, mode='w', encoding='utf-8') as f:
+                            f.write(cntnt)
+                        end_stage(
+                            ppr_log, 'fix_and_write', started,
+                            num_bytes=len(cntnt)
+                        )
+                else:
+                    # extraxt gzipped tex file
+                    started = start_stage(ppr_log)
+                    cntnt = read_gzipped_file(path)
+                    end_stage(ppr_log, 'decompress', started)
+                    if not cntnt:
+                        end_paper_log(log, ppr_log, failure='decoding_failed')
+                        continue
+                    if re.search(MAIN_TEX_PATT, cntnt) is None:
+                        end_paper_log(log, ppr_log, failure='unexpected_content')
+                        continue
+                    new_fn = '{}.tex'.format(aid_fn_safe)
+                    started = start_stage(ppr_log)
                     if PRE_FIX_NATBIB:
                         cntnt = NATBIB_PATT.sub(r'\\cite{\3}', cntnt)
                     if PRE_FIX_BIBOPT:
-                        cntnt = BIBOPT_PATT.sub(r'\\bibitem', cntnt)
+                        cntnt = BIBOPT_PATT.sub('\\bibitem', cntnt)
                     if PRE_FILTER_MATH:
                         cntnt = remove_math(cntnt)
-                    dest = os.path.join(out_dir, new_tex_fn)
+                    dest = os.path.join(out_dir, new_fn)
                     with open(dest, mode='w', encoding='utf-8') as f:
                         f.write(cntnt)
+                    end_stage(
+                        ppr_log, 'fix_and_write', started, num_bytes=len(cntnt)
+                    )
             else:
-                # extraxt gzipped tex file
-                cntnt = read_gzipped_file(path)
-                if not cntnt:
-                    continue
-                if re.search(MAIN_TEX_PATT, cntnt) is None:
-                    log('unexpected content in dump archive {}'.format(fn))
-                    continue
-                new_fn = '{}.tex'.format(aid_fn_safe)
-                if PRE_FIX_NATBIB:
-                    cntnt = NATBIB_PATT.sub(r'\\cite{\3}', cntnt)
-                if PRE_FIX_BIBOPT:
-                    cntnt = BIBOPT_PATT.sub('\\bibitem', cntnt)
-                if PRE_FILTER_MATH:
-                    cntnt = remove_math(cntnt)
-                dest = os.path.join(out_dir, new_fn)
-                with open(dest, mode='w', encoding='utf-8') as f:
-                    f.write(cntnt)
-        else:
-            log('unexpected file {} in dump directory'.format(fn))
+                end_paper_log(log, ppr_log, failure='unexpected_file')
+                continue
+            end_paper_log(log, ppr_log)
+    finally:
+        err.close()
+        close_log(log)
 
     return source_file_info
 
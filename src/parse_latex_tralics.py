@@ -4,6 +4,7 @@
 import json
 import os
 import re
+import shutil
 import sqlite3
 import subprocess
 import sys
@@ -14,6 +15,13 @@ from collections import OrderedDict, defaultdict
 from hashlib import sha1
 from lxml import etree
 from tqdm import tqdm
+from pipeline_log import (
+    LOG_FN, open_log, write_log, close_log, start_paper_log, end_paper_log,
+    start_stage, end_stage
+)
+from resource_limits import (
+    DEFAULT_LIMITS, run_limited, get_limit_failure, append_output
+)
 
 PDF_EXT_PATT = re.compile(r'^\.pdf$', re.I)
 ARXIV_URL_PATT = re.compile(
@@ -22,6 +30,65 @@ ARXIV_URL_PATT = re.compile(
     re.I
 )
 ARXIV_ID_PATT = re.compile(r'^([a-zA-Z-\.]+)?\/?(\d\d)(\d\d)(.*)$')
+MARKER_PATT = re.compile(
+    r'{{(cite|formula|figure|table|float):([0-9a-z-]+)}}'
+)
+# namespace of the IDs of figures, tables, and formulae (see _ref_entry_id)
+REF_ENTRY_ID_NAMESPACE = uuid.uuid5(
+    uuid.NAMESPACE_URL,
+    'https://github.com/IllDepence/unarXive'
+)
+# min. length of formulae interned in a formula store (shorter ones take
+# up less space inline than a reference by hash would)
+FORMULA_INTERN_MIN_LEN = 48
+# preferred location of scratch directories (tmpfs)
+SCRATCH_ROOT = '/dev/shm'
+# tralics timeout (in seconds), scaling with the size of the LaTeX source
+TRALICS_TIMEOUT_BASE = 5
+TRALICS_TIMEOUT_PER_MB = 20
+TRALICS_TIMEOUT_MAX = 30
+# timed out papers are retried with a longer timeout at lower priority
+# - at the end of the run (tralics_retry='end')
+# - in a separate pass (tralics_retry='defer', see retry_deferred)
+TRALICS_RETRY_MODES = ['end', 'defer', 'off']
+TRALICS_RETRY_TIMEOUT_FACTOR = 10
+TRALICS_RETRY_TIMEOUT_MAX = 300
+TRALICS_RETRY_NICENESS = 10
+TRALICS_RETRY_DIR = 'tralics_retry'
+# fallback containers of textual content if there are no div0 tags
+XML_CONTENT_TAGS = ['p', 'list', 'proof', 'listing']
+# _process_tralics_xml works through the elements of a paper in steps
+# 0 figures and tables, 1 formulae, 2 front matter, 3 noise, 4 refs,
+# 5 citations, 6 document structure
+# - tag -> step in which elements are processed
+XML_USE_STEPS = {
+    'figure': 0, 'table': 0, 'float': 0, 'formula': 1, 'unexpected': 3,
+    'ref': 4, 'bibitem': 5, 'cit': 5, 'div0': 6
+}
+XML_USE_STEPS.update({tag: 6 for tag in XML_CONTENT_TAGS})
+# - tag -> step after which elements are removed (keeping their tails)
+XML_STRIP_STEPS = {
+    'figure': 0, 'table': 0, 'float': 0, 'formula': 1, 'title': 2,
+    'author': 2, 'date': 2, 'thanks': 2, 'Bibliography': 5, 'bibitem': 5,
+    'cit': 5
+}
+XML_NUM_STEPS = 7
+XML_PROCESSING_TAGS = sorted(set(XML_USE_STEPS) | set(XML_STRIP_STEPS))
+# - step -> tags of the elements removed after it
+XML_STRIP_TAGS = {
+    step: [tag for tag, s in XML_STRIP_STEPS.items() if s == step]
+    for step in set(XML_STRIP_STEPS.values())
+}
+# - tag -> (use step, strip step, key of the collected elements)
+XML_TAG_STEPS = {
+    tag: (
+        XML_USE_STEPS.get(tag, XML_NUM_STEPS),
+        XML_STRIP_STEPS.get(tag),
+        # fallback content containers are kept together in document order
+        'content' if tag in XML_CONTENT_TAGS else tag
+    )
+    for tag in XML_PROCESSING_TAGS
+}
 
 
 def _write_debug_xml(tree):
@@ -104,12 +171,9 @@ def _process_content_node(c_node, curr_sec):
 
 
 def _get_local_refs(par_text):
-    marker_patt = re.compile(
-        r'{{(cite|formula|figure|table|float):([0-9a-z-]+)}}'
-    )
     cite_spans = []
     ref_spans = []
-    for m in marker_patt.finditer(par_text):
+    for m in MARKER_PATT.finditer(par_text):
         ref = {
             'start': m.start(),
             'end': m.end(),
@@ -183,14 +247,514 @@ def _get_paper_metadata(meta_db_cur, aid, ppr_year, ppr_month):
     return metadata
 
 
+def _ref_entry_id(aid, ref_type, position, content):
+    """ Deterministic ID of a figure, table, or formula, derived from
+        the paper's arXiv ID, the element's type and position within
+        the paper, and its content (caption or LaTeX), so that re-parsing
+        an unchanged paper yields identical output.
+
+        IDs have the format of UUIDs to fit the in-text markers, e.g.
+        {{formula:2c8e4d6a-7ef5-5e3b-9c1a-0f3d5b8e7a61}}
+    """
+
+    return str(uuid.uuid5(
+        REF_ENTRY_ID_NAMESPACE,
+        '{}\n{}\n{}\n{}'.format(aid, ref_type, position, content)
+    ))
+
+
+def _open_formula_db(formula_db_fp):
+    """ Open (and if necessary create) a formula store, mapping the
+        hashes of interned formulae to their LaTeX.
+    """
+
+    formula_db_conn = sqlite3.connect(formula_db_fp, timeout=60)
+    formula_db_conn.execute("""
+        create table if not exists formula(
+            'hash' text primary key,
+            'latex' text
+        )
+    """)
+    return formula_db_conn
+
+
+def _intern_formulae(ref_entries, bib_entries, formula_db_cur):
+    """ Replace the LaTeX of formula ref entries by a hash of it and
+        add it to the formula store.
+
+        Short formulae, entries without LaTeX (NO_LATEX_CONTENT), and
+        formulae within bib entries (which are put back into reference
+        strings for matching, see match_references_openalex.py) are left
+        as they are.
+    """
+
+    bib_formula_ids = set()
+    for bib_entry in bib_entries.values():
+        for m in MARKER_PATT.finditer(bib_entry['bib_entry_raw']):
+            if m.group(1) == 'formula':
+                bib_formula_ids.add(m.group(2))
+    formulae = []
+    for ref_id, ref_entry in ref_entries.items():
+        if ref_entry['type'] != 'formula' or \
+                ref_id in bib_formula_ids or \
+                len(ref_entry['latex']) < FORMULA_INTERN_MIN_LEN or \
+                ref_entry['latex'] == 'NO_LATEX_CONTENT':
+            continue
+        latex = ref_entry.pop('latex')
+        latex_hash = sha1(latex.encode('utf-8')).hexdigest()
+        ref_entry['latex_hash'] = latex_hash
+        formulae.append((latex_hash, latex))
+    formula_db_cur.executemany(
+        "insert or ignore into formula ('hash','latex') values(?,?)",
+        formulae
+    )
+
+
+def _get_scratch_root():
+    """ Directory for scratch files, in memory (/dev/shm) if available
+        (None for the system default otherwise).
+    """
+
+    if os.path.isdir(SCRATCH_ROOT) and os.access(SCRATCH_ROOT, os.W_OK):
+        return SCRATCH_ROOT
+    return None
+
+
+def _tralics_timeout(num_bytes, retry=False):
+    """ Timeout for running tralics on a LaTeX source of the given size,
+        e.g. 5s for 10kB, 15s for 500kB (and 10 times that on retry).
+    """
+
+    timeout = min(
+        TRALICS_TIMEOUT_BASE + TRALICS_TIMEOUT_PER_MB * num_bytes / 2**20,
+        TRALICS_TIMEOUT_MAX
+    )
+    if retry:
+        timeout = min(
+            timeout * TRALICS_RETRY_TIMEOUT_FACTOR,
+            TRALICS_RETRY_TIMEOUT_MAX
+        )
+    return timeout
+
+
+def _iter_parse_queue(fns, retry_fns):
+    """ Yield (file name, is retry) for all files, followed by those
+        added to retry_fns in the meantime.
+    """
+
+    for fn in fns:
+        yield fn, False
+    for fn in retry_fns:
+        yield fn, True
+
+
+def _defer_retry(path, fn, out_dir, tar_fn, source_file_info):
+    """ Keep a timed out paper’s LaTeX source (and source file info) for
+        retrying in a separate pass (see retry_deferred).
+    """
+
+    tar_fn_base, ext = os.path.splitext(tar_fn)
+    retry_dir = os.path.join(out_dir, TRALICS_RETRY_DIR, tar_fn_base)
+    os.makedirs(retry_dir, exist_ok=True)
+    shutil.copy(path, os.path.join(retry_dir, fn))
+    info_fp = '{}.json'.format(retry_dir)
+    retry_info = {'tar_fn': tar_fn, 'source_file_info': {}}
+    if os.path.isfile(info_fp):
+        with open(info_fp) as f:
+            retry_info = json.load(f)
+    retry_info['source_file_info'].update(source_file_info)
+    with open(info_fp, 'w') as f:
+        json.dump(retry_info, f)
+
+
+def _clear_dir(dir_path):
+    """ Remove the contents of a directory.
+    """
+
+    for fn in os.listdir(dir_path):
+        path = os.path.join(dir_path, fn)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def _process_tralics_xml(tree, aid, warn):
+    """ Extract ref entries (figures, tables, formulae), bib entries, and
+        body text from the XML output of tralics for a single paper.
+
+        All elements of interest are collected in a single walk over the
+        tree, instead of querying the whole tree in each of the steps
+        below (see XML_USE_STEPS). Elements within an element removed in
+        an earlier step (see XML_STRIP_STEPS) are left out, so the result
+        is the same as with one query per step.
+
+        Warnings are passed to warn (a callable taking a message).
+
+        Returns (ref_entries, bib_entries, body_text, num_citations,
+        num_citations_notfound).
+    """
+
+    # tags things that could be treated specially
+    # - <Metadata>
+    #     - <title>
+    #     - <authors><author>
+    # - <head>
+    # - <proof>
+    # - <abstract>
+    # - <maketitle>
+    # - <list> (might be used for larger chunks of text like
+    #           related work)
+    #
+    # tags *NOT* to touch
+    # - <unknown>: can surround whole content
+
+    tag_elems = defaultdict(list)
+    # step in which the enclosing elements are removed (the earliest)
+    strip_steps = [XML_NUM_STEPS]
+    for event, elem in etree.iterwalk(
+        tree, events=('start', 'end'), tag=XML_PROCESSING_TAGS
+    ):
+        use_step, strip_step, key = XML_TAG_STEPS[elem.tag]
+        if strip_step is None:
+            if event == 'start' and strip_steps[-1] >= use_step:
+                tag_elems[key].append(elem)
+            continue
+        if event == 'end':
+            strip_steps.pop()
+            continue
+        if strip_steps[-1] >= use_step:
+            tag_elems[key].append(elem)
+        strip_steps.append(min(strip_step, strip_steps[-1]))
+
+    def strip(step):
+        etree.strip_elements(tree, *XML_STRIP_TAGS[step], with_tail=False)
+
+    ref_entries = {}
+    bib_entries = {}
+    num_citations = 0
+    num_citations_notfound = 0
+
+    # figures and tables
+    # # come in the follwoing forms:
+    # # - <figure/table><head>caption text ...
+    # # - <figure/table><caption>caption text ...
+    # # - <float type="figure/table"><caption>caption text ...
+
+    ftags = tag_elems['figure']
+    ttags = tag_elems['table']
+    fltags = tag_elems['float']
+
+    for xtag_pos, xtag in enumerate(ftags + ttags + fltags):
+        if xtag.tag in ['figure', 'table']:
+            treat_as_type = xtag.tag
+        else:
+            assert xtag.tag == 'float'
+            if xtag.get('type') in ['figure', 'table']:
+                treat_as_type = xtag.get('type')
+            else:
+                continue
+
+        caption_text = ''
+        try:
+            for element in xtag.iter():
+                    if element.tag in ['head', 'caption']:
+                        elem_text = etree.tostring(
+                            element,
+                            encoding='unicode',
+                            method='text',
+                            with_tail=False
+                        )
+                        if len(elem_text) > 0:
+                            caption_text = elem_text
+        except TypeError:
+            # can get a "NoneType cannot be serialized" in rare
+            # cases
+            continue
+        if len(caption_text) < 1:
+            caption_text = 'NO_CAPTION'
+        caption_text = ''.join(caption_text.splitlines())
+        elem_uuid = _ref_entry_id(aid, treat_as_type, xtag_pos, caption_text)
+
+        xtag.tail = '{{{{{}:{}}}}}'.format(treat_as_type, elem_uuid)
+
+        if treat_as_type == 'figure':
+            ref_entries[elem_uuid] = {
+                'caption': caption_text,
+                'type': 'figure'}
+
+        elif treat_as_type == 'table':
+            ref_entries[elem_uuid] = {
+                'caption': caption_text,
+                'type': 'table'}
+
+    # remove all figure/table/float tags from xml file
+    strip(0)
+
+    # math notation
+    ftags = tag_elems['formula']
+    for ftag_pos, ftag in enumerate(ftags):
+        try:
+            latex_content = etree.tostring(
+                ftag.find('texmath'),
+                encoding='unicode',
+                method='text',
+                with_tail=False
+            )
+        except TypeError:
+            # very rare case where Tralics creates an XML that uses
+            # Texmath tags instead of texmath
+            # kown for:
+            # - 1308.0481
+            # - 1901.06986
+            try:
+                latex_content = etree.tostring(
+                    ftag.find('Texmath'),
+                    encoding='unicode',
+                    method='text',
+                    with_tail=False
+                )
+            except:
+                latex_content = 'NO_LATEX_CONTENT'
+        latex_content = ''.join(latex_content.splitlines())
+        formula_uuid = _ref_entry_id(aid, 'formula', ftag_pos, latex_content)
+        if ftag.tail:
+            new_tail = ' {}'.format(ftag.tail)
+        else:
+            new_tail = ''
+        ftag.tail = '{{{{formula:{}}}}}{}'.format(
+            formula_uuid,
+            new_tail
+        )
+
+        ref_entries[formula_uuid] = {
+            'latex': latex_content,
+            'type': 'formula'}
+
+    # remove all formula tags from XML file
+    strip(1)
+
+    # remove title and authors (works only in a few papers)
+    strip(2)
+    # remove what is most likely noise
+    mby_noise = tag_elems['unexpected']
+    for mn in mby_noise:
+        if len(mn.getchildren()) == 0:
+            mn.getparent().remove(mn)
+    # replace non citation references with REF
+    for rtag in tag_elems['ref']:
+        if not rtag.get('target', '').startswith('uid'):
+            continue
+        # FIXME: should resolve section refs here
+        if rtag.tail:
+            rtag.tail = '{} {}'.format('REF', rtag.tail)
+        else:
+            rtag.tail = ' {}'.format('REF')
+
+    # processing of citation markers
+    bibitems = tag_elems['bibitem']
+    bibkey_map = {}
+
+    for bi in bibitems:
+        containing_p = bi.getparent()
+        try:
+            while containing_p.tag != 'p':
+                # sometimes the bibitem element
+                # is not the direct child of
+                # the containing p item we want
+                containing_p = containing_p.getparent()
+        except AttributeError:
+            # getparent() might return None
+            continue
+        for child in containing_p.getchildren():
+            if child.text:
+                child.text = '{}'.format(child.text)
+        text = etree.tostring(
+            containing_p,
+            encoding='unicode',
+            method='text'
+        )
+
+        text = re.sub(r'\s+', ' ', text).strip()
+        # NOTE: commented out lines below b/c it removes information
+        # # replace the uuid of formulas in reference string
+        # text = re.sub(r'(^{{formula:)(.*)', '', text)
+        sha_hash = sha1()
+        items = [text.encode('utf-8'), str(aid).encode('utf-8')]
+        for item in items:
+            sha_hash.update(item)
+        sha_hash_string = str(sha_hash.hexdigest())
+        local_key = bi.get('id')
+        bibkey_map[local_key] = sha_hash_string
+
+        bib_entries[sha_hash_string] = {
+            'bib_entry_raw': text
+        }
+
+        contained_arXiv_ids_list = []
+        contained_links_list = []
+
+        for xref in containing_p.findall('xref'):
+            link = xref.get('url')
+            link_text_raw = etree.tostring(
+                xref,
+                encoding='unicode',
+                method='text'
+            )
+            # clean link plain text for matching with
+            # bib entry plain text
+            link_text = re.sub(
+                r'\s+',
+                ' ',
+                link_text_raw
+            ).strip()
+
+            aurl_match = ARXIV_URL_PATT.search(link)
+            if aurl_match:
+                id_part = aurl_match.group(1)
+                if len(link_text) != 0:
+                    try:
+                        location_offset_start = text.index(link_text)
+                        location_offset_end = text.index(link_text) + \
+                            len(link_text)
+                    except ValueError as e:
+                        # treat error if link text is not in
+                        # bib entry text
+                        location_offset_start = None
+                        location_offset_end = None
+
+                else:
+                    # if there are links included in source file
+                    # without corresponding visible text
+                    link_text = None
+                    location_offset_start = None
+                    location_offset_end = None
+
+                arXiv_item_local_temp_dict = {
+                    'id': id_part,
+                    'text': link_text,
+                    'start': location_offset_start,
+                    'end': location_offset_end
+                }
+                contained_arXiv_ids_list.append(
+                    arXiv_item_local_temp_dict
+                )
+
+            else:
+                if len(link_text) != 0:
+                    try:
+                        location_offset_start = text.index(link_text)
+                        location_offset_end = text.index(link_text) + \
+                            len(link_text)
+                    except ValueError as e:
+                        location_offset_start = None
+                        location_offset_end = None
+
+                else:
+                    link_text = None
+                    location_offset_start = None
+                    location_offset_end = None
+
+                link_item_local_temp_dict = {
+                    'url': link,
+                    'text': link_text,
+                    'start': location_offset_start,
+                    'end': location_offset_end
+                }
+                contained_links_list.append(link_item_local_temp_dict)
+
+        bib_entries[sha_hash_string][
+            'contained_arXiv_ids'
+        ] = contained_arXiv_ids_list
+        bib_entries[sha_hash_string][
+            'contained_links'
+        ] = contained_links_list
+
+    citations = tag_elems['cit']
+    for cit in citations:
+        num_citations += 1
+        elem = cit.find('ref')
+        if elem is None:
+            warn('cite element contains no ref element')
+            continue
+        ref = elem.get('target')
+        replace_text = ''
+        if ref in bibkey_map:
+            marker = '{{{{cite:{}}}}}'.format(bibkey_map[ref])
+            replace_text += marker
+        else:
+            warn('unmatched bibliography key {}'.format(ref))
+            num_citations_notfound += 1
+        if cit.tail:
+            cit.tail = replace_text + cit.tail
+        else:
+            cit.tail = replace_text
+    # /processing of citation markers
+    strip(5)
+
+    # _write_debug_xml(tree)
+
+    # process document structure
+    paragraphs = []
+    curr_sec = {
+        'head': '',
+        'num': '-1',
+        'type': ''
+    }
+    # div0 tag can appear on different levels of the XML hierarchy,
+    # such as /std/div0 or /unknown/frontmatter/div0
+    # we therefore take div0s from anywhere and assume they always
+    # are the lowest level containers of the main textual contents
+    top_level_sections = tag_elems['div0']
+    if len(top_level_sections) == 0:
+        # if there are no div0 tags, we give up on sections and just
+        # use paragraphs, lists, proofs, and listings and hope we
+        # cover all content with those
+        paragraphs = [
+            _process_content_node(p, curr_sec)
+            for p in tag_elems['content']
+        ]
+    for sec in top_level_sections:
+        paragraphs.extend(
+            _process_section_node(sec, curr_sec)
+        )
+
+    return (
+        ref_entries,
+        bib_entries,
+        paragraphs,
+        num_citations,
+        num_citations_notfound
+    )
+
+
 def parse(
         in_dir, out_dir, tar_fn, source_file_info, meta_db_fp, incremental,
-        write_logs=True
+        write_logs=True, formula_db_fp=None, timing=False,
+        tralics_retry='end', retry_pass=False, limits=None
 ):
-    def log(msg):
-        if write_logs:
-            with open(os.path.join(out_dir, 'log.txt'), 'a') as f:
-                f.write('{}\n'.format(msg))
+    """ Parse the normalized LaTeX files in in_dir into a JSONL file
+        in out_dir.
+
+        tralics is given time depending on the size of a paper’s LaTeX
+        source (see _tralics_timeout). Papers for which it times out are
+        retried with a longer timeout at lower priority, either at the
+        end of the run (tralics_retry='end'), or in a separate pass
+        (tralics_retry='defer', see retry_deferred), or dropped
+        (tralics_retry='off'). With retry_pass=True all papers are
+        parsed like retries and added to the chunk’s existing JSONL.
+        tralics runs with the resource limits given in limits (see
+        resource_limits.py, default: DEFAULT_LIMITS).
+
+        If formula_db_fp is given, formulae are interned in a formula store
+        shared across papers and chunks: instead of their LaTeX, formula
+        ref entries then only contain its hash (latex_hash), which can be
+        resolved with utility_scripts/unarxive_reader.py. Formulae within
+        bib entries are not interned.
+        Per paper log records (see pipeline_log.py) and the output of
+        tralics are written to out_dir if write_logs is True. With
+        timing=True log records include per stage timings.
+    """
 
     if not os.path.isdir(in_dir):
         print('input directory does not exist')
@@ -198,29 +762,59 @@ def parse(
 
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
+    log = open_log(out_dir, enabled=write_logs or timing)
+    if limits is None:
+        limits = DEFAULT_LIMITS
 
     # prepare metadata DB connection
     meta_db_conn = sqlite3.connect(meta_db_fp)
     meta_db_cur = meta_db_conn.cursor()
+    # prepare formula store connection
+    if formula_db_fp is not None:
+        formula_db_conn = _open_formula_db(formula_db_fp)
+        formula_db_cur = formula_db_conn.cursor()
 
     num_citations = 0
     num_citations_notfound = 0
     file_iterator = 0
-    paper_dicts_list = []
+    paper_lines = {}
+    retry_fns = []
 
     # iterate over each file in input directory
-    fns = os.listdir(in_dir)
-    for fn in tqdm(fns, total=len(fns), unit='papers'):
-        path = os.path.join(in_dir, fn)  # absolute path to current file
-        if fn in ['log.txt', 'log_latexpand.txt']:
-            continue
-        aid, ppr_year, ppr_month, ext = _filename_to_aid(fn, details=True)
-        aid_fn_safe = aid.replace('/', '')
-        if PDF_EXT_PATT.match(ext):  # Skip pdf files
-            log('skipping file {} (PDF)'.format(fn))
-            continue
-        # write latex contents in a temporary xml file
-        with tempfile.TemporaryDirectory() as tmp_dir_path:
+    # (in a fixed order, so that re-parsing yields identical output)
+    fns = sorted(os.listdir(in_dir))
+    # one scratch directory (in memory if possible), tralics log handle,
+    # and XML parser are used for all papers
+    if write_logs:
+        tralics_log_fp = os.path.join(out_dir, 'log_tralics.txt')
+    else:
+        tralics_log_fp = os.devnull
+    parser = etree.XMLParser()
+    with tempfile.TemporaryDirectory(dir=_get_scratch_root()) as tmp_dir_path, \
+            open(tralics_log_fp, 'a') as out:
+        # (papers queued for retry are added to the progress bar’s total)
+        pbar = tqdm(
+            _iter_parse_queue(fns, retry_fns), total=len(fns), unit='papers'
+        )
+        for fn, retry in pbar:
+            path = os.path.join(in_dir, fn)  # absolute path to current file
+            if fn in ['log.txt', 'log_latexpand.txt', LOG_FN]:
+                # logs of normalize_arxiv_dump.py
+                continue
+            aid, ppr_year, ppr_month, ext = _filename_to_aid(fn, details=True)
+            aid_fn_safe = aid.replace('/', '')
+            ppr_log = start_paper_log(
+                aid, 'parse', archive=tar_fn, timing=timing
+            )
+            retry = retry or retry_pass
+            if retry:
+                ppr_log['retry'] = True
+            if PDF_EXT_PATT.match(ext):  # Skip pdf files
+                end_paper_log(log, ppr_log, failure='pdf')
+                continue
+            # write latex contents in a temporary xml file
+            # (after removing the previous paper’s)
+            _clear_dir(tmp_dir_path)
             tmp_xml_path = os.path.join(tmp_dir_path, '{}.xml'.format(aid_fn_safe))
             # run tralics
             tralics_args = ['tralics',
@@ -233,41 +827,77 @@ def parse(
                             '-output_dir={}'.format(tmp_dir_path),
                             path]
 
-            if write_logs:
-                out = open(os.path.join(out_dir, 'log_tralics.txt'), 'a')
-            else:
-                out = open(os.devnull, 'w')
-            err = open(os.path.join(tmp_dir_path, 'tralics_out.txt'), mode='w')
             out.write('\n------------- {} -------------\n'.format(aid))
             out.flush()
 
+            # (tralics’ output goes to the scratch directory first, so that
+            # the output limit doesn’t apply to the growing log file)
+            tmp_stdout_path = os.path.join(tmp_dir_path, '_tralics_stdout.txt')
+            tmp_stderr_path = os.path.join(tmp_dir_path, '_tralics_stderr.txt')
+            num_bytes = os.path.getsize(path)
+            started = start_stage(ppr_log)
             try:
-                subprocess.run(tralics_args, stdout=out, stderr=err, timeout=5)
+                with open(tmp_stdout_path, 'w') as tmp_out, \
+                        open(tmp_stderr_path, 'w') as tmp_err:
+                    proc = run_limited(
+                        tralics_args,
+                        limits,
+                        niceness=TRALICS_RETRY_NICENESS if retry else None,
+                        stdout=tmp_out,
+                        stderr=tmp_err,
+                        timeout=_tralics_timeout(num_bytes, retry)
+                    )
             except subprocess.TimeoutExpired as e:
-                # print('FAILED {}. skipping'.format(aid))
-                log('\n--- {} ---\n{}\n----------\n'.format(aid, e))
+                append_output(tmp_stdout_path, out)
+                end_stage(ppr_log, 'tralics', started)
+                if not retry and tralics_retry == 'end':
+                    retry_fns.append(fn)
+                    pbar.total += 1
+                    pbar.refresh()
+                    ppr_log['warnings'].append('queued for retry')
+                elif not retry and tralics_retry == 'defer':
+                    _defer_retry(
+                        path, fn, out_dir, tar_fn,
+                        {aid_fn_safe: source_file_info[aid_fn_safe]}
+                    )
+                    ppr_log['warnings'].append('deferred for retry')
+                end_paper_log(
+                    log, ppr_log, failure='tralics_timeout', failure_detail=e
+                )
+                continue
+            append_output(tmp_stdout_path, out)
+            end_stage(ppr_log, 'tralics', started, num_bytes=num_bytes)
+            limit_failure = get_limit_failure(
+                'tralics', proc, limits, tmp_stderr_path
+            )
+            if limit_failure is not None:
+                end_paper_log(
+                    log, ppr_log, failure=limit_failure,
+                    failure_detail='exit status {}'.format(proc.returncode)
+                )
                 continue
-            out.close()
-            err.close()
-
-            # get plain text from tralics output
-            parser = etree.XMLParser()
 
             # check if smth went wrong with parsing latex to temporary xml file
             if not os.path.isfile(tmp_xml_path):
-                # print('FAILED {}. skipping'.format(aid))
-                log(('\n--- {} ---\n{}\n----------\n'
-                     '').format(aid, 'no tralics output'))
+                end_paper_log(log, ppr_log, failure='no_tralics_output')
+                continue
+            # get plain text from tralics output
+            started = start_stage(ppr_log)
+            try:
+                # get tree of XML hierarchy
+                tree = etree.parse(tmp_xml_path, parser)
+                file_iterator += 1
+            # catch exception to faulty XML file
+            except (etree.XMLSyntaxError, UnicodeDecodeError) as e:
+                end_paper_log(
+                    log, ppr_log, failure='xml_error', failure_detail=e
+                )
                 continue
-            with open(tmp_xml_path) as f:
-                try:
-                    tree = etree.parse(f, parser)  # get tree of XML hierarchy
-                    file_iterator += 1
-                # catch exception to faulty XML file
-                except (etree.XMLSyntaxError, UnicodeDecodeError) as e:
-                    # print('FAILED {}. skipping'.format(aid))
-                    log('\n--- {} ---\n{}\n----------\n'.format(aid, e))
-                    continue
+            if started is not None:
+                end_stage(
+                    ppr_log, 'xml_parse', started,
+                    num_bytes=os.path.getsize(tmp_xml_path)
+                )
 
             # start building paper dict
             paper_dict = OrderedDict({
@@ -286,7 +916,9 @@ def parse(
             paper_dict['_source_name'] = source_file_info[aid_fn_safe]['name']
 
             # get paper metadata
+            started = start_stage(ppr_log)
             metadata = _get_paper_metadata(meta_db_cur, aid, ppr_year, ppr_month)
+            end_stage(ppr_log, 'metadata_lookup', started)
             paper_dict['metadata'] = metadata
             abstract_text = metadata.get('abstract', '')
             abstract = {
@@ -298,320 +930,32 @@ def parse(
             paper_dict['abstract'] = abstract
 
             # parse XML
-
-            # tags things that could be treated specially
-            # - <Metadata>
-            #     - <title>
-            #     - <authors><author>
-            # - <head>
-            # - <proof>
-            # - <abstract>
-            # - <maketitle>
-            # - <list> (might be used for larger chunks of text like
-            #           related work)
-            #
-            # tags *NOT* to touch
-            # - <unknown>: can surround whole content
-
-            # figures and tables
-            # # come in the follwoing forms:
-            # # - <figure/table><head>caption text ...
-            # # - <figure/table><caption>caption text ...
-            # # - <float type="figure/table"><caption>caption text ...
-
-            ftags = tree.xpath('//{}'.format('figure'))
-            ttags = tree.xpath('//{}'.format('table'))
-            fltags = tree.xpath('//{}'.format('float'))
-
-            paper_dict['ref_entries'] = {}
-
-            for xtag in ftags + ttags + fltags:
-                if xtag.tag in ['figure', 'table']:
-                    treat_as_type = xtag.tag
-                else:
-                    assert xtag.tag == 'float'
-                    if xtag.get('type') in ['figure', 'table']:
-                        treat_as_type = xtag.get('type')
-                    else:
-                        continue
-                elem_uuid = uuid.uuid4()  # create uuid for each fig/tbl
-
-                caption_text = ''
-                try:
-                    for element in xtag.iter():
-                            if element.tag in ['head', 'caption']:
-                                elem_text = etree.tostring(
-                                    element,
-                                    encoding='unicode',
-                                    method='text',
-                                    with_tail=False
-                                )
-                                if len(elem_text) > 0:
-                                    caption_text = elem_text
-                except TypeError:
-                    # can get a "NoneType cannot be serialized" in rare
-                    # cases
-                    continue
-                if len(caption_text) < 1:
-                    caption_text = 'NO_CAPTION'
-
-                xtag.tail = '{{{{{}:{}}}}}'.format(treat_as_type, elem_uuid)
-
-                if treat_as_type == 'figure':
-                    paper_dict['ref_entries'][str(elem_uuid)] = {
-                        'caption': ''.join(caption_text.splitlines()),
-                        'type': 'figure'}
-
-                elif treat_as_type == 'table':
-                    paper_dict['ref_entries'][str(elem_uuid)] = {
-                        'caption': ''.join(caption_text.splitlines()),
-                        'type': 'table'}
-
-            # remove all figure/table/float tags from xml file
-            etree.strip_elements(tree, 'figure', with_tail=False)
-            etree.strip_elements(tree, 'table', with_tail=False)
-            etree.strip_elements(tree, 'float', with_tail=False)
-
-            # math notation
-            for ftag in tree.xpath('//{}'.format('formula')):
-                # uuid
-                formula_uuid = uuid.uuid4()
-                try:
-                    latex_content = etree.tostring(
-                        ftag.find('texmath'),
-                        encoding='unicode',
-                        method='text',
-                        with_tail=False
-                    )
-                except TypeError:
-                    # very rare case where Tralics creates an XML that uses
-                    # Texmath tags instead of texmath
-                    # kown for:
-                    # - 1308.0481
-                    # - 1901.06986
-                    try:
-                        latex_content = etree.tostring(
-                            ftag.find('Texmath'),
-                            encoding='unicode',
-                            method='text',
-                            with_tail=False
-                        )
-                    except:
-                        latex_content = 'NO_LATEX_CONTENT'
-                if ftag.tail:
-                    new_tail = ' {}'.format(ftag.tail)
-                else:
-                    new_tail = ''
-                ftag.tail = '{{{{formula:{}}}}}{}'.format(
-                    formula_uuid,
-                    new_tail
-                )
-
-                paper_dict['ref_entries'][str(formula_uuid)] = {
-                    'latex': ''.join(latex_content.splitlines()),
-                    'type': 'formula'}
-
-            # remove all formula tags from XML file
-            etree.strip_elements(tree, 'formula', with_tail=False)
-
-            # remove title and authors (works only in a few papers)
-            attributes = ['title', 'author', 'date', 'thanks']  # keywords
-            for attribute in attributes:
-                etree.strip_elements(tree, attribute, with_tail=False)
-            # remove what is most likely noise
-            mby_noise = tree.xpath('//unexpected')
-            for mn in mby_noise:
-                if len(mn.getchildren()) == 0:
-                    mn.getparent().remove(mn)
-            # replace non citation references with REF
-            for rtag in tree.xpath('//ref[starts-with(@target, "uid")]'):
-                # FIXME: should resolve section refs here
-                if rtag.tail:
-                    rtag.tail = '{} {}'.format('REF', rtag.tail)
-                else:
-                    rtag.tail = ' {}'.format('REF')
-
-            # processing of citation markers
-            bibitems = tree.xpath('//bibitem')
-            bibkey_map = {}
-
-            paper_dict['bib_entries'] = {}
-
-            for bi in bibitems:
-                containing_p = bi.getparent()
-                try:
-                    while containing_p.tag != 'p':
-                        # sometimes the bibitem element
-                        # is not the direct child of
-                        # the containing p item we want
-                        containing_p = containing_p.getparent()
-                except AttributeError:
-                    # getparent() might return None
-                    continue
-                for child in containing_p.getchildren():
-                    if child.text:
-                        child.text = '{}'.format(child.text)
-                text = etree.tostring(
-                    containing_p,
-                    encoding='unicode',
-                    method='text'
-                )
-
-                text = re.sub(r'\s+', ' ', text).strip()
-                # NOTE: commented out lines below b/c it removes information
-                # # replace the uuid of formulas in reference string
-                # text = re.sub(r'(^{{formula:)(.*)', '', text)
-                sha_hash = sha1()
-                items = [text.encode('utf-8'), str(aid).encode('utf-8')]
-                for item in items:
-                    sha_hash.update(item)
-                sha_hash_string = str(sha_hash.hexdigest())
-                local_key = bi.get('id')
-                bibkey_map[local_key] = sha_hash_string
-
-                paper_dict['bib_entries'][sha_hash_string] = {
-                    'bib_entry_raw': text
-                }
-
-                contained_arXiv_ids_list = []
-                contained_links_list = []
-
-                for xref in containing_p.findall('xref'):
-                    link = xref.get('url')
-                    link_text_raw = etree.tostring(
-                        xref,
-                        encoding='unicode',
-                        method='text'
-                    )
-                    # clean link plain text for matching with
-                    # bib entry plain text
-                    link_text = re.sub(
-                        r'\s+',
-                        ' ',
-                        link_text_raw
-                    ).strip()
-
-                    aurl_match = ARXIV_URL_PATT.search(link)
-                    if aurl_match:
-                        id_part = aurl_match.group(1)
-                        if len(link_text) != 0:
-                            try:
-                                location_offset_start = text.index(link_text)
-                                location_offset_end = text.index(link_text) + \
-                                    len(link_text)
-                            except ValueError as e:
-                                # treat error if link text is not in
-                                # bib entry text
-                                location_offset_start = None
-                                location_offset_end = None
-
-                        else:
-                            # if there are links included in source file
-                            # without corresponding visible text
-                            link_text = None
-                            location_offset_start = None
-                            location_offset_end = None
-
-                        arXiv_item_local_temp_dict = {
-                            'id': id_part,
-                            'text': link_text,
-                            'start': location_offset_start,
-                            'end': location_offset_end
-                        }
-                        contained_arXiv_ids_list.append(
-                            arXiv_item_local_temp_dict
-                        )
-
-                    else:
-                        if len(link_text) != 0:
-                            try:
-                                location_offset_start = text.index(link_text)
-                                location_offset_end = text.index(link_text) + \
-                                    len(link_text)
-                            except ValueError as e:
-                                location_offset_start = None
-                                location_offset_end = None
-
-                        else:
-                            link_text = None
-                            location_offset_start = None
-                            location_offset_end = None
-
-                        link_item_local_temp_dict = {
-                            'url': link,
-                            'text': link_text,
-                            'start': location_offset_start,
-                            'end': location_offset_end
-                        }
-                        contained_links_list.append(link_item_local_temp_dict)
-
-                paper_dict['bib_entries'][sha_hash_string][
-                    'contained_arXiv_ids'
-                ] = contained_arXiv_ids_list
-                paper_dict['bib_entries'][sha_hash_string][
-                    'contained_links'
-                ] = contained_links_list
-
-            citations = tree.xpath('//cit')
-            for cit in citations:
-                num_citations += 1
-                elem = cit.find('ref')
-                if elem is None:
-                    log(('WARNING: cite element in {} contains no ref element'
-                         '').format(aid))
-                    continue
-                ref = elem.get('target')
-                replace_text = ''
-                if ref in bibkey_map:
-                    marker = '{{{{cite:{}}}}}'.format(bibkey_map[ref])
-                    replace_text += marker
-                else:
-                    log(('WARNING: unmatched bibliography key {} for doc {}'
-                         '').format(ref, aid))
-                    num_citations_notfound += 1
-                if cit.tail:
-                    cit.tail = replace_text + cit.tail
-                else:
-                    cit.tail = replace_text
-            # /processing of citation markers
-            etree.strip_elements(tree, 'Bibliography', with_tail=False)
-            etree.strip_elements(tree, 'bibitem', with_tail=False)
-            etree.strip_elements(tree, 'cit', with_tail=False)
-
-            # _write_debug_xml(tree)
-
-            # process document structure
-            paragraphs = []
-            curr_sec = {
-                'head': '',
-                'num': '-1',
-                'type': ''
-            }
-            # div0 tag can appear on different levels of the XML hierarchy,
-            # such as /std/div0 or /unknown/frontmatter/div0
-            # we therefore take div0s from anywhere and assume they always
-            # are the lowest level containers of the main textual contents
-            top_level_sections = tree.xpath('//div0')
-            if len(top_level_sections) == 0:
-                # if there are no div0 tags, we give up on sections and just
-                # use paragraphs, lists, proofs, and listings and hope we
-                # cover all content with those
-                paragraphs = [
-                    _process_content_node(p, curr_sec)
-                    for p in tree.xpath((
-                        '//*[self::p or self::list or self::proof or '
-                        'self::listing]'
-                    ))
-                ]
-            for sec in top_level_sections:
-                paragraphs.extend(
-                    _process_section_node(sec, curr_sec)
+            started = start_stage(ppr_log)
+            (
+                paper_dict['ref_entries'],
+                paper_dict['bib_entries'],
+                paper_dict['body_text'],
+                ppr_num_citations,
+                ppr_num_citations_notfound
+            ) = _process_tralics_xml(tree, aid, ppr_log['warnings'].append)
+            end_stage(ppr_log, 'xml_processing', started)
+            if formula_db_fp is not None:
+                started = start_stage(ppr_log)
+                _intern_formulae(
+                    paper_dict['ref_entries'],
+                    paper_dict['bib_entries'],
+                    formula_db_cur
                 )
+                end_stage(ppr_log, 'formula_interning', started)
+            num_citations += ppr_num_citations
+            num_citations_notfound += ppr_num_citations_notfound
 
-            paper_dict['body_text'] = paragraphs
-
-        # bundle paper dicts for presisting as JSONL (one JSON line per paper)
-        paper_dicts_list.append(paper_dict)
+            # bundle papers for presisting as JSONL (one JSON line per paper)
+            started = start_stage(ppr_log)
+            line = '{}\n'.format(json.dumps(paper_dict))
+            end_stage(ppr_log, 'serialize', started, num_bytes=len(line))
+            paper_lines[aid_fn_safe] = line
+            end_paper_log(log, ppr_log)
 
     # persist output in JSONL
     tar_fn_base, ext = os.path.splitext(tar_fn)
@@ -619,13 +963,70 @@ def parse(
         out_dir,
         '{}.jsonl'.format(tar_fn_base)
     )
+    if retry_pass and os.path.isfile(out_json_path):
+        # add to the chunk’s papers parsed before
+        with open(out_json_path) as f:
+            for line in f:
+                paper_id = json.loads(line)['paper_id']
+                paper_lines.setdefault(paper_id.replace('/', ''), line)
     with open(out_json_path, 'w') as f:
-        for ppr in paper_dicts_list:
-            line = '{}\n'.format(json.dumps(ppr))
-            f.write(line)
+        for key in sorted(paper_lines):
+            f.write(paper_lines[key])
+    if formula_db_fp is not None:
+        formula_db_conn.commit()
+        formula_db_conn.close()
+
+    write_log(log, {
+        'stage': 'parse',
+        'tar_fn': tar_fn,
+        'num_citations': num_citations,
+        'num_citations_notfound': num_citations_notfound,
+        'num_tralics_retries': len(retry_fns)
+    })
+    close_log(log)
+    return True
+
+
+def retry_deferred(
+        out_dir, meta_db_fp, write_logs=True, formula_db_fp=None,
+        timing=False, limits=None
+):
+    """ Retry the papers of runs with tralics_retry='defer' for which
+        tralics timed out, adding them to their chunk’s JSONL in out_dir.
+    """
 
-    log(('Citations: {} (not unique)\nUnmatched citations: {}'
-         '').format(num_citations, num_citations_notfound))
+    retry_root = os.path.join(out_dir, TRALICS_RETRY_DIR)
+    if not os.path.isdir(retry_root):
+        print('no deferred papers')
+        return False
+    for fn in sorted(os.listdir(retry_root)):
+        retry_dir = os.path.join(retry_root, fn)
+        if not os.path.isdir(retry_dir):
+            continue
+        info_fp = '{}.json'.format(retry_dir)
+        with open(info_fp) as f:
+            retry_info = json.load(f)
+        print('retrying {} papers of {}'.format(
+            len(os.listdir(retry_dir)), retry_info['tar_fn']
+        ))
+        parse(
+            retry_dir,
+            out_dir,
+            retry_info['tar_fn'],
+            retry_info['source_file_info'],
+            meta_db_fp,
+            incremental=False,
+            write_logs=write_logs,
+            formula_db_fp=formula_db_fp,
+            timing=timing,
+            tralics_retry='off',
+            retry_pass=True,
+            limits=limits
+        )
+        shutil.rmtree(retry_dir)
+        os.remove(info_fp)
+    if len(os.listdir(retry_root)) == 0:
+        os.rmdir(retry_root)
     return True
 
 
@@ -0,0 +1,181 @@
+""" Buffered structured logging for normalize_arxiv_dump.py and
+    parse_latex_tralics.py.
+
+    Log records are JSON objects, written to a JSONL file (one record per
+    line) in batches rather than one file access per message. Per paper
+    records look like
+
+        {
+            "paper_id": "2105.05862",
+            "stage": "parse",
+            "time": 1671234567.89,
+            "seconds": 1.52,
+            "warnings": ["unmatched bibliography key bid3"],
+            "failure": null,
+            "failure_detail": null
+        }
+
+    where failure is None for successfully processed papers and a short
+    failure reason (e.g. "tralics_timeout", or "tralics_memory_limit"
+    see resource_limits.py) otherwise.
+
+    Optionally (timing=True), records also contain the wall clock time,
+    CPU time (including that of subprocesses, e.g. tralics), and number
+    of bytes processed of each processing stage of a paper, e.g.
+
+            "archive": "arXiv_src_2105_001.tar",
+            "timings": {
+                "tralics": {
+                    "count": 1, "wall": 1.21, "cpu": 1.18, "bytes": 84213
+                },
+                ...
+            }
+
+    (see utility_scripts/timing_report.py for a summary of those).
+
+    Batches are appended under an exclusive file lock, so that multiple
+    worker processes can log to the same file.
+
+    Example:
+
+        log = open_log('/path/to/out/dir')
+        ppr_log = start_paper_log('2105.05862', 'parse', timing=True)
+        started = start_stage(ppr_log)
+        ...
+        end_stage(ppr_log, 'tralics', started, num_bytes=84213)
+        ppr_log['warnings'].append('unmatched bibliography key bid3')
+        end_paper_log(log, ppr_log)
+        close_log(log)
+"""
+
+import fcntl
+import json
+import os
+import resource
+import time
+from collections import OrderedDict
+
+LOG_FN = 'log.jsonl'
+# number of records after which the buffer is written
+LOG_BUFFER_SIZE = 1000
+
+
+def open_log(log_dir, enabled=True, buffer_size=LOG_BUFFER_SIZE):
+    """ Create a log writing to log_dir/log.jsonl. If enabled is False,
+        records are discarded.
+    """
+
+    log_fp = None
+    if enabled:
+        log_fp = os.path.join(log_dir, LOG_FN)
+    return {
+        'fp': log_fp,
+        'buffer': [],
+        'buffer_size': buffer_size
+    }
+
+
+def write_log(log, record):
+    """ Add a record (dict) to the log.
+    """
+
+    if log['fp'] is None:
+        return
+    log['buffer'].append(json.dumps(record))
+    if len(log['buffer']) >= log['buffer_size']:
+        flush_log(log)
+
+
+def flush_log(log):
+    """ Write buffered records.
+    """
+
+    if log['fp'] is None or len(log['buffer']) == 0:
+        return
+    lines = ''.join(['{}\n'.format(line) for line in log['buffer']])
+    with open(log['fp'], 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(lines)
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+    log['buffer'] = []
+
+
+def close_log(log):
+    flush_log(log)
+
+
+def start_paper_log(paper_id, stage, archive=None, timing=False):
+    """ Start the record of processing a single paper in a given stage
+        (optionally noting the archive/chunk the paper is contained in).
+        With timing=True the processing stages timed using start_stage
+        and end_stage are recorded as well.
+    """
+
+    ppr_log = {
+        'paper_id': paper_id,
+        'stage': stage,
+        'time': time.time(),
+        'seconds': None,
+        'warnings': [],
+        'failure': None,
+        'failure_detail': None,
+        '_start': time.perf_counter()
+    }
+    if archive is not None:
+        ppr_log['archive'] = archive
+    if timing:
+        ppr_log['timings'] = OrderedDict()
+    return ppr_log
+
+
+def _cpu_time():
+    """ CPU time of the current process and its terminated subprocesses.
+    """
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def start_stage(ppr_log):
+    """ Start timing a processing stage of a paper. Returns what is to
+        be passed to end_stage (None if the paper’s record doesn’t
+        include timings).
+    """
+
+    if ppr_log.get('timings') is None:
+        return None
+    return (time.perf_counter(), _cpu_time())
+
+
+def end_stage(ppr_log, stage, started, num_bytes=None):
+    """ Finish timing a processing stage of a paper, optionally noting
+        the number of bytes processed. Stages timed multiple times (e.g.
+        once per reference) are summed up.
+    """
+
+    if started is None:
+        return
+    wall_start, cpu_start = started
+    timings = ppr_log['timings']
+    if stage not in timings:
+        timings[stage] = {'count': 0, 'wall': 0, 'cpu': 0, 'bytes': None}
+    stage_timing = timings[stage]
+    stage_timing['count'] += 1
+    stage_timing['wall'] += time.perf_counter() - wall_start
+    stage_timing['cpu'] += _cpu_time() - cpu_start
+    if num_bytes is not None:
+        stage_timing['bytes'] = (stage_timing['bytes'] or 0) + num_bytes
+
+
+def end_paper_log(log, ppr_log, failure=None, failure_detail=None):
+    """ Finish the record of processing a single paper, giving a reason
+        (and optionally details) if processing failed, and add it to the
+        log.
+    """
+
+    ppr_log['seconds'] = time.perf_counter() - ppr_log.pop('_start')
+    ppr_log['failure'] = failure
+    if failure_detail is not None:
+        ppr_log['failure_detail'] = str(failure_detail)
+    write_log(log, ppr_log)
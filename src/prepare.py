@@ -8,10 +8,14 @@ import tarfile
 import tempfile
 import time
 from normalize_arxiv_dump import normalize
-from parse_latex_tralics import parse
+from parse_latex_tralics import parse, retry_deferred, TRALICS_RETRY_MODES
+from resource_limits import DEFAULT_LIMITS
 
 
-def prepare(in_dir, out_dir, meta_db, tar_fn_patt, write_logs=False):
+def prepare(
+        in_dir, out_dir, meta_db, tar_fn_patt, write_logs=False,
+        formula_db=None, timing=False, tralics_retry='end', limits=None
+):
     if not os.path.isdir(in_dir):
         print('input directory does not exist')
         return False
@@ -104,7 +108,11 @@ def prepare(in_dir, out_dir, meta_db, tar_fn_patt, write_logs=False):
             source_file_info = normalize(
                 tmp_dir_gz,
                 tmp_dir_norm,
-                write_logs=write_logs
+                write_logs=write_logs,
+                archive=tar_fn,
+                timing=timing,
+                log_dir=out_dir,
+                limits=limits
             )
             parse(
                 tmp_dir_norm,
@@ -113,7 +121,11 @@ def prepare(in_dir, out_dir, meta_db, tar_fn_patt, write_logs=False):
                 source_file_info,
                 meta_db,
                 incremental=False,
-                write_logs=write_logs
+                write_logs=write_logs,
+                formula_db_fp=formula_db,
+                timing=timing,
+                tralics_retry=tralics_retry,
+                limits=limits
             )
         with open(done_log_path, 'a') as f:
             f.write('{}\n'.format(tar_fn))
@@ -121,18 +133,70 @@ def prepare(in_dir, out_dir, meta_db, tar_fn_patt, write_logs=False):
     print('{} PDFs'.format(num_pdf_total))
 
 
+def _limit_arg(arg, unit):
+    """ Resource limit given as a command line argument (e.g. --max-
+        memory=2048) in the given unit, None for 0 (unlimited).
+    """
+
+    val = int(arg.split('=', 1)[1])
+    if val <= 0:
+        return None
+    return val * unit
+
+
 if __name__ == '__main__':
-    if len(sys.argv) not in [4, 5]:
+    formula_db = None
+    timing = False
+    tralics_retry = 'end'
+    do_retry_deferred = False
+    # resource limits of tralics and latexpand (0 for unlimited)
+    limits = dict(DEFAULT_LIMITS)
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--formula-db='):
+            formula_db = arg.split('=', 1)[1]
+        elif arg == '--timing':
+            timing = True
+        elif arg.startswith('--tralics-retry='):
+            tralics_retry = arg.split('=', 1)[1]
+        elif arg == '--retry-deferred':
+            do_retry_deferred = True
+        elif arg.startswith('--max-memory='):
+            limits['memory'] = _limit_arg(arg, 2**20)
+        elif arg.startswith('--max-cpu='):
+            limits['cpu'] = _limit_arg(arg, 1)
+        elif arg.startswith('--max-output='):
+            limits['output'] = _limit_arg(arg, 2**20)
+        else:
+            args.append(arg)
+    if do_retry_deferred and len(args) == 2:
+        retry_deferred(
+            args[0], args[1], formula_db_fp=formula_db, timing=timing,
+            limits=limits
+        )
+        sys.exit()
+    if len(args) not in [3, 4] or tralics_retry not in TRALICS_RETRY_MODES:
         print((
             'usage: python3 prepare.py </path/to/in/dir> </path/to/out/dir> '
-            '</path/to/metadata.db> [<tar_fn_patt>]'
+            '</path/to/metadata.db> [<tar_fn_patt>] '
+            '[--formula-db=</path/to/formulae.db>] [--timing] '
+            '[--tralics-retry=end|defer|off] [--max-memory=<MB>] '
+            '[--max-cpu=<s>] [--max-output=<MB>]\n'
+            '       python3 prepare.py --retry-deferred </path/to/out/dir> '
+            '</path/to/metadata.db> [--formula-db=</path/to/formulae.db>] '
+            '[--timing] [--max-memory=<MB>] [--max-cpu=<s>] '
+            '[--max-output=<MB>]'
         ))
         sys.exit()
-    in_dir = sys.argv[1]
-    out_dir_dir = sys.argv[2]
-    meta_db = sys.argv[3]
-    if len(sys.argv) == 5:
-        tar_fn_patt = sys.argv[4]
+    in_dir = args[0]
+    out_dir_dir = args[1]
+    meta_db = args[2]
+    if len(args) == 4:
+        tar_fn_patt = args[3]
     else:
         tar_fn_patt = '.tar'
-    ret = prepare(in_dir, out_dir_dir, meta_db, tar_fn_patt, write_logs=True)
+    ret = prepare(
+        in_dir, out_dir_dir, meta_db, tar_fn_patt, write_logs=True,
+        formula_db=formula_db, timing=timing, tralics_retry=tralics_retry,
+        limits=limits
+    )
@@ -0,0 +1,164 @@
+""" Run external tools (tralics, latexpand) with resource limits, so that
+    a single runaway process can’t take up the memory of the whole
+    machine (and slow down all other workers).
+
+    Limits are set as rlimits of the tool’s process:
+    - memory: address space in bytes (RLIMIT_AS)
+    - cpu: CPU time in seconds (RLIMIT_CPU)
+    - output: size of files written in bytes (RLIMIT_FSIZE)
+
+    where None means unlimited. Runs stopped by a limit are reported as
+    failures of the paper in pipeline logs (see pipeline_log.py), e.g.
+    "tralics_memory_limit", "latexpand_cpu_limit", or
+    "tralics_output_limit". Runs killed for other reasons (e.g. by the
+    OOM killer) are reported as e.g. "tralics_killed".
+
+    Because the output limit applies to every file written by the
+    process, the output of tools should be written to per run files
+    rather than (growing) shared log files.
+
+    Example:
+
+        limits = get_limits(memory=2*2**30)
+        with open(stdout_fp, 'w') as out, open(stderr_fp, 'w') as err:
+            proc = run_limited(
+                ['tralics', ...], limits, stdout=out, stderr=err, timeout=5
+            )
+        failure = get_limit_failure('tralics', proc, limits, stderr_fp)
+        append_output(stdout_fp, log_file)
+"""
+
+import os
+import re
+import resource
+import signal
+import shutil
+import subprocess
+from functools import partial
+
+RESOURCE_LIMITS = {
+    'memory': resource.RLIMIT_AS,
+    'cpu': resource.RLIMIT_CPU,
+    'output': resource.RLIMIT_FSIZE
+}
+DEFAULT_LIMITS = {
+    'memory': 4 * 2**30,
+    'cpu': 600,
+    'output': 2**30
+}
+# messages of processes running out of memory (C++, Perl, Python, libc)
+MEMORY_ERROR_PATT = re.compile(
+    r'(bad_alloc|out of memory|cannot allocate memory|MemoryError)',
+    re.I
+)
+# number of bytes at the end of stderr checked for the above
+STDERR_TAIL_SIZE = 4096
+
+
+def get_limits(
+        memory=DEFAULT_LIMITS['memory'], cpu=DEFAULT_LIMITS['cpu'],
+        output=DEFAULT_LIMITS['output']
+):
+    """ Limits for run_limited. None means unlimited.
+    """
+
+    return {'memory': memory, 'cpu': cpu, 'output': output}
+
+
+def _apply_limits(limits, niceness=None):
+    """ Set the given limits (and niceness) for the current process. Run
+        in the child process before the tool is executed.
+    """
+
+    for name, value in limits.items():
+        if value is None:
+            continue
+        rlimit = RESOURCE_LIMITS[name]
+        soft, hard = resource.getrlimit(rlimit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        if name == 'cpu':
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            new_hard = value + 1
+            if hard != resource.RLIM_INFINITY:
+                new_hard = min(new_hard, hard)
+        else:
+            new_hard = value
+        resource.setrlimit(rlimit, (value, new_hard))
+    if niceness is not None:
+        os.nice(niceness)
+
+
+def run_limited(args, limits, niceness=None, **kwargs):
+    """ subprocess.run with the given limits, and optionally a lowered
+        scheduling priority (niceness), applied to the subprocess.
+
+        The CPU time (user + system, in seconds) used by the subprocess
+        is set as cpu_time of the returned CompletedProcess.
+    """
+
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc = subprocess.run(
+        args,
+        preexec_fn=partial(_apply_limits, limits, niceness),
+        **kwargs
+    )
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc.cpu_time = (
+        (usage_after.ru_utime - usage_before.ru_utime) +
+        (usage_after.ru_stime - usage_before.ru_stime)
+    )
+    return proc
+
+
+def append_output(fp, out):
+    """ Append the contents of the file at fp (output of a tool) to the
+        open file out (e.g. a log file shared by all runs).
+    """
+
+    out.flush()
+    with open(fp, 'rb') as f:
+        shutil.copyfileobj(f, out.buffer)
+    out.buffer.flush()
+
+
+def _read_tail(fp, size=STDERR_TAIL_SIZE):
+    try:
+        with open(fp, 'rb') as f:
+            f.seek(max(0, os.path.getsize(fp) - size))
+            return f.read().decode('utf-8', errors='replace')
+    except OSError:
+        return ''
+
+
+def get_limit_failure(tool, proc, limits, stderr_fp=None):
+    """ Failure reason if a run of the given tool (CompletedProcess of
+        run_limited) was stopped by one of the limits, or killed
+        otherwise, None if not.
+
+        A run killed by SIGKILL counts as stopped by the CPU limit only if
+        it used up the CPU time (SIGKILL is sent one second after
+        SIGXCPU). Running out of memory is detected based on the error
+        message in the tool’s stderr (written to stderr_fp).
+    """
+
+    if proc.returncode == 0:
+        return None
+    # killed by the signal (or, if run through a shell, exit status 128+n)
+    killed = proc.returncode in [-signal.SIGKILL, 128 + signal.SIGKILL]
+    if limits.get('cpu') is not None:
+        if proc.returncode in [-signal.SIGXCPU, 128 + signal.SIGXCPU]:
+            return '{}_cpu_limit'.format(tool)
+        cpu_time = getattr(proc, 'cpu_time', None)
+        if killed and cpu_time is not None and cpu_time >= limits['cpu']:
+            return '{}_cpu_limit'.format(tool)
+    if limits.get('output') is not None and proc.returncode in [
+        -signal.SIGXFSZ, 128 + signal.SIGXFSZ
+    ]:
+        return '{}_output_limit'.format(tool)
+    if limits.get('memory') is not None and stderr_fp is not None and \
+            MEMORY_ERROR_PATT.search(_read_tail(stderr_fp)):
+        return '{}_memory_limit'.format(tool)
+    if killed:
+        return '{}_killed'.format(tool)
+    return None
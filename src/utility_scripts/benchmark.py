@@ -0,0 +1,528 @@
+""" Benchmark the offline processing steps on the data sample shipped with
+    the repository (doc/unarXive_data_sample.tar.gz), to catch performance
+    regressions between releases.
+
+    Stages
+    - xml_processing: post-processing of tralics XML (_process_tralics_xml
+      in parse_latex_tralics.py) on stored tralics outputs (--xml-dir),
+      or on tralics style XML generated from the sample papers if none
+      are given (tralics is not needed either way)
+    - paper_stats, calc_stats: calc_stats.py
+    - prep_para, prep: ml_tasks_prep_data.py
+    - split, split_hashed: ml_tasks_split_data.py (on the output of prep)
+    - filter_permissive: filter_permissively_livensed.py
+    - match: match_references_openalex.py with a stub OpenAlex DB (built
+      from the references in the sample that are linked to OpenAlex),
+      stub GROBID/Crossref responses, and a metadata DB generated from
+      the sample (skipped if the matcher’s dependencies are not
+      installed)
+
+    For each stage the wall clock time of each of --repeat runs, the
+    throughput (papers/sec and MB/sec) of the fastest run, and the peak
+    memory allocated (measured in a separate run using tracemalloc) are
+    reported as JSON. Stages write their outputs to a fresh temporary
+    working directory per run.
+
+    With --compare=<baseline.json> stages that got slower than the
+    baseline by more than --threshold (default 1.2, i.e. 20%) are
+    reported and the script exits with a non-zero status.
+
+    Example:
+
+        python3 benchmark.py --repeat=5 --out=bench.json
+        python3 benchmark.py --compare=bench.json
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from lxml import etree
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+)
+from parse_latex_tralics import _process_tralics_xml  # noqa: E402
+from calc_stats import calc_stats, paper_stats  # noqa: E402
+from ml_tasks_prep_data import prep, prep_para  # noqa: E402
+from ml_tasks_split_data import split, split_hashed  # noqa: E402
+from filter_permissively_livensed import filter_permissive  # noqa: E402
+from generate_metadata_db import gen_meta_db  # noqa: E402
+from unarxive_reader import get_jsonl_fps  # noqa: E402
+
+SAMPLE_FP = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', '..', 'doc', 'unarXive_data_sample.tar.gz'
+)
+STAGES = [
+    'xml_processing', 'paper_stats', 'calc_stats', 'prep_para', 'prep',
+    'split', 'split_hashed', 'filter_permissive', 'match'
+]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.2
+SPLIT_DEV_TEST_SIZE = 50
+SPLIT_DEV_TEST_FRAC = 0.1
+
+
+def _paper_to_tralics_xml(ppr):
+    """ Generate XML as produced by tralics for a paper in the unarXive
+        format, i.e. with sections, paragraphs, formulae, figures, tables,
+        citations, and a bibliography, such that _process_tralics_xml
+        yields (roughly) the paper’s content again.
+    """
+
+    root = etree.Element('std')
+    bib_keys = {}
+    for bib_id in ppr['bib_entries']:
+        bib_keys[bib_id] = 'bid{}'.format(len(bib_keys))
+    sec = None
+    sec_key = None
+    for para in ppr['body_text']:
+        if sec is None or (para['section'], para['sec_number']) != sec_key:
+            sec_key = (para['section'], para['sec_number'])
+            sec = etree.SubElement(root, 'div0')
+            sec.set('id-text', str(para['sec_number']))
+            head = etree.SubElement(sec, 'head')
+            head.text = para['section'] or ''
+        p = etree.SubElement(sec, 'p')
+        spans = sorted(
+            para['cite_spans'] + para['ref_spans'],
+            key=lambda s: s['start']
+        )
+        text = para['text']
+        p.text = text[:spans[0]['start']] if spans else text
+        for i, span in enumerate(spans):
+            end = spans[i+1]['start'] if i+1 < len(spans) else len(text)
+            ref_entry = ppr['ref_entries'].get(span['ref_id'])
+            if span in para['cite_spans']:
+                elem = etree.SubElement(p, 'cit')
+                etree.SubElement(elem, 'ref').set(
+                    'target', bib_keys.get(span['ref_id'], 'bidx')
+                )
+            elif ref_entry is None:
+                elem = etree.SubElement(p, 'ref')
+                elem.set('target', 'uid1')
+            elif ref_entry['type'] == 'formula':
+                elem = etree.SubElement(p, 'formula')
+                etree.SubElement(elem, 'texmath').text = ref_entry.get(
+                    'latex', ''
+                )
+            else:
+                elem = etree.SubElement(p, ref_entry['type'])
+                etree.SubElement(elem, 'head').text = ref_entry['caption']
+            elem.tail = text[span['end']:end]
+    bib = etree.SubElement(root, 'Bibliography')
+    for bib_id, bib_entry in ppr['bib_entries'].items():
+        p = etree.SubElement(bib, 'p')
+        etree.SubElement(p, 'bibitem').set('id', bib_keys[bib_id])
+        p.text = bib_entry['bib_entry_raw']
+        for link in bib_entry['contained_links']:
+            xref = etree.SubElement(p, 'xref')
+            xref.set('url', link['url'])
+            xref.text = link['text'] or ''
+    return etree.tostring(root, encoding='utf-8')
+
+
+def _stub_title(bib_entry_raw):
+    """ Title of a reference as returned by the GROBID stub.
+    """
+
+    return max(bib_entry_raw.split('. '), key=len)
+
+
+def _stub_openalex_db(pprs):
+    """ In memory stand-in for the OpenAlex/Crossref PostgreSQL DB used
+        by match_references_openalex.py. Contains a work for every
+        reference in the given papers linked to OpenAlex.
+    """
+
+    from match_references_openalex import normalize_title
+
+    works = {}
+    for ppr in pprs:
+        for bib_entry in ppr['bib_entries'].values():
+            ids = bib_entry.get('ids', {})
+            if len(ids.get('open_alex_id', '')) == 0:
+                continue
+            norm_title = normalize_title(
+                _stub_title(bib_entry['bib_entry_raw'])
+            )
+            first_author = norm_title.split(' ')[0]
+            works.setdefault(norm_title, []).append((
+                ids['open_alex_id'].split('/')[-1],
+                norm_title,
+                [first_author],
+                len(works),
+                None, None, None,
+                [
+                    ids['open_alex_id'].split('/')[-1],
+                    ids.get('pubmed_id', ''),
+                    ids.get('pmc_id', ''),
+                    ids.get('doi', '')
+                ]
+            ))
+    return {'openalex': works, 'crossref': {}}
+
+
+class _StubCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, query, params):
+        if query.startswith('INSERT INTO crossref'):
+            self.db['crossref'][params[0]] = [params]
+            self.result = []
+        elif 'from crossref' in query:
+            self.result = self.db['crossref'].get(params[0], [])
+        else:
+            self.result = self.db['openalex'].get(params[0], [])
+
+    def fetchall(self):
+        return self.result
+
+
+class _StubConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return _StubCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def prepare_benchmark(sample_fp, work_dir, xml_dir=None):
+    """ Extract the sample and prepare the inputs of all stages.
+    """
+
+    with tarfile.open(sample_fp) as tar:
+        tar.extractall(work_dir)
+    data_dir = os.path.join(work_dir, 'data')
+    os.makedirs(data_dir)
+    for fp in get_jsonl_fps(work_dir):
+        os.rename(fp, os.path.join(data_dir, os.path.basename(fp)))
+    jsonl_fps = get_jsonl_fps(data_dir)
+    pprs = []
+    for fp in jsonl_fps:
+        with open(fp) as f:
+            pprs.extend(json.loads(line) for line in f)
+    bench = {
+        'data_dir': data_dir,
+        'jsonl_fps': jsonl_fps,
+        'jsonl_bytes': sum(os.path.getsize(fp) for fp in jsonl_fps),
+        'pprs': pprs
+    }
+
+    # XML
+    xml_docs = []
+    if xml_dir is not None:
+        for fn in sorted(os.listdir(xml_dir)):
+            if os.path.splitext(fn)[1] != '.xml':
+                continue
+            with open(os.path.join(xml_dir, fn), 'rb') as f:
+                xml_docs.append((os.path.splitext(fn)[0], f.read()))
+    else:
+        for ppr in pprs:
+            xml_docs.append((ppr['paper_id'], _paper_to_tralics_xml(ppr)))
+    bench['xml_docs'] = xml_docs
+
+    # prep output (input for splitting)
+    prep_dir = os.path.join(work_dir, 'prep')
+    os.makedirs(prep_dir)
+    cwd = os.getcwd()
+    os.chdir(prep_dir)
+    try:
+        prep(data_dir, stream=True)
+    finally:
+        os.chdir(cwd)
+    bench['prep_dir'] = prep_dir
+
+    # metadata DB (sample papers and arXiv papers they cite)
+    meta_fp = os.path.join(work_dir, 'meta.jsonl')
+    with open(meta_fp, 'w') as f:
+        for ppr in pprs:
+            f.write(json.dumps(ppr['metadata']) + '\n')
+            for bib_entry in ppr['bib_entries'].values():
+                aid = bib_entry.get('ids', {}).get('arxiv_id', '')
+                if len(aid) > 0:
+                    f.write(json.dumps({
+                        'id': aid,
+                        'title': _stub_title(bib_entry['bib_entry_raw'])
+                    }) + '\n')
+    gen_meta_db(meta_fp)
+    bench['meta_db_fp'] = os.path.join(work_dir, 'meta.sqlite')
+    return bench
+
+
+def bench_xml_processing(bench):
+    num_bytes = 0
+    for aid, xml in bench['xml_docs']:
+        tree = etree.ElementTree(etree.fromstring(xml))
+        _process_tralics_xml(tree, aid, lambda msg: None)
+        num_bytes += len(xml)
+    return len(bench['xml_docs']), num_bytes
+
+
+def bench_paper_stats(bench):
+    for ppr in bench['pprs']:
+        paper_stats(ppr)
+    return len(bench['pprs']), bench['jsonl_bytes']
+
+
+def bench_calc_stats(bench):
+    calc_stats(bench['data_dir'], force_calc=True, save_dir='stats')
+    return len(bench['pprs']), bench['jsonl_bytes']
+
+
+def bench_prep_para(bench):
+    for ppr in bench['pprs']:
+        for para in ppr['body_text']:
+            prep_para(ppr, para)
+    return len(bench['pprs']), bench['jsonl_bytes']
+
+
+def bench_prep(bench):
+    prep(bench['data_dir'], stream=True)
+    return len(bench['pprs']), bench['jsonl_bytes']
+
+
+def _split_inputs(bench):
+    to_split = os.path.join(bench['prep_dir'], 'citrec_data.jsonl')
+    license_info = os.path.join(
+        bench['prep_dir'], 'license_information.json'
+    )
+    with open(to_split) as f:
+        num_pprs = sum(1 for line in f)
+    return to_split, license_info, num_pprs
+
+
+def bench_split(bench):
+    to_split, license_info, num_pprs = _split_inputs(bench)
+    split(to_split, license_info, SPLIT_DEV_TEST_SIZE, None)
+    return num_pprs, os.path.getsize(to_split)
+
+
+def bench_split_hashed(bench):
+    to_split, license_info, num_pprs = _split_inputs(bench)
+    split_hashed(to_split, license_info, SPLIT_DEV_TEST_FRAC, None)
+    return num_pprs, os.path.getsize(to_split)
+
+
+def bench_filter_permissive(bench):
+    os.makedirs('filtered')
+    for fp in bench['jsonl_fps']:
+        filter_permissive(fp, 'filtered')
+    return len(bench['pprs']), bench['jsonl_bytes']
+
+
+def bench_match(bench):
+    import match_references_openalex as matcher
+
+    stub_db = _stub_openalex_db(bench['pprs'])
+    patched = {
+        'find_title_with_grobid_in_string': lambda host, bib_str: (
+            '<biblStruct><title level="a" type="main">{}</title>'
+            '</biblStruct>'
+        ).format(_stub_title(bib_str)),
+        'find_title_in_crossref_by_doi': lambda doi: False
+    }
+    originals = {name: getattr(matcher, name) for name in patched}
+    connect = matcher.psycopg2.connect
+    try:
+        for name, func in patched.items():
+            setattr(matcher, name, func)
+        matcher.psycopg2.connect = lambda **kwargs: _StubConnection(stub_db)
+        out_root = os.path.join(os.getcwd(), 'matched') + '/'
+        for fp in bench['jsonl_fps']:
+            matcher.extend_parsed_arxiv_chunk(
+                (fp, out_root, 'stub', bench['meta_db_fp'], 'stub', False)
+            )
+    finally:
+        for name, func in originals.items():
+            setattr(matcher, name, func)
+        matcher.psycopg2.connect = connect
+    return len(bench['pprs']), bench['jsonl_bytes']
+
+
+def _matcher_available():
+    try:
+        import match_references_openalex  # noqa: F401
+    except ImportError as e:
+        print('skipping match ({})'.format(e))
+        return False
+    return True
+
+
+def _run_in_tmp_cwd(func, bench):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            return func(bench)
+        finally:
+            os.chdir(cwd)
+
+
+def run_stage(stage, bench, repeat=DEFAULT_REPEAT):
+    """ Run a benchmark stage repeat times (plus once for measuring
+        memory) and return its measurements.
+    """
+
+    func = globals()['bench_{}'.format(stage)]
+    seconds = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        num_pprs, num_bytes = _run_in_tmp_cwd(func, bench)
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    _run_in_tmp_cwd(func, bench)
+    peak_mem = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = min(seconds)
+    return OrderedDict([
+        ('papers', num_pprs),
+        ('bytes', num_bytes),
+        ('seconds', seconds),
+        ('best_seconds', best),
+        ('papers_per_sec', num_pprs / best if best > 0 else None),
+        ('mb_per_sec', num_bytes / 2**20 / best if best > 0 else None),
+        ('peak_mem_bytes', peak_mem)
+    ])
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(
+        sample_fp=SAMPLE_FP, stages=STAGES, repeat=DEFAULT_REPEAT,
+        xml_dir=None
+):
+    """ Run the given benchmark stages on the data sample.
+    """
+
+    results = OrderedDict()
+    results['meta'] = OrderedDict([
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('git_commit', _git_commit()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('sample', os.path.basename(sample_fp)),
+        ('xml', 'stored' if xml_dir is not None else 'generated'),
+        ('repeat', repeat)
+    ])
+    results['stages'] = OrderedDict()
+    with tempfile.TemporaryDirectory() as work_dir:
+        print('preparing benchmark data')
+        bench = prepare_benchmark(sample_fp, work_dir, xml_dir)
+        for stage in stages:
+            if stage == 'match' and not _matcher_available():
+                continue
+            print('running {}'.format(stage))
+            results['stages'][stage] = run_stage(stage, bench, repeat)
+    results['meta']['max_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF
+    ).ru_maxrss
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Return the stages (with their slowdown) that are slower than in
+        the baseline by more than the threshold factor.
+    """
+
+    regressions = OrderedDict()
+    for stage, stage_results in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        base_secs = baseline['stages'][stage]['best_seconds']
+        if base_secs <= 0:
+            continue
+        slowdown = stage_results['best_seconds'] / base_secs
+        if slowdown > threshold:
+            regressions[stage] = slowdown
+    return regressions
+
+
+def print_results(results):
+    print('\n{:<20}papers\tbest s\tpapers/s\tMB/s\tpeak MB'.format('stage'))
+    for stage, r in results['stages'].items():
+        print('{:<20}{}\t{:.3f}\t{:.1f}\t\t{:.2f}\t{:.1f}'.format(
+            stage,
+            r['papers'],
+            r['best_seconds'],
+            r['papers_per_sec'] or 0,
+            r['mb_per_sec'] or 0,
+            r['peak_mem_bytes'] / 2**20
+        ))
+
+
+if __name__ == '__main__':
+    opts = {}
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--'):
+            key, _, val = arg[2:].partition('=')
+            opts[key] = val
+        else:
+            args.append(arg)
+    if len(args) > 1 or 'help' in opts:
+        print((
+            'Usage: python3 benchmark.py [<sample.tar.gz>] [--repeat=N] '
+            '[--stages=<stage>,...] [--xml-dir=<tralics_xml_dir>] '
+            '[--out=<results.json>] [--compare=<baseline.json>] '
+            '[--threshold=<factor>]\n\n'
+            'Stages: {}'.format(', '.join(STAGES))
+        ))
+        sys.exit()
+    stages = STAGES
+    if opts.get('stages'):
+        stages = opts['stages'].split(',')
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if len(unknown) > 0:
+            print('unknown stage(s): {}'.format(', '.join(unknown)))
+            sys.exit(1)
+    results = benchmark(
+        sample_fp=args[0] if len(args) > 0 else SAMPLE_FP,
+        stages=stages,
+        repeat=int(opts.get('repeat') or DEFAULT_REPEAT),
+        xml_dir=opts.get('xml-dir') or None
+    )
+    print_results(results)
+    if opts.get('out'):
+        with open(opts['out'], 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if opts.get('compare'):
+        with open(opts['compare']) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results,
+            baseline,
+            float(opts.get('threshold') or DEFAULT_THRESHOLD)
+        )
+        for stage, slowdown in regressions.items():
+            print('regression: {} is {:.2f}x slower than baseline'.format(
+                stage, slowdown
+            ))
+        if len(regressions) > 0:
+            sys.exit(1)
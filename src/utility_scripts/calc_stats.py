@@ -10,33 +10,105 @@
     - figures
     - tables
     - mathematical notation
+
+    For breakdowns along other dimensions (e.g. license × discipline)
+    see stats_cube.py.
 """
 
 import json
 import os
+import struct
 import sys
+import tempfile
+import zipfile
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from collections import defaultdict
+from collections.abc import Mapping
+from functools import lru_cache
+from hashlib import sha1
 from arxiv_taxonomy import GROUPS, ARCHIVES, CATEGORIES
+from unarxive_reader import (
+    get_jsonl_fps, get_paper_month, iter_chunk_papers, map_chunks
+)
+
+# stats taken from paper_stats
+PPR_STATS_KEYS = [
+    'num_cit_markers',
+    'num_cit_markers_linked',
+    'num_refs',
+    'num_refs_linked',
+    'num_paras',
+    'num_para_type_paragraph',
+    'num_para_type_listing',
+    'num_para_type_label',
+    'num_para_type_item',
+    'num_para_type_proof',
+    'num_para_type_pic_put',
+    'num_fig_succs',
+    'num_fig_fails',
+    'num_tbl_succs',
+    'num_tbl_fails',
+    'num_formula_succs',
+    'num_formula_fails'
+]
+# stats only determined during aggregation
+AGGREGATE_ONLY_KEYS = [
+    'num_pprs',
+    'num_license_arxiv_non-exclusive',
+    'num_license_public_domain',
+    'num_license_creative_commons',
+    'num_license_no_license',
+    'num_license_unknown_license'
+]
+STATS_KEYS = PPR_STATS_KEYS + AGGREGATE_ONLY_KEYS
+STATS_KEY_IDX = {k: i for i, k in enumerate(STATS_KEYS)}
+# changed whenever the way papers are counted changes, so that chunk
+# caches of earlier versions are discarded
+STATS_VERSION = 2
+# row vector positions used in paper_stats_row
+PARA_TYPE_STATS_IDX = {
+    'paragraph': STATS_KEY_IDX['num_para_type_paragraph'],
+    'listing': STATS_KEY_IDX['num_para_type_listing'],
+    'label': STATS_KEY_IDX['num_para_type_label'],
+    'item': STATS_KEY_IDX['num_para_type_item'],
+    'proof': STATS_KEY_IDX['num_para_type_proof'],
+    'pic-put': STATS_KEY_IDX['num_para_type_pic_put']
+}
+NON_TEXT_STATS_IDX = {
+    ('figure', True): STATS_KEY_IDX['num_fig_succs'],
+    ('figure', False): STATS_KEY_IDX['num_fig_fails'],
+    ('table', True): STATS_KEY_IDX['num_tbl_succs'],
+    ('table', False): STATS_KEY_IDX['num_tbl_fails'],
+    ('formula', True): STATS_KEY_IDX['num_formula_succs'],
+    ('formula', False): STATS_KEY_IDX['num_formula_fails']
+}
+
+
+def refmatch_rate(root_dir='tmp_foo', until_2020=False, save_fp=None):
+    """ Print (and return) the share of reference entries linked to
+        OpenAlex, answered from the stats cube (see stats_cube.py, which
+        is calculated on first use and persisted in save_fp).
+    """
 
-
-def refmatch_rate(root_dir='tmp_foo', until_2020=False):
-    mtrs, idxs = calc_stats(root_dir)
+    # (stats_cube builds on this module)
+    from stats_cube import get_stats_cube, query_cube
+    cube = get_stats_cube(root_dir, save_fp=save_fp)
     refs_total = 0
     refs_linked_total = 0
-    for year, y_idx in idxs['year_to_idx'].items():
-        val_total = np.sum(mtrs['num_refs'][:, y_idx[0]:y_idx[-1]])
-        val_linked = np.sum(mtrs['num_refs_linked'][:, y_idx[0]:y_idx[-1]])
+    for (year,), sums in query_cube(
+        cube, ['num_refs', 'num_refs_linked'], group_by=['year']
+    ).items():
         if until_2020 and year in ['2021', '2022']:
             print('skipping year {}'.format(year))
             continue
-        refs_total += val_total
-        refs_linked_total += val_linked
+        refs_total += sums['num_refs']
+        refs_linked_total += sums['num_refs_linked']
     print(f'total: {refs_total}')
     print(f'linked: {refs_linked_total}')
     print(refs_linked_total/refs_total)
+    return refs_linked_total/refs_total
 
 
 def get_fine_arxiv_category_name(cat_id):
@@ -124,22 +196,8 @@ def paper_stats(ppr):
 
     stats = {}
 
-    # determine year
-    pid = ppr.get('paper_id')
-    if '/' in pid:
-        # old format ID
-        pref, pid = pid.split('/')
-    if pid[0] == '9':
-        # years 1991–1999
-        year = int('19' + pid[:2])
-    else:
-        # years 2000–2099
-        year = int('20' + pid[:2])
-    month = pid[2:4]
-    stats['month'] = '{}-{}'.format(
-        year,
-        month
-    )
+    # determine month
+    stats['month'] = get_paper_month(ppr.get('paper_id'))
 
     # determine categories
     main_fine_cat = None
@@ -148,7 +206,7 @@ def paper_stats(ppr):
     coarse_cats = []
     fine_cat_ids = [
         c for c
-        in ppr.get('metadata', {}).get('categories', '').split(' ')
+        in (ppr.get('metadata', {}).get('categories') or '').split(' ')
         if len(c) > 0  # filter when categories is ''
     ]
     for fine_cat_id in fine_cat_ids:
@@ -170,105 +228,111 @@ def paper_stats(ppr):
     stats['license_url'] = ppr.get('metadata', {}).get('license', None)
 
     # full text based stats
-    num_paras = 0
-    num_para_types = defaultdict(int)  # nice for manual work
-    num_para_type_paragraph = 0  # v easier to aggregate
-    num_para_type_listing = 0
-    num_para_type_label = 0
-    num_para_type_item = 0
-    num_para_type_proof = 0
-    num_para_type_pic_put = 0  # ^ easier to aggregate
-    num_cit_markers = 0
-    num_cit_markers_linked = 0
-    num_refs = 0
-    num_refs_linked = 0
-    num_non_text_types = defaultdict(int)
-    num_non_text_success = defaultdict(dict)
+    row = [0] * len(STATS_KEYS)
+    details = {
+        'num_para_types': defaultdict(int),  # nice for manual work
+        'num_non_text_types': defaultdict(int),
+        'num_non_text_success': defaultdict(dict)
+    }
+    paper_stats_row(ppr, row, details)
+    for key in PPR_STATS_KEYS:
+        stats[key] = row[STATS_KEY_IDX[key]]
+    for nt_type in ['figure', 'table', 'formula']:
+        details['num_non_text_success'].setdefault(nt_type, {})
+    stats.update(details)
+
+    return stats
+
+
+def paper_stats_row(ppr, row, details=None):
+    """ Writes the counts of a paper into row, a vector indexed like
+        STATS_KEYS (including num_pprs and the paper’s license count), and
+        returns the paper’s main fine category and month.
+
+        If details is given, counts of all paragraph types and of non-text
+        elements by type are additionally collected in it (see
+        paper_stats).
+    """
+
+    counts = [0] * len(STATS_KEYS)
+    counts[STATS_KEY_IDX['num_pprs']] = 1
+    counts[get_license_stats_idx(
+        ppr.get('metadata', {}).get('license', None)
+    )] = 1
     # reference section entries
-    for ref in ppr['bib_entries'].values():
-        # count reference section entries separately, because a single
-        # entry can appear in multiple paragraphs
-        num_refs += 1
-        open_alex_id = get_open_alex_id_from_ref(ref)
-        if open_alex_id is not None:
-            num_refs_linked += 1
-    stats['num_refs'] = num_refs
-    stats['num_refs_linked'] = num_refs_linked
+    # (counted separately, because a single entry can appear in multiple
+    # paragraphs)
+    linked_ref_ids = set()
+    for ref_id, ref in ppr['bib_entries'].items():
+        if get_open_alex_id_from_ref(ref) is not None:
+            linked_ref_ids.add(ref_id)
+    counts[STATS_KEY_IDX['num_refs']] = len(ppr['bib_entries'])
+    counts[STATS_KEY_IDX['num_refs_linked']] = len(linked_ref_ids)
     # paragraphs and in-text citations
-    for para in ppr.get('body_text', []):
-        num_paras += 1
-        num_para_types[para['content_type']] += 1
-        if para['content_type'] == 'paragraph':
-            num_para_type_paragraph += 1
-        elif para['content_type'] == 'listing':
-            num_para_type_listing += 1
-        elif para['content_type'] == 'label':
-            num_para_type_label += 1
-        elif para['content_type'] == 'item':
-            num_para_type_item += 1
-        elif para['content_type'] == 'proof':
-            num_para_type_proof += 1
-        elif para['content_type'] == 'pic-put':
-            num_para_type_pic_put += 1
+    num_cit_markers = 0
+    num_cit_markers_linked = 0
+    body_text = ppr.get('body_text', [])
+    for para in body_text:
+        type_idx = PARA_TYPE_STATS_IDX.get(para['content_type'])
+        if type_idx is not None:
+            counts[type_idx] += 1
+        if details is not None:
+            details['num_para_types'][para['content_type']] += 1
+        # each cite span is one marker
+        # (earlier versions counted all markers of a span’s reference in
+        # the paragraph for each span, i.e. k² for a reference cited k
+        # times)
+        num_cit_markers += len(para['cite_spans'])
         for cit in para['cite_spans']:
-            # for each reference
-            ref_id = cit['ref_id']
-            num_mrkrs = para['text'].count(ref_id)
-            num_cit_markers += num_mrkrs
-            ref = ppr['bib_entries'].get(
-                ref_id, {}
-            )
-            open_alex_id = get_open_alex_id_from_ref(ref)
-            if open_alex_id is not None:
-                num_cit_markers_linked += num_mrkrs
-    stats['num_paras'] = num_paras
-    stats['num_para_type_paragraph'] = num_para_type_paragraph
-    stats['num_para_type_listing'] = num_para_type_listing
-    stats['num_para_type_label'] = num_para_type_label
-    stats['num_para_type_item'] = num_para_type_item
-    stats['num_para_type_proof'] = num_para_type_proof
-    stats['num_para_type_pic_put'] = num_para_type_pic_put
-    stats['num_para_types'] = num_para_types
-    stats['num_cit_markers'] = num_cit_markers
-    stats['num_cit_markers_linked'] = num_cit_markers_linked
+            if cit['ref_id'] in linked_ref_ids:
+                num_cit_markers_linked += 1
+    counts[STATS_KEY_IDX['num_paras']] = len(body_text)
+    counts[STATS_KEY_IDX['num_cit_markers']] = num_cit_markers
+    counts[STATS_KEY_IDX['num_cit_markers_linked']] = num_cit_markers_linked
     # formulae, tables, figures
     for non_text in ppr['ref_entries'].values():
         nt_type = non_text['type']
         if nt_type == 'formula':
-            content = non_text['latex']
+            # interned formulae (see parse_latex_tralics.py) only come
+            # with a hash of their LaTeX
+            content = non_text.get('latex', non_text.get('latex_hash'))
         else:
             content = non_text['caption']
-        for succ in ['fail', 'success']:
-            if succ not in num_non_text_success[nt_type]:
-                num_non_text_success[nt_type][succ] = 0
-        if content[:3] == 'NO_':
-            # NO_CAPTION / NO_LATEX_CONTENT
-            num_non_text_success[nt_type]['fail'] += 1
-        else:
-            num_non_text_types[nt_type] += 1
-            num_non_text_success[nt_type]['success'] += 1
-    stats['num_non_text_types'] = num_non_text_types
-    stats['num_non_text_success'] = num_non_text_success
-    stats['num_fig_succs'] = num_non_text_success['figure'].get(
-        'success', 0
-    )
-    stats['num_fig_fails'] = num_non_text_success['figure'].get(
-        'fail', 0
-    )
-    stats['num_tbl_succs'] = num_non_text_success['table'].get(
-        'success', 0
-    )
-    stats['num_tbl_fails'] = num_non_text_success['table'].get(
-        'fail', 0
-    )
-    stats['num_formula_succs'] = num_non_text_success['formula'].get(
-        'success', 0
-    )
-    stats['num_formula_fails'] = num_non_text_success['formula'].get(
-        'fail', 0
-    )
+        # NO_CAPTION / NO_LATEX_CONTENT
+        success = content[:3] != 'NO_'
+        nt_idx = NON_TEXT_STATS_IDX.get((nt_type, success))
+        if nt_idx is not None:
+            counts[nt_idx] += 1
+        if details is not None:
+            nt_success = details['num_non_text_success'][nt_type]
+            nt_success.setdefault('fail', 0)
+            nt_success.setdefault('success', 0)
+            if success:
+                details['num_non_text_types'][nt_type] += 1
+                nt_success['success'] += 1
+            else:
+                nt_success['fail'] += 1
+    row[:] = counts
 
-    return stats
+    main_fine_cat = None
+    for fine_cat_id in (
+        ppr.get('metadata', {}).get('categories') or ''
+    ).split(' '):
+        if len(fine_cat_id) > 0:
+            main_fine_cat = fine_cat_id
+            break
+    return main_fine_cat, get_paper_month(ppr.get('paper_id'))
+
+
+@lru_cache(maxsize=None)
+def get_license_stats_idx(license_url):
+    """ Position of the num_license_* stat of a license in STATS_KEYS.
+    """
+
+    license_stats_key = 'num_license_{}'.format(
+        get_license_coarse_name(license_url).replace(' ', '_').lower()
+    )
+    return STATS_KEY_IDX[license_stats_key]
 
 
 def get_stats_matrix_indices(max_year=2022):
@@ -324,7 +388,8 @@ def get_empty_stats_matrix(indices):
         (
             len(indices['cat_to_idx']),
             len(indices['mon_to_idx'])
-        )
+        ),
+        dtype=np.int64
     )
     return stats_matrx
 
@@ -484,7 +549,10 @@ def demoplot(
     fig.savefig('/tmp/demoax.pdf')
 
 
-def calc_stats(root_dir, force_calc=False, save_dir=None):
+def calc_stats(
+        root_dir, force_calc=False, save_dir=None, num_workers=1,
+        incremental=False, verify_hash=False
+):
     """ Calculates a range of stats, each stored in a matrix of dimensions
             num_categories × num_months
         where consecutive sections of rows/columns are category groups/years.
@@ -505,100 +573,299 @@ def calc_stats(root_dir, force_calc=False, save_dir=None):
         For each statistical value (num papers, num references, etc.) one
         such matrix is created.
 
+        With num_workers > 1, JSONL chunks are processed in a process pool
+        (map), each worker persisting the partial matrices of its chunk in
+        a temporary stats archive, which are then summed up (reduce).
+
+        With incremental=True, the partial matrices of each chunk are kept
+        in a chunk cache (see update_chunk_cache) and only chunks that were
+        added or changed since the last run are processed.
+
         Returns
             stats matrices
             stats matrix indices
     """
 
     # use pre-calculated stats if possible
-    if not force_calc:
+    # (in incremental mode the chunk cache takes care of that)
+    if not force_calc and not incremental:
         precalc_stats = load_from_disk(save_dir)
         if precalc_stats is not None:
             stats_matrix_dict, stats_matrix_indices = precalc_stats
             return stats_matrix_dict, stats_matrix_indices
 
     # set up stats data structure
-    ppr_stats_keys = [
-        'num_cit_markers',
-        'num_cit_markers_linked',
-        'num_refs',
-        'num_refs_linked',
-        'num_paras',
-        'num_para_type_paragraph',
-        'num_para_type_listing',
-        'num_para_type_label',
-        'num_para_type_item',
-        'num_para_type_proof',
-        'num_para_type_pic_put',
-        'num_fig_succs',
-        'num_fig_fails',
-        'num_tbl_succs',
-        'num_tbl_fails',
-        'num_formula_succs',
-        'num_formula_fails'
-    ]
     stats_matrix_indices = get_stats_matrix_indices()
-    stats_matrix_dict = {}
-    aggregrate_only_keys = [
-        'num_pprs',
-        'num_license_arxiv_non-exclusive',
-        'num_license_public_domain',
-        'num_license_creative_commons',
-        'num_license_no_license',
-        'num_license_unknown_license'
-    ]
-    for k in ppr_stats_keys + aggregrate_only_keys:
-        stats_matrix_dict[k] = get_empty_stats_matrix(stats_matrix_indices)
+    stats_matrix_dict = get_empty_stats_matrix_dict(stats_matrix_indices)
 
     # go through JSONLs
-    jsonl_fps = []
-    for path_to_file, subdirs, files in os.walk(root_dir):
-        for fn in files:
-            fn_base, ext = os.path.splitext(fn)
-            if ext == '.jsonl':
-                fp = os.path.join(path_to_file, fn)
-                if os.path.getsize(fp) > 0:
-                    jsonl_fps.append(fp)
+    jsonl_fps = get_jsonl_fps(root_dir)
     print('found {} JSONLs to parse'.format(len(jsonl_fps)))
-    for fp in jsonl_fps:
-        with open(fp) as f:
-            for i, line in enumerate(f):
-                ppr = json.loads(line)
-                ppr_stats = paper_stats(ppr)
-                # get stats matrix indices
-                cat = ppr_stats['main_fine_cat']
-                mon = ppr_stats['month']
-                try:
-                    cat_m_idx = stats_matrix_indices['cat_to_idx'][cat]
-                except KeyError:
-                    print(
-                        'main_fine_cat of {} is {}. skipping'.format(
-                            ppr['paper_id'], cat
-                        )
-                    )
-                    continue
-                    mon_m_idx = stats_matrix_indices['mon_to_idx'][mon]
-                # add to ppr count
-                stats_matrix_dict['num_pprs'][cat_m_idx][mon_m_idx] += 1
-                # add license counts
-                license_stats_key = 'num_license_{}'.format(
-                    get_license_coarse_name(
-                        ppr_stats['license_url']
-                    ).replace(' ', '_').lower()
-                )
-                stats_matrix_dict[license_stats_key][cat_m_idx][mon_m_idx] += 1
-                # add to other keys
-                for stats_key in ppr_stats_keys:
-                    stats_matrix_dict[
-                        stats_key
-                    ][cat_m_idx][mon_m_idx] += ppr_stats[stats_key]
+    if incremental:
+        partial_fps = update_chunk_cache(
+            root_dir,
+            jsonl_fps,
+            get_chunk_cache_dir(save_dir),
+            stats_matrix_indices,
+            num_workers,
+            verify_hash
+        )
+        for partial_fp in partial_fps:
+            add_partial_stats(stats_matrix_dict, partial_fp)
+    elif num_workers <= 1:
+        for fp in jsonl_fps:
+            chunk_matrix_dict = chunk_stats(fp, stats_matrix_indices)
+            for k, mtrx in chunk_matrix_dict.items():
+                stats_matrix_dict[k] += mtrx
+    else:
+        with tempfile.TemporaryDirectory() as partial_dir:
+            worker_params = [
+                (fp, os.path.join(partial_dir, '{}.npz'.format(i)))
+                for i, fp in enumerate(jsonl_fps)
+            ]
+            for partial_fp in map_chunks(
+                _chunk_stats_to_archive,
+                worker_params,
+                num_workers=num_workers,
+                ordered=False
+            ):
+                add_partial_stats(stats_matrix_dict, partial_fp)
+                os.remove(partial_fp)
 
     # save to disk for re-use
-    save_to_disk(stats_matrix_dict, stats_matrix_indices)
+    save_to_disk(stats_matrix_dict, stats_matrix_indices, save_dir)
 
     return stats_matrix_dict, stats_matrix_indices
 
 
+def get_empty_stats_matrix_dict(indices):
+    """ Create a zero filled stats matrix for every key in STATS_KEYS.
+    """
+
+    stats_matrix_dict = {}
+    for k in STATS_KEYS:
+        stats_matrix_dict[k] = get_empty_stats_matrix(indices)
+    return stats_matrix_dict
+
+
+def chunk_stats(fp, stats_matrix_indices):
+    """ Calculate the stats matrices for the papers of a single JSONL.
+
+        Per paper stats are collected as rows of a preallocated array and
+        then scattered into the matrices with a single np.add.at.
+    """
+
+    num_stats = len(STATS_KEYS)
+    ppr_rows = np.zeros((1024, num_stats), dtype=np.int64)
+    cat_m_idxs = np.zeros(1024, dtype=np.intp)
+    mon_m_idxs = np.zeros(1024, dtype=np.intp)
+    num_pprs = 0
+    for ppr in iter_chunk_papers(fp):
+        if num_pprs == ppr_rows.shape[0]:
+            # grow buffers
+            ppr_rows = np.concatenate([ppr_rows, np.zeros_like(ppr_rows)])
+            cat_m_idxs = np.concatenate([cat_m_idxs, cat_m_idxs])
+            mon_m_idxs = np.concatenate([mon_m_idxs, mon_m_idxs])
+        cat, mon = paper_stats_row(ppr, ppr_rows[num_pprs])
+        # get stats matrix indices
+        try:
+            cat_m_idxs[num_pprs] = stats_matrix_indices['cat_to_idx'][cat]
+            mon_m_idxs[num_pprs] = stats_matrix_indices['mon_to_idx'][mon]
+        except KeyError:
+            print(
+                'main_fine_cat/month of {} is {}/{}. skipping'.format(
+                    ppr['paper_id'], cat, mon
+                )
+            )
+            continue
+        num_pprs += 1
+
+    stats_mtrxs = np.zeros(
+        (
+            num_stats,
+            len(stats_matrix_indices['cat_to_idx']),
+            len(stats_matrix_indices['mon_to_idx'])
+        ),
+        dtype=np.int64
+    )
+    np.add.at(
+        stats_mtrxs,
+        (slice(None), cat_m_idxs[:num_pprs], mon_m_idxs[:num_pprs]),
+        ppr_rows[:num_pprs].T
+    )
+    stats_matrix_dict = {}
+    for i, k in enumerate(STATS_KEYS):
+        stats_matrix_dict[k] = stats_mtrxs[i]
+    return stats_matrix_dict
+
+
+def add_partial_stats(stats_matrix_dict, partial_fp):
+    """ Add partial stats matrices persisted by _chunk_stats_to_archive.
+    """
+
+    with np.load(partial_fp) as partial:
+        for k in STATS_KEYS:
+            rows = partial[k + '.rows']
+            cols = partial[k + '.cols']
+            stats_matrix_dict[k][rows, cols] += partial[k + '.vals']
+
+
+def get_chunk_cache_dir(save_dir=None):
+    if save_dir is None:
+        save_dir = get_save_dir()
+    return os.path.join(save_dir, 'chunks')
+
+
+def get_chunk_manifest_fn():
+    return 'manifest.json'
+
+
+def get_chunk_signature(fp, with_hash=False):
+    """ Get size, modification time, and optionally the SHA1 hash of
+        a JSONL chunk to determine if it changed between runs.
+    """
+
+    stat = os.stat(fp)
+    signature = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'sha1': None
+    }
+    if with_hash:
+        hasher = sha1()
+        with open(fp, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                hasher.update(block)
+        signature['sha1'] = hasher.hexdigest()
+    return signature
+
+
+def chunk_unchanged(cached, current, fp):
+    """ Compare a cached chunk signature against the current file.
+
+        If the cached signature has a hash, a chunk with the same size
+        but a different mtime (e.g. because it was copied) still counts
+        as unchanged if its content hash is the same.
+    """
+
+    if cached['size'] != current['size']:
+        return False
+    if cached['mtime'] == current['mtime']:
+        return True
+    if cached.get('sha1') is not None:
+        return get_chunk_signature(fp, True)['sha1'] == cached['sha1']
+    return False
+
+
+def update_chunk_cache(
+        root_dir, jsonl_fps, cache_dir, stats_matrix_indices,
+        num_workers=1, verify_hash=False
+):
+    """ Bring the per-chunk stats cache in cache_dir up to date with the
+        given JSONL chunks and return the paths of the partial stats of all
+        current chunks.
+
+        The cache manifest holds the signature (size, mtime, optional SHA1)
+        of each chunk at the time its partial stats were calculated. Only
+        new or changed chunks are (re-)processed, partial stats of chunks
+        that no longer exist are removed.
+    """
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    manifest_fp = os.path.join(cache_dir, get_chunk_manifest_fn())
+    shape = [
+        len(STATS_KEYS),
+        len(stats_matrix_indices['cat_to_idx']),
+        len(stats_matrix_indices['mon_to_idx'])
+    ]
+    manifest = {
+        'shape': shape,
+        'format': 'npz',
+        'version': STATS_VERSION,
+        'chunks': {}
+    }
+    if os.path.isfile(manifest_fp):
+        with open(manifest_fp) as f:
+            prev_manifest = json.load(f)
+        if prev_manifest['shape'] == shape and \
+                prev_manifest.get('format') == manifest['format'] and \
+                prev_manifest.get('version') == manifest['version']:
+            manifest = prev_manifest
+        else:
+            print(
+                'stats dimensions/format/version changed. '
+                'discarding chunk cache'
+            )
+            for cached in prev_manifest['chunks'].values():
+                partial_fp = os.path.join(cache_dir, cached['partial_fn'])
+                if os.path.isfile(partial_fp):
+                    os.remove(partial_fp)
+
+    cached_chunks = manifest['chunks']
+    current_chunks = {}
+    worker_params = []
+    for fp in jsonl_fps:
+        rel_fp = os.path.relpath(fp, root_dir)
+        partial_fn = '{}{}npz'.format(
+            sha1(rel_fp.encode('utf-8')).hexdigest(),
+            os.path.extsep
+        )
+        partial_fp = os.path.join(cache_dir, partial_fn)
+        signature = get_chunk_signature(fp)
+        cached = cached_chunks.get(rel_fp)
+        if cached is not None and os.path.isfile(partial_fp) and \
+                chunk_unchanged(cached, signature, fp):
+            signature['sha1'] = cached.get('sha1')
+        else:
+            if verify_hash:
+                signature = get_chunk_signature(fp, True)
+            worker_params.append((fp, partial_fp))
+        signature['partial_fn'] = partial_fn
+        current_chunks[rel_fp] = signature
+    print('{} of {} chunks new or changed'.format(
+        len(worker_params), len(jsonl_fps)
+    ))
+
+    # (re-)calculate partial stats
+    for i, partial_fp in enumerate(map_chunks(
+        _chunk_stats_to_archive,
+        worker_params,
+        num_workers=num_workers,
+        ordered=False
+    )):
+        print('{}/{}'.format(i+1, len(worker_params)))
+
+    # clean up cache entries of removed chunks
+    for rel_fp, cached in cached_chunks.items():
+        if rel_fp not in current_chunks:
+            partial_fp = os.path.join(cache_dir, cached['partial_fn'])
+            if os.path.isfile(partial_fp):
+                os.remove(partial_fp)
+
+    manifest['chunks'] = current_chunks
+    with open(manifest_fp, 'w') as f:
+        json.dump(manifest, f)
+
+    return [
+        os.path.join(cache_dir, c['partial_fn'])
+        for c in current_chunks.values()
+    ]
+
+
+def _chunk_stats_to_archive(params):
+    """ Worker function for parallel stats calculation. Persists the
+        (sparse) stats matrices of one chunk.
+    """
+
+    fp, partial_fp = params
+    save_stats_archive(
+        partial_fp,
+        chunk_stats(fp, get_stats_matrix_indices())
+    )
+    return partial_fp
+
+
 def get_save_dir():
     return 'stats'
 
@@ -611,51 +878,175 @@ def get_save_index_prefix():
     return 'stats_idx'
 
 
-def get_stats_matrix_fn(dict_key):
-    fn = '{}{}{}npy'.format(
-        get_save_matrix_prefix(),
-        dict_key,
-        os.path.extsep
-    )
-    return fn
+def get_stats_archive_fn():
+    return 'stats{}npz'.format(os.path.extsep)
+
 
+def save_stats_archive(
+        fp, stats_matrix_dict, stats_matrix_indices=None, sparse=True
+):
+    """ Save stats matrices, and optionally their indices, in a single
+        uncompressed .npz archive, so that LazyStatsMatrices can memory-map
+        its arrays.
+
+        With sparse=True (default), each matrix is stored as COO triplets
+        <key>.rows, <key>.cols, <key>.vals of its non-zero cells, which for
+        the mostly empty category × month matrices is much smaller than
+        the dense representation.
+    """
+
+    arrays = {}
+    for k, mtrx in stats_matrix_dict.items():
+        if sparse:
+            rows, cols = np.nonzero(mtrx)
+            arrays[k + '.rows'] = rows.astype(np.uint16)
+            arrays[k + '.cols'] = cols.astype(np.uint16)
+            arrays[k + '.vals'] = mtrx[rows, cols]
+            arrays[k + '.shape'] = np.array(mtrx.shape)
+        else:
+            arrays[k] = mtrx
+    if stats_matrix_indices is not None:
+        arrays['_indices'] = np.array(json.dumps(stats_matrix_indices))
+    np.savez(fp, **arrays)
 
-def get_stats_index_fn(dict_key):
-    fn = '{}{}{}json'.format(
-        get_save_index_prefix(),
-        dict_key,
-        os.path.extsep
+
+def memmap_npz_member(fp, zip_info):
+    """ Memory-map an array stored uncompressed in an .npz archive.
+
+        Returns None if the array can’t be mapped (compressed members,
+        e.g. of archives written by earlier versions, and object arrays).
+    """
+
+    if zip_info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(fp, 'rb') as f:
+        # skip the member’s local file header (30 bytes + name + extra)
+        f.seek(zip_info.header_offset)
+        local_header = f.read(30)
+        name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+        f.seek(zip_info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            header = np.lib.format.read_array_header_2_0(f)
+        else:
+            return None
+        offset = f.tell()
+    shape, fortran_order, dtype = header
+    if dtype.hasobject:
+        return None
+    if 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+        fp, dtype=dtype, mode='r', offset=offset, shape=shape,
+        order='F' if fortran_order else 'C'
     )
-    return fn
 
 
-def save_to_disk(stats_matrix_dict, stats_matrix_indices):
+class LazyStatsMatrices(Mapping):
+    """ Read-only mapping from stat keys to stats matrices of a stats
+        archive. Matrices are only read (and densified) on first access,
+        so that e.g. a plot only loads the stats it needs. Arrays stored
+        uncompressed are memory-mapped rather than read.
+
+        The stats matrix indices saved in the archive are available as
+        attribute indices (None if not saved). Use close() or a with
+        statement to close the archive; matrices accessed before remain
+        usable.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._npz = np.load(fp)
+        self.indices = None
+        if '_indices' in self._npz.files:
+            self.indices = json.loads(str(self._npz['_indices']))
+        self._keys = []
+        for name in self._npz.files:
+            k = name.rsplit('.', 1)[0] if name.endswith(
+                ('.rows', '.cols', '.vals', '.shape')
+            ) else name
+            if k[0] != '_' and k not in self._keys:
+                self._keys.append(k)
+        self._loaded = {}
+
+    def _get_array(self, name):
+        arr = memmap_npz_member(
+            self.fp, self._npz.zip.getinfo(name + '.npy')
+        )
+        if arr is None:
+            arr = self._npz[name]
+        return arr
+
+    def __getitem__(self, k):
+        if k not in self._loaded:
+            if k in self._npz.files:
+                self._loaded[k] = self._get_array(k)
+            elif k + '.vals' in self._npz.files:
+                mtrx = np.zeros(
+                    self._get_array(k + '.shape'), dtype=np.int64
+                )
+                mtrx[
+                    self._get_array(k + '.rows'),
+                    self._get_array(k + '.cols')
+                ] = self._get_array(k + '.vals')
+                self._loaded[k] = mtrx
+            else:
+                raise KeyError(k)
+        return self._loaded[k]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_stats_archive(fp):
+    """ Load a stats archive saved with save_stats_archive.
+
+        Returns
+            stats matrices (lazily loaded, see LazyStatsMatrices)
+            stats matrix indices (None if not saved in the archive)
+    """
+
+    stats_matrices = LazyStatsMatrices(fp)
+    return stats_matrices, stats_matrices.indices
+
+
+def save_to_disk(stats_matrix_dict, stats_matrix_indices, save_dir=None):
     """ Save stats to disk.
     """
 
-    save_dir = get_save_dir()
+    if save_dir is None:
+        save_dir = get_save_dir()
 
     print('persisting stats in `{}`'.format(save_dir))
 
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
 
-    # persist matrices
-    for dict_key, np_arr in stats_matrix_dict.items():
-        fn = get_stats_matrix_fn(dict_key)
-        fp = os.path.join(save_dir, fn)
-        np.save(fp, np_arr)
-
-    # persist indices
-    for dict_key, index_dict in stats_matrix_indices.items():
-        fn = get_stats_index_fn(dict_key)
-        fp = os.path.join(save_dir, fn)
-        with open(fp, 'w') as f:
-            json.dump(index_dict, f)
+    # persist matrices and indices in a single archive
+    fp = os.path.join(save_dir, get_stats_archive_fn())
+    save_stats_archive(fp, stats_matrix_dict, stats_matrix_indices)
 
 
 def load_from_disk(save_dir=None):
     """ Load stats from disk if previously persisted.
+
+        Stats matrices are loaded lazily from the stats archive. Stats
+        persisted as one .npy/.json per matrix/index by earlier versions
+        are loaded as well.
     """
 
     stats_matrix_dict = {}
@@ -666,6 +1057,9 @@ def load_from_disk(save_dir=None):
     if not os.path.exists(save_dir):
         return None
     print('loading previously persisted stats from disk')
+    archive_fp = os.path.join(save_dir, get_stats_archive_fn())
+    if os.path.isfile(archive_fp):
+        return load_stats_archive(archive_fp)
     for fn in os.listdir(save_dir):
         fp = os.path.join(save_dir, fn)
         fn_base, ext = os.path.splitext(fn)
@@ -682,6 +1076,8 @@ def load_from_disk(save_dir=None):
             )
             with open(fp) as f:
                 stats_matrix_indices[dict_key] = json.load(f)
+    if len(stats_matrix_dict) == 0:
+        return None
 
     return stats_matrix_dict, stats_matrix_indices
 
@@ -689,8 +1085,18 @@ def load_from_disk(save_dir=None):
 if __name__ == '__main__':
     if len(sys.argv) == 1:
         livetest()
-    if len(sys.argv) != 2:
-        print('Usage: calc_stats.py </path/to/data>')
+    incremental = '--incremental' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--incremental']
+    if len(args) not in [1, 2]:
+        print(
+            'Usage: calc_stats.py </path/to/data> [num_workers] '
+            '[--incremental]'
+        )
         sys.exit()
-    root_dir = sys.argv[1]
-    mtrs, idxs = calc_stats(root_dir)
+    root_dir = args[0]
+    num_workers = 1
+    if len(args) == 2:
+        num_workers = int(args[1])
+    mtrs, idxs = calc_stats(
+        root_dir, num_workers=num_workers, incremental=incremental
+    )
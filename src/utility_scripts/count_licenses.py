@@ -1,15 +1,15 @@
 import json
-import os
 import sys
 from collections import defaultdict
+from unarxive_reader import get_jsonl_fps, get_license_from_line
 
 
 def license_counts_from_json(fp):
     license_counts = defaultdict(int)
     with open(fp) as f:
         for line in f:
-            ppr = json.loads(line.strip())
-            license = ppr.get('metadata', {}).get('license')
+            # only decode metadata, not the full paper
+            license = get_license_from_line(line)
             license_counts[license] += 1
     return license_counts
 
@@ -17,13 +17,9 @@ def license_counts_from_json(fp):
 def main(root_dir):
     license_counts = defaultdict(int)
 
-    for sub_dir, dirs, files in os.walk(root_dir):
-        for fn in files:
-            if os.path.splitext(fn)[-1] != '.jsonl':
-                continue
-            fp = os.path.join(sub_dir, fn)
-            for license, count in license_counts_from_json(fp).items():
-                license_counts[license] += count
+    for fp in get_jsonl_fps(root_dir):
+        for license, count in license_counts_from_json(fp).items():
+            license_counts[license] += count
     with open('license_counts.json', 'w') as f:
         json.dump(license_counts, f)
     for license, count in license_counts.items():
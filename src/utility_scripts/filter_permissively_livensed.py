@@ -8,10 +8,12 @@
     such that the final data set can be shared as CC-BY-SA.
 """
 
-import json
+import contextlib
 import os
 import sys
 from collections import defaultdict
+from functools import partial
+from unarxive_reader import get_jsonl_fps, get_license_from_line, map_chunks
 
 
 def is_permissive(license_url):
@@ -34,40 +36,58 @@ def is_permissive(license_url):
     return True
 
 
-def filter_permissive(fp_full, out_dir):
+def filter_permissive(fp_full, out_dir, root_dir=None):
     """ Filter a single JSONL
+
+        Lines of permissively licensed papers are copied to the output
+        as is, i.e. without decoding and re-encoding the papers. If
+        root_dir is given, the output is placed at the JSONL’s path
+        relative to root_dir within out_dir (so that chunks of the same
+        name in different directories don’t overwrite each other).
     """
 
     # filter and count
     license_counts = defaultdict(int)
-    permissive_pprs = []
     full_ppr_count = 0
-    with open(fp_full) as f:
-        for line in f:
-            ppr = json.loads(line.strip())
-            full_ppr_count += 1
-            # count
-            license_url = ppr.get('metadata', {}).get('license')
-            license_counts[license_url] += 1
-            # filter
-            if is_permissive(license_url):
-                permissive_pprs.append(ppr)
-
-    fn = os.path.split(fp_full)[-1]
+    permissive_ppr_count = 0
+    if root_dir is None:
+        fn = os.path.split(fp_full)[-1]
+    else:
+        fn = os.path.relpath(fp_full, root_dir)
     fp_filtered = os.path.join(out_dir, fn)
-    if len(permissive_pprs) > 0:
-        # save to disk
-        with open(fp_filtered, 'w') as f:
-            for ppr in permissive_pprs:
-                f.write('{}\n'.format(json.dumps(ppr)))
+    out_f = None
+    try:
+        with contextlib.ExitStack() as stack:
+            f = stack.enter_context(open(fp_full, 'rb'))
+            for line in f:
+                full_ppr_count += 1
+                # count (only decoding metadata)
+                license_url = get_license_from_line(line)
+                license_counts[license_url] += 1
+                # filter
+                if is_permissive(license_url):
+                    if out_f is None:
+                        # only create output file if there is something
+                        # to save
+                        os.makedirs(
+                            os.path.dirname(fp_filtered), exist_ok=True
+                        )
+                        out_f = stack.enter_context(open(fp_filtered, 'wb'))
+                    out_f.write(line)
+                    permissive_ppr_count += 1
+    except BaseException:
+        # don’t leave a partially written output behind
+        if out_f is not None:
+            os.remove(fp_filtered)
+        raise
 
     # report
-    print(f'[ {fn} ]   {full_ppr_count} -> {len(permissive_pprs)}')
+    print(f'[ {fn} ]   {full_ppr_count} -> {permissive_ppr_count}')
 
     return license_counts
 
 
-def main(root_dir):
+def main(root_dir, num_workers=1):
     # ensure output dir
     out_dir = os.path.join(
         root_dir,
@@ -76,17 +96,17 @@ def main(root_dir):
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
 
-    # filter
+    # filter (chunks in parallel if num_workers > 1)
+    jsonl_fps = [fp for fp in get_jsonl_fps(root_dir) if out_dir not in fp]
     license_counts = defaultdict(int)
-    for sub_dir, dirs, files in os.walk(root_dir):
-        if out_dir in sub_dir:
-            continue
-        for fn in files:
-            if os.path.splitext(fn)[-1] != '.jsonl':
-                continue
-            fp = os.path.join(sub_dir, fn)
-            for license_url, count in filter_permissive(fp, out_dir).items():
-                license_counts[license_url] += count
+    for chunk_license_counts in map_chunks(
+        partial(filter_permissive, out_dir=out_dir, root_dir=root_dir),
+        jsonl_fps,
+        num_workers=num_workers,
+        ordered=False
+    ):
+        for license_url, count in chunk_license_counts.items():
+            license_counts[license_url] += count
     permissive_total = 0
     restrictive_total = 0
     for license_url, count in license_counts.items():
@@ -100,8 +120,14 @@ def main(root_dir):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: filter_permissively_licensed.py </path/to/data>')
+    if len(sys.argv) not in [2, 3]:
+        print((
+            'Usage: filter_permissively_licensed.py </path/to/data> '
+            '[num_workers]'
+        ))
         sys.exit()
     root_dir = sys.argv[1]
-    main(root_dir)
+    num_workers = 1
+    if len(sys.argv) == 3:
+        num_workers = int(sys.argv[2])
+    main(root_dir, num_workers)
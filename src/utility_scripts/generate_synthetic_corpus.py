@@ -0,0 +1,849 @@
+""" Generate a synthetic corpus for testing the pipeline at scale without
+    the arXiv dump, consisting of
+    - arXiv style source archives (src/arXiv_src_<yymm>_<num>.tar
+      containing gzipped LaTeX files and gzipped TAR archives of
+      multi-file papers), input for prepare.py
+    - the corresponding unarXive JSONL chunks
+      (unarXive/<yy>/arXiv_src_<yymm>_<num>.jsonl, as after matching),
+      input for calc_stats.py, ml_tasks_prep_data.py, etc.
+    - an arXiv metadata snapshot (arxiv-metadata-oai-snapshot.json),
+      input for generate_metadata_db.py
+    - an OpenAlex works dump (openalex/works/<part>/part_<num>.gz) with
+      the works cited by the papers (and the papers themselves), input
+      for generate_openalex_db*.py
+
+    Papers cite works contained in the OpenAlex dump, other synthetic
+    papers (by arXiv ID), and works not contained in the dump. The
+    number of papers, references per paper, formulae per paragraph, and
+    the distribution of papers across categories (see
+    arxiv_taxonomy.CATEGORIES) and years are configurable.
+
+    Every paper and work is generated from the seed and its index
+    alone, so output is reproducible and chunks are generated in
+    parallel (--workers=N).
+
+    Example:
+
+        python3 generate_synthetic_corpus.py /tmp/synth --papers=100000 \\
+            --refs=40 --formula-density=3 --categories=cs.CL:3,hep-th:1 \\
+            --years=2020:1,2021:2,2022:4 --workers=8
+"""
+
+import gzip
+import io
+import json
+import math
+import os
+import random
+import sys
+import tarfile
+import uuid
+import numpy as np
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date
+from itertools import accumulate
+from hashlib import sha1
+from arxiv_taxonomy import GROUPS, ARCHIVES, CATEGORIES_ACTIVE
+from unarxive_reader import map_chunks
+
+DEFAULT_NUM_PAPERS = 1000
+DEFAULT_PAPERS_PER_CHUNK = 500
+DEFAULT_REFS_PER_PAPER = 30
+DEFAULT_FORMULA_DENSITY = 2.0  # formulae per paragraph
+DEFAULT_YEARS = {2018: 1, 2019: 1, 2020: 1, 2021: 1, 2022: 1}
+# paper structure (means)
+SECTIONS_PER_PAPER = 6
+PARAGRAPHS_PER_SECTION = 4
+WORDS_PER_PARAGRAPH = 80
+FIGURES_PER_PAPER = 4
+TABLES_PER_PAPER = 2
+CITATIONS_PER_REF = 1.5
+# references
+ARXIV_REF_FRAC = 0.2  # of references citing earlier synthetic papers
+LINKED_REF_FRAC = 0.6  # of other references citing works in the dump
+DOI_LINK_FRAC = 0.3  # of references to works with a DOI URL
+WORKS_PER_REF = 0.5  # default size of the works pool
+# sources
+MULTI_FILE_FRAC = 0.3  # of papers split into multiple LaTeX files
+CROSS_LIST_FRAC = 0.3  # of papers with a secondary category
+WORKS_PER_PART = 100000
+# seeds of the random generators of the different entities
+PLAN_SEED = 0
+PAPER_SEED = 1
+WORK_SEED = 2
+PAPER_WORK_ID_OFFSET = 9 * 10**10
+WORK_ID_OFFSET = 10**10
+
+WORDS = [
+    'model', 'data', 'method', 'result', 'analysis', 'system', 'network',
+    'function', 'theory', 'approach', 'field', 'energy', 'state', 'space',
+    'learning', 'algorithm', 'structure', 'process', 'value', 'bound',
+    'estimate', 'distribution', 'measure', 'graph', 'operator', 'signal',
+    'sample', 'error', 'order', 'group', 'set', 'case', 'problem',
+    'solution', 'equation', 'parameter', 'density', 'mass', 'spectrum',
+    'transition', 'phase', 'limit', 'rate', 'dimension', 'representation',
+    'the', 'of', 'a', 'in', 'and', 'we', 'is', 'for', 'that', 'with',
+    'show', 'propose', 'consider', 'obtain', 'large', 'small', 'linear',
+    'random', 'local', 'global', 'optimal', 'stable', 'efficient', 'novel'
+]
+FIRST_NAMES = [
+    'Anna', 'Ben', 'Carla', 'David', 'Elif', 'Farid', 'Grace', 'Hiro',
+    'Ines', 'Jonas', 'Kavya', 'Lars', 'Mei', 'Nikolai', 'Olga', 'Pedro',
+    'Qing', 'Rosa', 'Sven', 'Tariq', 'Uma', 'Viktor', 'Wen', 'Yusuf'
+]
+LAST_NAMES = [
+    'Abe', 'Becker', 'Costa', 'Dubois', 'Eriksson', 'Fischer', 'Garcia',
+    'Hansen', 'Ivanov', 'Jensen', 'Kim', 'Lopez', 'Müller', 'Nakamura',
+    'Okafor', 'Petrov', 'Quinn', 'Rossi', 'Schmidt', 'Tanaka', 'Ueda',
+    'Vogel', 'Wang', 'Yilmaz', 'Zhang'
+]
+SECTION_HEADS = [
+    'Introduction', 'Related Work', 'Preliminaries', 'Method', 'Model',
+    'Experiments', 'Results', 'Discussion', 'Conclusion'
+]
+FORMULA_TEMPLATES = [
+    'x_{{{i}}}',
+    '\\alpha _{{{i}}} + \\beta ',
+    '\\sum _{{k=1}}^{{{n}}} a_k x^{{k}}',
+    '\\mathcal {{O}}(n^{{{i}}})',
+    '\\int _0^{{{n}}} f(t)\\,dt',
+    '\\Vert v_{{{i}}} \\Vert _2 \\le \\epsilon ',
+    'E = m c^{{{i}}}',
+    'P(X_{{{i}}} \\mid Y) = \\frac{{P(Y \\mid X_{{{i}}}) P(X_{{{i}}})}}{{P(Y)}}'
+]
+VENUES = [
+    'Phys. Rev. D', 'J. Math. Phys.', 'Ann. Statist.', 'Nucl. Phys. B',
+    'Proc. ACL', 'Proc. NeurIPS', 'IEEE Trans. Signal Process.',
+    'Comm. Math. Phys.', 'Bioinformatics', 'J. Finance'
+]
+CONCEPTS = [
+    ('Physics', 'https://www.wikidata.org/wiki/Q413'),
+    ('Mathematics', 'https://www.wikidata.org/wiki/Q395'),
+    ('Computer Science', 'https://www.wikidata.org/wiki/Q21198'),
+    ('Biology', 'https://www.wikidata.org/wiki/Q420'),
+    ('Economics', 'https://www.wikidata.org/wiki/Q8134'),
+    ('Engineering', 'https://www.wikidata.org/wiki/Q11023')
+]
+# (roughly) the distribution of licenses of arXiv papers
+LICENSES = [
+    (None, 10),
+    ('http://arxiv.org/licenses/nonexclusive-distrib/1.0/', 70),
+    ('http://creativecommons.org/licenses/by/4.0/', 12),
+    ('http://creativecommons.org/licenses/by-sa/4.0/', 1),
+    ('http://creativecommons.org/licenses/by-nc-sa/4.0/', 2),
+    ('http://creativecommons.org/licenses/by-nc-nd/4.0/', 2),
+    ('http://creativecommons.org/publicdomain/zero/1.0/', 1),
+    ('http://creativecommons.org/licenses/by/3.0/', 2)
+]
+
+
+def _parse_weights(weights_str, key_type=str):
+    """ Parse a distribution given as "key:weight,key:weight,...".
+    """
+
+    weights = OrderedDict()
+    for item in weights_str.split(','):
+        key, _, weight = item.partition(':')
+        weights[key_type(key)] = float(weight or 1)
+    return weights
+
+
+def get_config(
+        num_papers=DEFAULT_NUM_PAPERS, refs_per_paper=DEFAULT_REFS_PER_PAPER,
+        formula_density=DEFAULT_FORMULA_DENSITY, categories=None,
+        years=None, num_works=None, papers_per_chunk=DEFAULT_PAPERS_PER_CHUNK,
+        seed=42
+):
+    """ Validate generation parameters and plan the distribution of
+        papers across months and chunks.
+
+        categories and years are dicts mapping arXiv categories / years
+        to weights (default: all active categories and DEFAULT_YEARS,
+        uniformly).
+    """
+
+    if categories is None:
+        categories = {
+            cat_id: 1 for cat_id, cat in CATEGORIES_ACTIVE.items()
+            if ARCHIVES.get(cat['in_archive'], {}).get('in_group') in GROUPS
+            and not GROUPS[ARCHIVES[cat['in_archive']]['in_group']].get(
+                'is_test', False
+            )
+        }
+    unknown = [cat_id for cat_id in categories
+               if cat_id not in CATEGORIES_ACTIVE]
+    if len(unknown) > 0:
+        raise ValueError(
+            'unknown or inactive categories: {}'.format(', '.join(unknown))
+        )
+    if years is None:
+        years = DEFAULT_YEARS
+    if min(years) < 2008 or max(years) > 2099:
+        # (older papers have archive based IDs, e.g. hep-th/9901001)
+        raise ValueError('years have to be in the range 2008–2099')
+    if num_works is None:
+        num_works = max(1, int(num_papers * refs_per_paper * WORKS_PER_REF))
+    cat_ids = sorted(categories)
+
+    # number of papers per month
+    rng = np.random.default_rng([seed, PLAN_SEED])
+    months = [
+        (year, month) for year in sorted(years) for month in range(1, 13)
+    ]
+    month_weights = np.array([years[year] for year, month in months])
+    month_counts = rng.multinomial(
+        num_papers, month_weights / month_weights.sum()
+    )
+    if max(month_counts) > 99999:
+        raise ValueError('too many papers per month (max. 99999)')
+    month_starts = []
+    month_yymms = []
+    chunks = []
+    first_idx = 0
+    for (year, month), count in zip(months, month_counts):
+        if count == 0:
+            continue
+        yymm = '{:02d}{:02d}'.format(year % 100, month)
+        month_starts.append(first_idx)
+        month_yymms.append(yymm)
+        for chunk_num, chunk_first in enumerate(
+            range(first_idx, first_idx + count, papers_per_chunk)
+        ):
+            chunks.append((
+                'arXiv_src_{}_{:03d}'.format(yymm, chunk_num + 1),
+                chunk_first,
+                min(chunk_first + papers_per_chunk, first_idx + count)
+            ))
+        first_idx += count
+
+    return {
+        'seed': seed,
+        'num_papers': num_papers,
+        'refs_per_paper': refs_per_paper,
+        'formula_density': formula_density,
+        'cat_ids': cat_ids,
+        'cat_cum_weights': list(accumulate(
+            categories[cat_id] for cat_id in cat_ids
+        )),
+        'num_works': num_works,
+        'month_starts': month_starts,
+        'month_yymms': month_yymms,
+        'chunks': chunks
+    }
+
+
+def get_paper_id(config, idx):
+    """ arXiv ID of the paper with the given index, e.g. 2105.00042
+    """
+
+    month_idx = bisect_right(config['month_starts'], idx) - 1
+    return '{}.{:05d}'.format(
+        config['month_yymms'][month_idx],
+        idx - config['month_starts'][month_idx] + 1
+    )
+
+
+def _rng(*key):
+    """ Random number generator for the entity identified by key (e.g.
+        seed, PAPER_SEED, paper index).
+    """
+
+    return random.Random(':'.join(str(k) for k in key))
+
+
+def _poisson(rng, lam):
+    """ Poisson distributed random number (approximated by a normal
+        distribution for large lam).
+    """
+
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, int(round(rng.gauss(lam, math.sqrt(lam)))))
+    limit = math.exp(-lam)
+    k = 0
+    p = rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+def _words(rng, num, capitalize=False):
+    words = rng.choices(WORDS, k=max(1, num))
+    if capitalize:
+        words = [w.capitalize() for w in words]
+    return ' '.join(words)
+
+
+def _person(rng):
+    return (
+        rng.choice(LAST_NAMES),
+        rng.choice(FIRST_NAMES)
+    )
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def get_paper_metadata(config, idx):
+    """ Metadata of the paper with the given index, in the format of the
+        arXiv metadata snapshot (see generate_metadata_db.py).
+    """
+
+    rng = _rng(config['seed'], PAPER_SEED, idx, 0)
+    aid = get_paper_id(config, idx)
+    cats = rng.choices(config['cat_ids'], cum_weights=config['cat_cum_weights'])
+    if rng.random() < CROSS_LIST_FRAC:
+        cross_cat = rng.choice(config['cat_ids'])
+        if cross_cat not in cats:
+            cats.append(cross_cat)
+    authors = [_person(rng) for i in range(1 + _poisson(rng, 2))]
+    license_url = rng.choices(
+        [lic for lic, weight in LICENSES],
+        [weight for lic, weight in LICENSES]
+    )[0]
+    created = date(
+        2000 + int(aid[:2]), int(aid[2:4]), rng.randint(1, 28)
+    )
+    return OrderedDict([
+        ('id', aid),
+        ('submitter', '{} {}'.format(authors[0][1], authors[0][0])),
+        ('authors', ', '.join(
+            '{} {}'.format(first, last) for last, first in authors
+        )),
+        ('title', _words(rng, 4 + _poisson(rng, 4), capitalize=True)),
+        ('comments', '{} pages'.format(1 + _poisson(rng, 12))),
+        ('journal-ref', None),
+        ('doi', None),
+        ('report-no', None),
+        ('categories', ' '.join(cats)),
+        ('license', license_url),
+        ('abstract', '  {}.\n'.format(_words(rng, 100 + _poisson(rng, 50)))),
+        ('versions', [{
+            'version': 'v1',
+            'created': created.strftime('%a, %d %b %Y 12:00:00 GMT')
+        }]),
+        ('update_date', created.isoformat()),
+        ('authors_parsed', [[last, first, ''] for last, first in authors])
+    ])
+
+
+def get_discipline(cat_id):
+    """ Name of the group of an arXiv category, e.g.
+            cs.CL -> Computer Science
+    """
+
+    archive_id = CATEGORIES_ACTIVE[cat_id]['in_archive']
+    return GROUPS[ARCHIVES[archive_id]['in_group']]['name']
+
+
+def get_work(config, k):
+    """ The k-th work of the works pool, in the format of the OpenAlex
+        works dump.
+    """
+
+    rng = _rng(config['seed'], WORK_SEED, k)
+    openalex_id = 'W{}'.format(WORK_ID_OFFSET + k)
+    authors = [_person(rng) for i in range(1 + _poisson(rng, 2))]
+    concept_name, concept_url = rng.choice(CONCEPTS)
+    return OrderedDict([
+        ('id', 'https://openalex.org/{}'.format(openalex_id)),
+        ('doi', 'https://doi.org/10.{}/synth.{}'.format(
+            rng.randrange(1000, 10000), k
+        ) if rng.random() < 0.8 else None),
+        ('title', _words(rng, 4 + _poisson(rng, 5), capitalize=True)),
+        ('publication_year', rng.randrange(1980, 2023)),
+        ('ids', {
+            'openalex': 'https://openalex.org/{}'.format(openalex_id),
+            'pmid': 'https://pubmed.ncbi.nlm.nih.gov/{}'.format(
+                10**7 + k
+            ) if rng.random() < 0.1 else None,
+            'pmcid': None
+        }),
+        ('authorships', [
+            {'author': {'display_name': '{} {}'.format(first, last)}}
+            for last, first in authors
+        ]),
+        ('cited_by_count', 1 + int(rng.expovariate(0.05))),
+        ('concepts', [{
+            'level': 0,
+            'display_name': concept_name,
+            'wikidata': concept_url,
+            'score': 0.9
+        }]),
+        ('open_access', {'is_oa': False, 'oa_url': None}),
+        ('locations', [{
+            'is_oa': False,
+            'landing_page_url': None,
+            'pdf_url': None
+        }]),
+        ('host_venue', {'display_name': rng.choice(VENUES)})
+    ])
+
+
+def get_paper_work(config, idx):
+    """ A synthetic paper as an OpenAlex work (with an arXiv location).
+    """
+
+    metadata = get_paper_metadata(config, idx)
+    openalex_id = 'W{}'.format(PAPER_WORK_ID_OFFSET + idx)
+    abs_url = 'https://arxiv.org/abs/{}'.format(metadata['id'])
+    return OrderedDict([
+        ('id', 'https://openalex.org/{}'.format(openalex_id)),
+        ('doi', None),
+        ('title', metadata['title']),
+        ('publication_year', 2000 + int(metadata['id'][:2])),
+        ('ids', {
+            'openalex': 'https://openalex.org/{}'.format(openalex_id),
+            'pmid': None,
+            'pmcid': None
+        }),
+        ('authorships', [
+            {'author': {'display_name': '{} {}'.format(first, last)}}
+            for last, first, suffix in metadata['authors_parsed']
+        ]),
+        ('cited_by_count', 0),
+        ('concepts', [{
+            'level': 0,
+            'display_name': get_discipline(metadata['categories'].split()[0]),
+            'wikidata': '',
+            'score': 0.9
+        }]),
+        ('open_access', {'is_oa': True, 'oa_url': abs_url}),
+        ('locations', [{
+            'is_oa': True,
+            'landing_page_url': abs_url,
+            'pdf_url': 'https://arxiv.org/pdf/{}'.format(metadata['id'])
+        }])
+    ])
+
+
+def _bib_entry_str(authors, title, venue, year, url=None):
+    """ Reference string, e.g. A. Abe and B. Becker. Some title.
+        Phys. Rev. D 12 (2019) 345.
+    """
+
+    names = ['{}. {}'.format(first[0], last) for last, first in authors]
+    if len(names) > 1:
+        names = [', '.join(names[:-1]), names[-1]]
+    bib_str = '{}. {}. {} {} ({}) {}.'.format(
+        ' and '.join(names), title, venue, 1 + len(title) % 97, year,
+        10 + len(venue) * 7
+    )
+    if url is not None:
+        bib_str += ' URL {}'.format(url)
+    return bib_str
+
+
+def get_paper_refs(config, idx, rng):
+    """ References of a paper as (bib entry string, URL, IDs) tuples,
+        where IDs are those the entry would be matched to.
+    """
+
+    refs = []
+    for i in range(_poisson(rng, config['refs_per_paper'])):
+        ids = OrderedDict([
+            ('open_alex_id', ''), ('sem_open_alex_id', ''),
+            ('pubmed_id', ''), ('pmc_id', ''), ('doi', ''), ('arxiv_id', '')
+        ])
+        url = None
+        if idx > 0 and rng.random() < ARXIV_REF_FRAC:
+            cited_idx = rng.randrange(idx)
+            cited = get_paper_metadata(config, cited_idx)
+            url = 'https://arxiv.org/abs/{}'.format(cited['id'])
+            openalex_id = 'W{}'.format(PAPER_WORK_ID_OFFSET + cited_idx)
+            ids['arxiv_id'] = cited['id']
+            authors = [(last, first)
+                       for last, first, suffix in cited['authors_parsed']]
+            title = cited['title']
+            venue = 'arXiv preprint'
+            year = 2000 + int(cited['id'][:2])
+        elif rng.random() < LINKED_REF_FRAC:
+            work = get_work(config, rng.randrange(config['num_works']))
+            openalex_id = work['id'].split('/')[-1]
+            if work['doi'] is not None:
+                ids['doi'] = work['doi'].replace('https://doi.org/', '')
+                if rng.random() < DOI_LINK_FRAC:
+                    url = work['doi']
+            if work['ids']['pmid'] is not None:
+                ids['pubmed_id'] = work['ids']['pmid']
+            authors = [
+                tuple(reversed(a['author']['display_name'].split(' ', 1)))
+                for a in work['authorships']
+            ]
+            title = work['title']
+            venue = work['host_venue']['display_name']
+            year = work['publication_year']
+        else:
+            openalex_id = None
+            authors = [_person(rng) for j in range(1 + _poisson(rng, 2))]
+            title = _words(rng, 4 + _poisson(rng, 5), capitalize=True)
+            venue = rng.choice(VENUES)
+            year = rng.randrange(1980, 2023)
+        if openalex_id is not None:
+            ids['open_alex_id'] = 'https://openalex.org/{}'.format(
+                openalex_id
+            )
+            ids['sem_open_alex_id'] = (
+                'https://semopenalex.org/work/{}'.format(openalex_id)
+            )
+        refs.append(
+            (_bib_entry_str(authors, title, venue, year, url), url, ids)
+        )
+    return refs
+
+
+def _paragraph_items(config, rng, num_refs, num_paras):
+    """ Content of a paragraph as a list of (type, value) items, with
+        types text, formula, and cite (value being the reference index).
+    """
+
+    words = WORDS_PER_PARAGRAPH + _poisson(rng, WORDS_PER_PARAGRAPH / 4)
+    inserts = []
+    for i in range(_poisson(rng, config['formula_density'])):
+        latex = rng.choice(FORMULA_TEMPLATES)
+        inserts.append(('formula', latex.format(
+            i=rng.randrange(1, 10), n=rng.randrange(2, 100)
+        )))
+    if num_refs > 0:
+        for i in range(_poisson(rng, num_refs * CITATIONS_PER_REF / num_paras)):
+            inserts.append(('cite', rng.randrange(num_refs)))
+    positions = sorted(rng.randrange(words) for i in range(len(inserts)))
+    order = rng.sample(range(len(inserts)), len(inserts))
+    items = []
+    prev_pos = 0
+    for pos, j in zip(positions, order):
+        if pos > prev_pos:
+            items.append(('text', _words(rng, pos - prev_pos)))
+        items.append(inserts[j])
+        prev_pos = pos
+    items.append(('text', '{}.'.format(_words(rng, words - prev_pos))))
+    return items
+
+
+def generate_paper(config, idx):
+    """ Generate the paper with the given index.
+
+        Returns its LaTeX source (dict of file names and contents) and
+        unarXive representation.
+    """
+
+    rng = _rng(config['seed'], PAPER_SEED, idx, 1)
+    metadata = get_paper_metadata(config, idx)
+    aid = metadata['id']
+    refs = get_paper_refs(config, idx, rng)
+    bib_ids = []
+    bib_entries = OrderedDict()
+    for bib_str, url, ids in refs:
+        sha_hash = sha1()
+        sha_hash.update(bib_str.encode('utf-8'))
+        sha_hash.update(aid.encode('utf-8'))
+        bib_id = sha_hash.hexdigest()
+        bib_ids.append(bib_id)
+        contained_arXiv_ids = []
+        contained_links = []
+        if url is not None:
+            link = OrderedDict([
+                ('text', url),
+                ('start', bib_str.index(url)),
+                ('end', bib_str.index(url) + len(url))
+            ])
+            if ids['arxiv_id']:
+                link['id'] = ids['arxiv_id']
+                link.move_to_end('id', last=False)
+                contained_arXiv_ids.append(link)
+            else:
+                link['url'] = url
+                link.move_to_end('url', last=False)
+                contained_links.append(link)
+        bib_entries[bib_id] = OrderedDict([
+            ('bib_entry_raw', bib_str),
+            ('contained_arXiv_ids', contained_arXiv_ids),
+            ('contained_links', contained_links),
+            ('discipline', ''),
+            ('ids', ids)
+        ])
+
+    # sections and paragraphs
+    num_secs = max(1, _poisson(rng, SECTIONS_PER_PAPER))
+    sections = []
+    for sec_idx in range(num_secs):
+        num_paras = max(1, _poisson(rng, PARAGRAPHS_PER_SECTION))
+        sections.append((
+            SECTION_HEADS[sec_idx % len(SECTION_HEADS)],
+            [
+                _paragraph_items(
+                    config, rng, len(refs), num_secs * PARAGRAPHS_PER_SECTION
+                )
+                for i in range(num_paras)
+            ]
+        ))
+    # figures and tables (placed after paragraphs)
+    num_paras_total = sum(len(paras) for head, paras in sections)
+    for float_type, mean in [
+        ('figure', FIGURES_PER_PAPER), ('table', TABLES_PER_PAPER)
+    ]:
+        for i in range(_poisson(rng, mean)):
+            para_idx = rng.randrange(num_paras_total)
+            for head, paras in sections:
+                if para_idx < len(paras):
+                    paras[para_idx].append((
+                        float_type,
+                        'Illustration of the {}'.format(_words(rng, 6))
+                    ))
+                    break
+                para_idx -= len(paras)
+
+    # render LaTeX and unarXive representation
+    body_text = []
+    ref_entries = OrderedDict()
+    sec_sources = []
+    for sec_idx, (head, paras) in enumerate(sections):
+        sec_tex = ['\\section{{{}}}\n'.format(head)]
+        for items in paras:
+            par_tex = []
+            par_text = ''
+            cite_spans = []
+            ref_spans = []
+            for item_type, value in items:
+                if item_type == 'text':
+                    par_tex.append(value)
+                    par_text += value + ' '
+                    continue
+                if item_type == 'cite':
+                    par_tex.append('\\cite{{b{}}}'.format(value))
+                    ref_id = bib_ids[value]
+                    spans = cite_spans
+                else:
+                    if item_type == 'formula':
+                        par_tex.append('${}$'.format(value))
+                        ref_entry = {'latex': value, 'type': 'formula'}
+                    else:
+                        par_tex.append((
+                            '\n\\begin{{{0}}}\n\\caption{{{1}}}\n'
+                            '\\end{{{0}}}\n'
+                        ).format(item_type, value))
+                        ref_entry = {'caption': value, 'type': item_type}
+                    ref_id = _uuid(rng)
+                    ref_entries[ref_id] = ref_entry
+                    spans = ref_spans
+                marker = '{{{{{}:{}}}}}'.format(item_type, ref_id)
+                spans.append(OrderedDict([
+                    ('start', len(par_text)),
+                    ('end', len(par_text) + len(marker)),
+                    ('text', marker),
+                    ('ref_id', ref_id)
+                ]))
+                par_text += marker + ' '
+            sec_tex.append(' '.join(par_tex) + '\n\n')
+            body_text.append(OrderedDict([
+                ('section', head),
+                ('sec_number', str(sec_idx + 1)),
+                ('sec_type', 'section'),
+                ('content_type', 'paragraph'),
+                ('text', par_text.rstrip() + '\n'),
+                ('cite_spans', cite_spans),
+                ('ref_spans', ref_spans)
+            ]))
+        sec_sources.append(''.join(sec_tex))
+
+    bib_tex = ['\\begin{thebibliography}{99}\n']
+    for i, (bib_str, url, ids) in enumerate(refs):
+        if url is not None:
+            bib_str = bib_str.replace(url, '\\url{{{}}}'.format(url))
+        bib_tex.append('\\bibitem{{b{}}} {}\n'.format(i, bib_str))
+    bib_tex.append('\\end{thebibliography}\n')
+    preamble = (
+        '\\documentclass{{article}}\n'
+        '\\usepackage{{amsmath}}\n'
+        '\\usepackage{{url}}\n'
+        '\\begin{{document}}\n'
+        '\\title{{{}}}\n'
+        '\\author{{{}}}\n'
+        '\\maketitle\n'
+        '\\begin{{abstract}}\n{}\\end{{abstract}}\n\n'
+    ).format(
+        metadata['title'], metadata['authors'], metadata['abstract'].strip()
+    )
+    if rng.random() < MULTI_FILE_FRAC:
+        sources = OrderedDict([('main.tex', preamble + ''.join(
+            '\\input{{sec{}}}\n'.format(i) for i in range(len(sec_sources))
+        ) + ''.join(bib_tex) + '\\end{document}\n')])
+        for i, sec_source in enumerate(sec_sources):
+            sources['sec{}.tex'.format(i)] = sec_source
+    else:
+        sources = OrderedDict([('main.tex', preamble + ''.join(
+            sec_sources
+        ) + ''.join(bib_tex) + '\\end{document}\n')])
+
+    paper = OrderedDict([
+        ('paper_id', aid),
+        ('_pdf_hash', None),
+        ('_source_hash', None),
+        ('_source_name', '{}.gz'.format(aid)),
+        ('metadata', metadata),
+        ('discipline', get_discipline(metadata['categories'].split()[0])),
+        ('abstract', OrderedDict([
+            ('section', 'Abstract'),
+            ('text', metadata['abstract']),
+            ('cite_spans', []),
+            ('ref_spans', [])
+        ])),
+        ('body_text', body_text),
+        ('bib_entries', bib_entries),
+        ('ref_entries', ref_entries)
+    ])
+    return sources, paper
+
+
+def _gzip_source(sources):
+    """ Compress a paper’s source the way arXiv does: a single file is
+        gzipped, multiple files are put in a gzipped TAR archive.
+    """
+
+    if len(sources) == 1:
+        return gzip.compress(
+            list(sources.values())[0].encode('utf-8'), mtime=0
+        )
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for fn, source in sources.items():
+            data = source.encode('utf-8')
+            tar_info = tarfile.TarInfo(fn)
+            tar_info.size = len(data)
+            tar.addfile(tar_info, io.BytesIO(data))
+    return gzip.compress(buf.getvalue(), mtime=0)
+
+
+def _add_to_tar(tar, fn, data):
+    tar_info = tarfile.TarInfo(fn)
+    tar_info.size = len(data)
+    tar.addfile(tar_info, io.BytesIO(data))
+
+
+def generate_chunk(params):
+    """ Generate the source archive and JSONL chunk of a range of papers.
+    """
+
+    config, out_dir, chunk_name, first_idx, end_idx = params
+    yymm = chunk_name.split('_')[2]
+    src_dir = os.path.join(out_dir, 'src')
+    jsonl_dir = os.path.join(out_dir, 'unarXive', yymm[:2])
+    os.makedirs(src_dir, exist_ok=True)
+    os.makedirs(jsonl_dir, exist_ok=True)
+    tar_fp = os.path.join(src_dir, '{}.tar'.format(chunk_name))
+    jsonl_fp = os.path.join(jsonl_dir, '{}.jsonl'.format(chunk_name))
+    with tarfile.open(tar_fp, 'w') as tar, open(jsonl_fp, 'w') as f:
+        for idx in range(first_idx, end_idx):
+            sources, paper = generate_paper(config, idx)
+            source_gz = _gzip_source(sources)
+            paper['_source_hash'] = sha1(source_gz).hexdigest()
+            _add_to_tar(
+                tar, '{}/{}'.format(yymm, paper['_source_name']), source_gz
+            )
+            f.write(json.dumps(paper) + '\n')
+    return end_idx - first_idx
+
+
+def generate_works_part(params):
+    """ Generate a part of the OpenAlex works dump.
+    """
+
+    config, out_dir, part_num, first_k, end_k, paper_works = params
+    part_dir = os.path.join(out_dir, 'openalex', 'works', 'synthetic')
+    os.makedirs(part_dir, exist_ok=True)
+    part_fp = os.path.join(part_dir, 'part_{:03d}.gz'.format(part_num))
+    with gzip.GzipFile(part_fp, 'wb', mtime=0) as f:
+        for k in range(first_k, end_k):
+            if paper_works:
+                work = get_paper_work(config, k)
+            else:
+                work = get_work(config, k)
+            f.write((json.dumps(work) + '\n').encode('utf-8'))
+    return end_k - first_k
+
+
+def generate_corpus(out_dir, config, num_workers=1):
+    """ Generate sources, JSONL chunks, metadata snapshot, and OpenAlex
+        works dump as described at the top.
+    """
+
+    # metadata snapshot
+    os.makedirs(out_dir, exist_ok=True)
+    meta_fp = os.path.join(out_dir, 'arxiv-metadata-oai-snapshot.json')
+    print('generating metadata snapshot')
+    with open(meta_fp, 'w') as f:
+        for idx in range(config['num_papers']):
+            f.write(json.dumps(get_paper_metadata(config, idx)) + '\n')
+
+    # sources and JSONL chunks
+    chunk_params = [
+        (config, out_dir, chunk_name, first_idx, end_idx)
+        for chunk_name, first_idx, end_idx in config['chunks']
+    ]
+    for i, num_pprs in enumerate(map_chunks(
+        generate_chunk, chunk_params, num_workers=num_workers, ordered=False
+    )):
+        print('{}/{} chunks'.format(i + 1, len(chunk_params)))
+
+    # OpenAlex works (works pool and the synthetic papers)
+    works_params = []
+    for num_works, paper_works in [
+        (config['num_works'], False), (config['num_papers'], True)
+    ]:
+        for first_k in range(0, num_works, WORKS_PER_PART):
+            works_params.append((
+                config, out_dir, len(works_params), first_k,
+                min(first_k + WORKS_PER_PART, num_works), paper_works
+            ))
+    for i, num_works in enumerate(map_chunks(
+        generate_works_part, works_params, num_workers=num_workers,
+        ordered=False
+    )):
+        print('{}/{} works dump parts'.format(i + 1, len(works_params)))
+
+
+if __name__ == '__main__':
+    opts = {}
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--'):
+            key, _, val = arg[2:].partition('=')
+            opts[key] = val
+        else:
+            args.append(arg)
+    if len(args) != 1:
+        print((
+            'Usage: python3 generate_synthetic_corpus.py <out_dir> '
+            '[--papers=N] [--papers-per-chunk=N] [--refs=N] '
+            '[--formula-density=F] [--categories=<cat>:<weight>,...] '
+            '[--years=<year>:<weight>,...] [--works=N] [--seed=N] '
+            '[--workers=N]'
+        ))
+        sys.exit()
+    try:
+        config = get_config(
+            num_papers=int(opts.get('papers', DEFAULT_NUM_PAPERS)),
+            refs_per_paper=float(opts.get('refs', DEFAULT_REFS_PER_PAPER)),
+            formula_density=float(
+                opts.get('formula-density', DEFAULT_FORMULA_DENSITY)
+            ),
+            categories=_parse_weights(opts['categories'])
+            if opts.get('categories') else None,
+            years=_parse_weights(opts['years'], key_type=int)
+            if opts.get('years') else None,
+            num_works=int(opts['works']) if opts.get('works') else None,
+            papers_per_chunk=int(
+                opts.get('papers-per-chunk', DEFAULT_PAPERS_PER_CHUNK)
+            ),
+            seed=int(opts.get('seed', 42))
+        )
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    generate_corpus(
+        args[0], config, num_workers=int(opts.get('workers', 1))
+    )
@@ -18,17 +18,26 @@
 """
 
 import json
+import sqlite3
 import os
 import pprint
 import re
 import sys
-# import unicodeit
+import tempfile
 from collections import defaultdict, OrderedDict
+from functools import partial
+from hashlib import sha1
 from calc_stats import get_coarse_arxiv_category
+from unarxive_reader import (
+    get_jsonl_fps, get_paper_month, map_chunks, expand_formulae
+)
+from unicode_math import latex_to_unicode_batch, set_cache, flush_cache
 
 
-mathfont_patt = re.compile(
-    r'\\math(cal|frak|bb|normal|rm|it|bf|sf|tt)\s*{([^}]+)}'
+# in-text markers of cited and referenced content
+# (see parse_latex_tralics.py)
+marker_patt = re.compile(
+    r'{{(cite|formula|figure|table|float):[^}]+}}'
 )
 alloc_map = {
     'introduction':
@@ -94,61 +103,60 @@ alloc_map = {
 
 
 def get_paper_year(ppr):
-    pid = ppr.get('paper_id')
-    if '/' in pid:
-        # old format ID
-        pref, pid = pid.split('/')
-    if pid[0] == '9':
-        # years 1991–1999
-        year = int('19' + pid[:2])
-    else:
-        # years 2000–2099
-        year = int('20' + pid[:2])
-    # month = pid[2:4]
-    return year
+    return int(get_paper_month(ppr.get('paper_id'))[:4])
 
 
 def prep_para(ppr, para, unicode_math=False):
     """ For a single paragraph.
+
+        In-text markers are replaced in a single pass over the text
+        - formulae with their LaTeX (or a unicode rendition)
+        - figures and tables with a type token (e.g. <FIGURE>)
+        - citations with numbered markers (e.g. [1]), noting the
+          offsets of markers of references linked to OpenAlex
     """
 
     # prepare math notation, figures, and tables
     replacement_dict = {}
+    unicode_math_spans = []
     for ref_span in para['ref_spans']:
         rid = ref_span['ref_id']
         ref_entry = ppr['ref_entries'][rid]
         if ref_entry['type'] == 'formula':
             if unicode_math:
-                # this is SLOW (b/c unicodeit is)
-                math_unicode = unicodeit.replace(
-                    ref_entry['latex']
+                # converted below, all formulae of the paragraph at once
+                unicode_math_spans.append(
+                    (ref_span['text'], ref_entry['latex'])
                 )
-                # math font command replacement
-                math_unicode = mathfont_patt.sub(
-                    r'\2', math_unicode
-                )
-                replacement_dict[ref_span['text']] = math_unicode
             else:
                 latex_intext = '\(' + ref_entry['latex'] + '\)'
                 replacement_dict[ref_span['text']] = latex_intext
         else:
             repl_token = '<{}>'.format(ref_entry['type'].upper())
             replacement_dict[ref_span['text']] = repl_token
-    # make replacements
-    para_prepd = para['text']
-    for repl_key, repl in replacement_dict.items():
-        para_prepd = para_prepd.replace(repl_key, repl)
+    if len(unicode_math_spans) > 0:
+        math_unicodes = latex_to_unicode_batch(
+            [latex for span_text, latex in unicode_math_spans]
+        )
+        for (span_text, latex), math_unicode in zip(
+            unicode_math_spans, math_unicodes
+        ):
+            replacement_dict[span_text] = math_unicode
 
     # prepare citation markers
-    cit_docs_seen = []
     cit_refid2mark = {}
     cit_mrk_links = {}
+    # in-text marker -> (ref ID, number of cite spans)
+    cite_text_spans = {}
     for i, cite_span in enumerate(para['cite_spans']):
-        # keep track of already assigned
         ref_id = cite_span['ref_id']
-        if ref_id in cit_docs_seen:
+        if cite_span['text'] in cite_text_spans:
+            cite_text_spans[cite_span['text']][1] += 1
+        else:
+            cite_text_spans[cite_span['text']] = [ref_id, 1]
+        # keep track of already assigned
+        if ref_id in cit_refid2mark:
             continue
-        cit_docs_seen.append(ref_id)
         # only define replacements once per cited doc
         cit_marker = '[{}]'.format(i+1)
         cit_refid2mark[ref_id] = cit_marker
@@ -161,190 +169,418 @@ def prep_para(ppr, para, unicode_math=False):
                 'offsets': []
             })
             cit_mrk_links[cit_marker] = ref
+
     # make replacements and keep track of offsets
-    for i, cite_span in enumerate(para['cite_spans']):
-        # find marker
-        marker_text = cite_span['text']
-        starts_at = para_prepd.index(marker_text)
-        pre = para_prepd[:starts_at]
-        post = para_prepd[starts_at+len(marker_text)-1:]
-        # replace
-        cit_marker = cit_refid2mark[cite_span['ref_id']]
-        repl = cit_marker
-        para_prepd = pre + repl + post
-        # note offset for linked refs
-        cit_marker = cit_refid2mark[cite_span['ref_id']]
-        if cit_marker in cit_mrk_links:
-            ends_at = starts_at+len(cit_marker)
-            cit_mrk_links[cit_marker]['offsets'].append(
-                (starts_at, ends_at)
-            )
-            assert para_prepd[starts_at:ends_at] == cit_marker
+    text = para['text']
+    prepd_parts = []
+    prepd_len = 0
+    prev_end = 0
+    for match in marker_patt.finditer(text):
+        marker_text = match.group(0)
+        if marker_text in replacement_dict:
+            repl = replacement_dict[marker_text]
+        elif marker_text in cite_text_spans and \
+                cite_text_spans[marker_text][1] > 0:
+            ref_id = cite_text_spans[marker_text][0]
+            cite_text_spans[marker_text][1] -= 1
+            cit_marker = cit_refid2mark[ref_id]
+            # NOTE: the closing brace of the in-text marker is kept
+            #       (e.g. “[1]}”) to not change previously prepared data
+            repl = cit_marker + '}'
+            # note offset for linked refs
+            if cit_marker in cit_mrk_links:
+                starts_at = prepd_len + match.start() - prev_end
+                ends_at = starts_at+len(cit_marker)
+                cit_mrk_links[cit_marker]['offsets'].append(
+                    (starts_at, ends_at)
+                )
+        else:
+            continue
+        prepd_parts.append(text[prev_end:match.start()])
+        prepd_parts.append(repl)
+        prepd_len += match.start() - prev_end + len(repl)
+        prev_end = match.end()
+    prepd_parts.append(text[prev_end:])
+    para_prepd = ''.join(prepd_parts)
 
     return para_prepd, cit_mrk_links
 
 
-def prep(root_dir):
+PERMISSIVE_LICENSES = [
+    # only use papers licensed such that result can be
+    # shared as cc by-sa 4.0 — i.e. no nc and no nd
+    # (could opt for using by-nc-sa and get ~15k more
+    #  papers, but at ~200k it’s not a huge gain and
+    #  requires restricting the use of the ML data)
+    'http://creativecommons.org/licenses/by/4.0/',  # 130k
+    'http://creativecommons.org/licenses/by/3.0/',  # 6k
+    'http://creativecommons.org/licenses/by-sa/4.0/',  # 8k
+    'http://creativecommons.org/publicdomain/zero/1.0/',  # 8k
+    'http://creativecommons.org/licenses/publicdomain/',  # 2k
+    # 'http://creativecommons.org/licenses/by-nc-sa/3.0/',  4k
+    # 'http://creativecommons.org/licenses/by-nc-sa/4.0/',  18k
+    # 'http://creativecommons.org/licenses/by-nc-nd/4.0/',  18k
+]
+
+
+def get_empty_prep_counts():
+    """ Counters needed for the data distribution report.
+    """
+
+    return {
+        'counts': defaultdict(int),
+        'num_imrad_pprs': 0,
+        'num_imrad_smpls': 0,
+        'num_citrec_pprs': 0,
+        'num_citrec_paras': 0,
+        'num_citrec_smpls': 0,
+        'num_pprs_per_cited_doc': defaultdict(int),
+        'num_smpls_per_cited_doc': defaultdict(int),
+        'imrad_year_cat_dist': defaultdict(int),
+        'citrec_year_cat_dist': defaultdict(int),
+    }
+
+
+def prep_paper(ppr, prep_counts, unicode_math=False, formula_db_conn=None):
+    """ For a single paper.
+
+        Returns the paper’s license info and its IMRaD and citation
+        recommendation sample packets (None if the paper has no samples
+        of the respective kind), or None if the paper is not
+        permissively licensed. Updates prep_counts along the way.
+
+        Interned formulae are expanded using formula_db_conn if given.
+    """
+
+    counts = prep_counts['counts']
+    num_pprs_per_cited_doc = prep_counts['num_pprs_per_cited_doc']
+    num_smpls_per_cited_doc = prep_counts['num_smpls_per_cited_doc']
+    imrad_smpls = []
+    citrec_smpls = []
+    # metadata
+    metadata = ppr.get('metadata', {})
+    license_url = metadata.get('license', None)
+    if license_url is None or license_url not in PERMISSIVE_LICENSES:
+        # skip non premissively licensed
+        return None
+    if formula_db_conn is not None:
+        expand_formulae(ppr, formula_db_conn)
+    authors = metadata.get('authors', None)
+    license_info = {
+        'license': license_url,
+        'authors': authors
+    }
+    main_cat = (metadata.get('categories') or '').split(' ')[-1]
+    grp_id = get_coarse_arxiv_category(main_cat)
+    for para_num, para in enumerate(ppr['body_text']):
+        # process paragraph
+        para_prepd, cit_mrk_links = prep_para(ppr, para, unicode_math)
+        # create IMRaD classification task data
+        sec_pre = para.get('section', '')
+        if sec_pre is None:
+            sec_pre = ''
+        sec_clean = sec_pre.strip().lower().replace(
+            '.', ''
+        )
+        label = None
+        if sec_clean in alloc_map['introduction']:
+            label = 'i'
+        elif sec_clean in alloc_map['methods']:
+            label = 'm'
+        elif sec_clean in alloc_map['results']:
+            label = 'r'
+        elif sec_clean in alloc_map['discussion']:
+            label = 'd'
+        elif sec_clean in alloc_map['related work']:
+            label = 'w'
+        else:
+            counts['_noclass'] += 1
+        if label is not None:
+            if len(para_prepd) < 200:
+                counts['_tooshort'] += 1
+            else:
+                counts[label] += 1
+                prep_counts['num_imrad_smpls'] += 1
+                imrad_smpl = OrderedDict({
+                        '_paper_id': ppr['paper_id'],
+                        '_orig_sec': sec_pre,
+                        'label': label,
+                        'text': para_prepd
+                })
+                imrad_smpls.append(imrad_smpl)
+        # create citation recommedation classification task data
+        sec_pre = para.get('section', '')
+        if len(cit_mrk_links) > 0:
+            prep_counts['num_citrec_paras'] += 1
+            # create one sample per cited doc
+            for marker, cit_mrk_link in cit_mrk_links.items():
+                prep_counts['num_citrec_smpls'] += 1
+                num_smpls_per_cited_doc[cit_mrk_link['id']] += 1
+                citrec_smpl = OrderedDict({
+                    '_paper_id': ppr['paper_id'],
+                    '_raw_ref': cit_mrk_link['ref'],
+                    'text': para_prepd,
+                    'marker': marker,
+                    'marker_offsets': cit_mrk_link['offsets'],
+                    'label': cit_mrk_link['id']
+                })
+                citrec_smpls.append(citrec_smpl)
+    # pack all of samples from one paper
+    imrad_smpl_packet = None
+    if len(imrad_smpls) > 0:
+        imrad_smpl_packet = OrderedDict({
+                'year': get_paper_year(ppr),  # for stratified
+                'discipline': grp_id,              # sampling
+                'category': main_cat,
+                'imrad_smpls': imrad_smpls,
+            })
+        prep_counts['num_imrad_pprs'] += 1
+        dist_key = '{}-{}'.format(grp_id, get_paper_year(ppr))
+        prep_counts['imrad_year_cat_dist'][dist_key] += len(imrad_smpls)
+    citrec_smpl_packet = None
+    if len(citrec_smpls) > 0:
+        uniq_lbls = set(
+            [s['label'] for s in citrec_smpls]
+        )
+        for lbl in uniq_lbls:
+            num_pprs_per_cited_doc[lbl] += 1
+        citrec_smpl_packet = OrderedDict({
+                'year': get_paper_year(ppr),  # for stratified
+                'discipline': grp_id,              # sampling
+                'category': main_cat,
+                'citrec_smpls': citrec_smpls
+            })
+        prep_counts['num_citrec_pprs'] += 1
+        dist_key = '{}-{}'.format(grp_id, get_paper_year(ppr))
+        prep_counts['citrec_year_cat_dist'][dist_key] += len(citrec_smpls)
+    return license_info, imrad_smpl_packet, citrec_smpl_packet
+
+
+def iter_chunk_packets(
+        fp, prep_counts, unicode_math=False, formula_db_fp=None
+):
+    """ For a single JSONL. Lazily yields paper ID, license info, and
+        sample packets of each permissively licensed paper.
+    """
+
+    formula_db_conn = None
+    if formula_db_fp is not None:
+        formula_db_conn = sqlite3.connect(formula_db_fp)
+    with open(fp) as f:
+        for line_num, line in enumerate(f):
+            try:
+                ppr = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                print(f'failed to load {fp} line {line_num}\nskipping ...')
+                continue
+            prepd = prep_paper(
+                ppr, prep_counts, unicode_math, formula_db_conn
+            )
+            if prepd is None:
+                continue
+            license_info, imrad_smpl_packet, citrec_smpl_packet = prepd
+            yield (
+                ppr['paper_id'],
+                license_info,
+                imrad_smpl_packet,
+                citrec_smpl_packet
+            )
+    if formula_db_conn is not None:
+        formula_db_conn.close()
+    if unicode_math:
+        flush_cache()
+
+
+def open_prep_output(fp, output_format):
+    """ Open an output file to which entries (serialized JSON values) are
+        written one at a time. Output formats are
+        - lines: one entry per line (JSONL)
+        - array: a JSON array
+        - object: a JSON object (entries being "key": value pairs)
+    """
+
+    output = {
+        'file': open(fp, 'w'),
+        'format': output_format,
+        'num_entries': 0
+    }
+    if output_format == 'array':
+        output['file'].write('[')
+    elif output_format == 'object':
+        output['file'].write('{')
+    return output
+
+
+def write_prep_output(output, entry):
+    if output['format'] == 'lines':
+        output['file'].write(entry + '\n')
+    else:
+        # same separator as json.dump
+        if output['num_entries'] > 0:
+            output['file'].write(', ')
+        output['file'].write(entry)
+    output['num_entries'] += 1
+
+
+def close_prep_output(output):
+    if output['format'] == 'array':
+        output['file'].write(']')
+    elif output['format'] == 'object':
+        output['file'].write('}')
+    output['file'].close()
+
+
+def open_prep_outputs(stream):
+    """ Open license info, IMRaD, and citation recommendation outputs.
+
+        Sample packets are written as JSON arrays, or as JSONL if stream
+        is True. License info is always written as a single JSON object
+        (looked up by paper ID when splitting).
+    """
+
+    if stream:
+        ext, packet_format = 'jsonl', 'lines'
+    else:
+        ext, packet_format = 'json', 'array'
+    return {
+        'license': open_prep_output('license_information.json', 'object'),
+        'imrad': open_prep_output(f'imrad_data.{ext}', packet_format),
+        'citrec': open_prep_output(f'citrec_data.{ext}', packet_format),
+    }
+
+
+def write_prep_packets(
+        outputs, paper_id, license_info, imrad_smpl_packet, citrec_smpl_packet
+):
+    write_prep_output(
+        outputs['license'],
+        '{}: {}'.format(json.dumps(paper_id), json.dumps(license_info))
+    )
+    if imrad_smpl_packet is not None:
+        write_prep_output(outputs['imrad'], json.dumps(imrad_smpl_packet))
+    if citrec_smpl_packet is not None:
+        write_prep_output(outputs['citrec'], json.dumps(citrec_smpl_packet))
+
+
+def merge_prep_counts(prep_counts, chunk_prep_counts):
+    """ Add the counters of a chunk to the overall counters.
+    """
+
+    for key, val in chunk_prep_counts.items():
+        if isinstance(val, dict):
+            for k, v in val.items():
+                prep_counts[key][k] += v
+        else:
+            prep_counts[key] += val
+
+
+def _prep_chunk_to_shards(
+        fp, shard_dir, unicode_math=False, formula_db_fp=None
+):
+    """ For a single JSONL, in a worker process. Writes the chunk’s
+        outputs to shard files (one entry per line) and returns their
+        paths together with the chunk’s counters.
+    """
+
+    prep_counts = get_empty_prep_counts()
+    shard_base = os.path.join(
+        shard_dir,
+        sha1(fp.encode('utf-8')).hexdigest()
+    )
+    shard_outputs = {}
+    for key in ['license', 'imrad', 'citrec']:
+        shard_outputs[key] = open_prep_output(
+            f'{shard_base}.{key}.jsonl',
+            'lines'
+        )
+    for packets in iter_chunk_packets(
+        fp, prep_counts, unicode_math, formula_db_fp
+    ):
+        write_prep_packets(shard_outputs, *packets)
+    shard_fps = {}
+    for key, shard_output in shard_outputs.items():
+        close_prep_output(shard_output)
+        shard_fps[key] = shard_output['file'].name
+    return shard_fps, prep_counts
+
+
+def prep(
+        root_dir, stream=False, num_workers=1, unicode_math=False,
+        unicode_math_cache_fp=None, formula_db_fp=None
+):
     """ For all JSONLs in the given root directory.
+
+        Outputs are written as they are generated, so that only counters
+        for the distribution report are kept in memory. Sample packets
+        are written as JSON arrays, or as JSONL (one packet per line) if
+        stream is True.
+
+        With num_workers > 1 chunks are processed in parallel, each
+        worker writing per chunk shards that are merged in chunk order,
+        giving the same output as a serial run.
+
+        With unicode_math=True mathematical notation is rendered as plain
+        text rather than LaTeX, optionally using (and filling) a
+        persistent conversion cache at unicode_math_cache_fp.
+
+        For data parsed with a formula store (see parse_latex_tralics.py)
+        formula_db_fp has to be given.
     """
 
-    counts = defaultdict(int)
+    prep_counts = get_empty_prep_counts()
+    if unicode_math:
+        set_cache(unicode_math_cache_fp)
 
     # collect JSONLs
-    jsonl_fps = []
-    for path_to_file, subdirs, files in os.walk(root_dir):
-        for fn in files:
-            fn_base, ext = os.path.splitext(fn)
-            if ext == '.jsonl':
-                fp = os.path.join(path_to_file, fn)
-                if os.path.getsize(fp) > 0:
-                    jsonl_fps.append(fp)
-    num_imrad_smpls = 0
-    num_citrec_smpls = 0
-    num_citrec_paras = 0
-    imrad_smpl_packets = []
-    citrec_smpl_packets = []
-    paper_license_dict = {}
-    num_pprs_per_cited_doc = defaultdict(int)
-    num_smpls_per_cited_doc = defaultdict(int)
-    # go through JSONLs
-    for i, fp in enumerate(jsonl_fps):
-        print(f'{i}/{len(jsonl_fps)}')
-        with open(fp) as f:
-            lines = f.readlines()
-            for line_num, line in enumerate(lines):
-                # process paper
-                imrad_smpls = []
-                citrec_smpls = []
-                try:
-                    ppr = json.loads(line)
-                except json.decoder.JSONDecodeError:
-                    print(f'failed to load {fp} line {line_num}\nskipping ...')
-                # metadata
-                metadata = ppr.get('metadata', {})
-                license_url = metadata.get('license', None)
-                if license_url is None or license_url not in [
-                    # only use papers licensed such that result can be
-                    # shared as cc by-sa 4.0 — i.e. no nc and no nd
-                    # (could opt for using by-nc-sa and get ~15k more
-                    #  papers, but at ~200k it’s not a huge gain and
-                    #  requires restricting the use of the ML data)
-                    'http://creativecommons.org/licenses/by/4.0/',  # 130k
-                    'http://creativecommons.org/licenses/by/3.0/',  # 6k
-                    'http://creativecommons.org/licenses/by-sa/4.0/',  # 8k
-                    'http://creativecommons.org/publicdomain/zero/1.0/',  # 8k
-                    'http://creativecommons.org/licenses/publicdomain/',  # 2k
-                    # 'http://creativecommons.org/licenses/by-nc-sa/3.0/',  4k
-                    # 'http://creativecommons.org/licenses/by-nc-sa/4.0/',  18k
-                    # 'http://creativecommons.org/licenses/by-nc-nd/4.0/',  18k
-                ]:
-                    # skip non premissively licensed
-                    continue
-                authors = metadata.get('authors', None)
-                paper_license_dict[ppr['paper_id']] = {
-                    'license': license_url,
-                    'authors': authors
-                }
-                main_cat = metadata.get('categories', '').split(' ')[-1]
-                grp_id = get_coarse_arxiv_category(main_cat)
-                for para_num, para in enumerate(ppr['body_text']):
-                    # process paragraph
-                    para_prepd, cit_mrk_links = prep_para(ppr, para)
-                    # create IMRaD classification task data
-                    sec_pre = para.get('section', '')
-                    if sec_pre is None:
-                        sec_pre = ''
-                    sec_clean = sec_pre.strip().lower().replace(
-                        '.', ''
-                    )
-                    label = None
-                    if sec_clean in alloc_map['introduction']:
-                        label = 'i'
-                    elif sec_clean in alloc_map['methods']:
-                        label = 'm'
-                    elif sec_clean in alloc_map['results']:
-                        label = 'r'
-                    elif sec_clean in alloc_map['discussion']:
-                        label = 'd'
-                    elif sec_clean in alloc_map['related work']:
-                        label = 'w'
-                    else:
-                        counts['_noclass'] += 1
-                    if label is not None:
-                        if len(para_prepd) < 200:
-                            counts['_tooshort'] += 1
-                        else:
-                            counts[label] += 1
-                            num_imrad_smpls += 1
-                            imrad_smpl = OrderedDict({
-                                    '_paper_id': ppr['paper_id'],
-                                    '_orig_sec': sec_pre,
-                                    'label': label,
-                                    'text': para_prepd
-                            })
-                            imrad_smpls.append(imrad_smpl)
-                    # create citation recommedation classification task data
-                    sec_pre = para.get('section', '')
-                    if len(cit_mrk_links) > 0:
-                        num_citrec_paras += 1
-                        # create one sample per cited doc
-                        for marker, cit_mrk_link in cit_mrk_links.items():
-                            num_citrec_smpls += 1
-                            num_smpls_per_cited_doc[cit_mrk_link['id']] += 1
-                            citrec_smpl = OrderedDict({
-                                '_paper_id': ppr['paper_id'],
-                                '_raw_ref': cit_mrk_link['ref'],
-                                'text': para_prepd,
-                                'marker': marker,
-                                'marker_offsets': cit_mrk_link['offsets'],
-                                'label': cit_mrk_link['id']
-                            })
-                            citrec_smpls.append(citrec_smpl)
-                # pack all of samples from one paper
-                if len(imrad_smpls) > 0:
-                    imrad_smpl_packet = OrderedDict({
-                            'year': get_paper_year(ppr),  # for stratified
-                            'discipline': grp_id,              # sampling
-                            'category': main_cat,
-                            'imrad_smpls': imrad_smpls.copy(),
-                        })
-                    imrad_smpl_packets.append(imrad_smpl_packet)
-                if len(citrec_smpls) > 0:
-                    uniq_lbls = set(
-                        [s['label'] for s in citrec_smpls]
-                    )
-                    for lbl in uniq_lbls:
-                        num_pprs_per_cited_doc[lbl] += 1
-                    citrec_smpl_packet = OrderedDict({
-                            'year': get_paper_year(ppr),  # for stratified
-                            'discipline': grp_id,              # sampling
-                            'category': main_cat,
-                            'citrec_smpls': citrec_smpls.copy()
-                        })
-                    citrec_smpl_packets.append(citrec_smpl_packet)
-
-    # get distribution numbers
-    citrec_year_cat_dist = defaultdict(int)
-    for ppr_smpls in citrec_smpl_packets:
-        key = ppr_smpls['discipline'] + '-' + str(ppr_smpls['year'])
-        citrec_year_cat_dist[key] += len(ppr_smpls['citrec_smpls'])
-    imrad_year_cat_dist = defaultdict(int)
-    for ppr_smpls in imrad_smpl_packets:
-        key = ppr_smpls['discipline'] + '-' + str(ppr_smpls['year'])
-        imrad_year_cat_dist[key] += len(ppr_smpls['imrad_smpls'])
-
-    with open('license_information.json', 'w') as f:
-        json.dump(paper_license_dict, f)
-    with open('imrad_data.json', 'w') as f:
-        json.dump(imrad_smpl_packets, f)
-    with open('citrec_data.json', 'w') as f:
-        json.dump(citrec_smpl_packets, f)
+    jsonl_fps = get_jsonl_fps(root_dir)
+    outputs = open_prep_outputs(stream)
+    if num_workers <= 1:
+        # go through JSONLs
+        for i, fp in enumerate(jsonl_fps):
+            print(f'{i}/{len(jsonl_fps)}')
+            for packets in iter_chunk_packets(
+                fp, prep_counts, unicode_math, formula_db_fp
+            ):
+                write_prep_packets(outputs, *packets)
+    else:
+        with tempfile.TemporaryDirectory() as shard_dir:
+            for i, (shard_fps, chunk_prep_counts) in enumerate(map_chunks(
+                partial(
+                    _prep_chunk_to_shards,
+                    shard_dir=shard_dir,
+                    unicode_math=unicode_math,
+                    formula_db_fp=formula_db_fp
+                ),
+                jsonl_fps,
+                num_workers=num_workers,
+                # (each worker uses the persistent cache, too)
+                initializer=set_cache if unicode_math else None,
+                initargs=(unicode_math_cache_fp,) if unicode_math else ()
+            )):
+                print(f'{i}/{len(jsonl_fps)}')
+                merge_prep_counts(prep_counts, chunk_prep_counts)
+                for key, shard_fp in shard_fps.items():
+                    with open(shard_fp) as f:
+                        for line in f:
+                            write_prep_output(outputs[key], line[:-1])
+                    os.remove(shard_fp)
+    for output in outputs.values():
+        close_prep_output(output)
+
+    print_prep_report(prep_counts)
 
+
+def print_prep_report(prep_counts):
+    """ Print the distribution of the generated data.
+    """
+
+    num_pprs_per_cited_doc = prep_counts['num_pprs_per_cited_doc']
+    num_smpls_per_cited_doc = prep_counts['num_smpls_per_cited_doc']
     print('citrec papers used:')
-    print(len(citrec_smpl_packets))
-    print(f'{num_citrec_paras} citrec paras')
-    print(f'{num_citrec_smpls} citrec samples')
-    pprint.pprint(citrec_year_cat_dist)
+    print(prep_counts['num_citrec_pprs'])
+    print(f'{prep_counts["num_citrec_paras"]} citrec paras')
+    print(f'{prep_counts["num_citrec_smpls"]} citrec samples')
+    pprint.pprint(prep_counts['citrec_year_cat_dist'])
     cit_docs_smpls_ge3 = len(
         [v for v in num_smpls_per_cited_doc.values() if v >= 3]
     )
@@ -366,17 +602,39 @@ def prep(root_dir):
     print()
     print()
     print('IMRAD papers used:')
-    print(len(imrad_smpl_packets))
-    print(f'{num_imrad_smpls} IMRaD samples')
-    pprint.pprint(counts)
-    pprint.pprint(imrad_year_cat_dist)
+    print(prep_counts['num_imrad_pprs'])
+    print(f'{prep_counts["num_imrad_smpls"]} IMRaD samples')
+    pprint.pprint(prep_counts['counts'])
+    pprint.pprint(prep_counts['imrad_year_cat_dist'])
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
+    flags = ['--stream', '--unicode-math']
+    formula_db_fp = None
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--formula-db='):
+            formula_db_fp = arg.split('=', 1)[1]
+        elif arg not in flags:
+            args.append(arg)
+    if len(args) not in [1, 2]:
         print(
-            'Usage: python3 ml_task_prep_data.py </path/to/unarXive/root/dir>'
+            'Usage: python3 ml_task_prep_data.py '
+            '</path/to/unarXive/root/dir> [num_workers] [--stream] '
+            '[--unicode-math] [--formula-db=</path/to/formulae.db>]'
         )
         sys.exit()
-    root_dir = sys.argv[1]
-    prep(root_dir)
+    root_dir = args[0]
+    num_workers = 1
+    if len(args) == 2:
+        num_workers = int(args[1])
+    stream = '--stream' in sys.argv
+    unicode_math = '--unicode-math' in sys.argv
+    prep(
+        root_dir,
+        stream=stream,
+        num_workers=num_workers,
+        unicode_math=unicode_math,
+        unicode_math_cache_fp='unicode_math_cache.db',
+        formula_db_fp=formula_db_fp
+    )
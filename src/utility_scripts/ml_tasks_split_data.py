@@ -7,13 +7,126 @@
     - paper publication year
 """
 
+import contextlib
 import json
 import math
 import os
 import random
 import sys
+import tempfile
 import uuid
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
+from hashlib import sha1
+
+SAMPLE_ID_NAMESPACE = uuid.uuid5(
+    uuid.NAMESPACE_URL,
+    'https://github.com/IllDepence/unarXive'
+)
+
+
+def iter_json_array(fp, read_size=2**16):
+    """ Iterate over the elements of a JSON array in a file (e.g. sample
+        packets written by ml_tasks_prep_data.py) without loading the
+        whole array into memory.
+    """
+
+    decoder = json.JSONDecoder()
+    with open(fp) as f:
+        buf = ''
+        pos = 0
+        in_array = False
+        while True:
+            # skip whitespace and separators between elements
+            while pos < len(buf) and buf[pos] in ' \t\n\r,':
+                pos += 1
+            if pos == len(buf):
+                buf = f.read(read_size)
+                pos = 0
+                if len(buf) == 0:
+                    raise ValueError(f'unexpected end of JSON array in {fp}')
+                continue
+            if not in_array:
+                if buf[pos] != '[':
+                    raise ValueError(f'{fp} does not contain a JSON array')
+                in_array = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                elem, end = decoder.raw_decode(buf, pos)
+                # numbers and literals are only complete if followed by
+                # a separator (e.g. 2. might be the start of 2.5)
+                complete = buf[pos] in '{["' or (
+                    end < len(buf) and buf[end] in ' \t\n\r,]'
+                )
+            except json.JSONDecodeError:
+                complete = False
+            if not complete:
+                # element continues beyond the buffer
+                more = f.read(max(read_size, len(buf) - pos))
+                if len(more) > 0:
+                    buf = buf[pos:] + more
+                    pos = 0
+                    continue
+                # end of file, raises if the element is incomplete
+                elem, end = decoder.raw_decode(buf, pos)
+            yield elem
+            pos = end
+
+
+def index_packets(fp, single_disc=None):
+    """ Single pass over sample packets in JSONL format (one packet per
+        line) determining
+        - the byte offset of each packet to use (optionally filtered
+          for a single discipline)
+        - the number of packets for each label
+        - the sample key (imrad_smpls or citrec_smpls)
+    """
+
+    offsets = []
+    num_packets_for_label = defaultdict(int)
+    sample_key = None
+    with open(fp, 'rb') as f:
+        offset = 0
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            ppr = json.loads(line)
+            if single_disc is not None and ppr['discipline'] != single_disc:
+                continue
+            # determine sample and label key
+            if sample_key is None:
+                for key in ['imrad_smpls', 'citrec_smpls']:
+                    if key in ppr:
+                        sample_key = key
+            offsets.append(line_offset)
+            # determine set of unique labels for which we have
+            # samples for the current paper
+            uniq_lbls = set()
+            for smpl in ppr[sample_key]:
+                uniq_lbls.add(smpl['label'])
+            # for each unique label, increase count of papers
+            # for label by 1
+            for lbl in uniq_lbls:
+                num_packets_for_label[lbl] += 1
+    return offsets, num_packets_for_label, sample_key
+
+
+def iter_packets_shuffled(fp, offsets, seed=42):
+    """ Read the packets at the given offsets in random order.
+
+        The order is the same as that of random.shuffle on a list of the
+        packets after random.seed(seed).
+    """
+
+    packet_order = list(range(len(offsets)))
+    random.seed(seed)
+    random.shuffle(packet_order)
+    with open(fp, 'rb') as f:
+        for i in packet_order:
+            f.seek(offsets[i])
+            yield json.loads(f.readline())
 
 
 def split(fn_to_split, fn_license_info, dev_test_size, single_disc):
@@ -29,33 +142,63 @@ def split(fn_to_split, fn_license_info, dev_test_size, single_disc):
         grp_q-bio
         grp_q-fin
         grp_stat
+
+        Sample packets are read from JSONL in a streaming fashion, so
+        that apart from license data only statistics per label and
+        stratum are kept in memory. Samples are written to the split
+        files as they are allocated. (JSON input is converted to JSONL
+        first.)
     """
 
-    print('reading paper data')
-    with open(fn_to_split) as f:
-        smpl_packs = json.load(f)
     print('reading license data')
     with open(fn_license_info) as f:
         paper_license_dict = json.load(f)
-    license_dict_dist = {}
+
+    fn_base, ext = os.path.splitext(os.path.split(fn_to_split)[-1])
+    with contextlib.ExitStack() as stack:
+        tmp_dir_path = stack.enter_context(tempfile.TemporaryDirectory())
+        split_files = {}
+        for split in ['test', 'dev', 'train']:
+            split_files[split] = stack.enter_context(
+                open(f'{fn_base}_{split}.jsonl', 'w')
+            )
+        # (one license record per paper)
+        license_file = stack.enter_context(
+            open(f'{fn_base}_license_info.jsonl', 'w')
+        )
+        _split(
+            fn_to_split, paper_license_dict, dev_test_size, single_disc,
+            tmp_dir_path, split_files, license_file
+        )
+
+
+def _split(
+        fn_to_split, paper_license_dict, dev_test_size, single_disc,
+        tmp_dir_path, split_files, license_file
+):
+    """ split() with opened output files.
+    """
+
+    fn_packets = fn_to_split
+    if os.path.splitext(fn_to_split)[1] != '.jsonl':
+        print('converting paper data to JSONL')
+        fn_packets = os.path.join(tmp_dir_path, 'packets.jsonl')
+        with open(fn_packets, 'w') as f:
+            for ppr in iter_json_array(fn_to_split):
+                f.write(json.dumps(ppr) + '\n')
 
     if single_disc is not None:
         print(f'only using samples from discipline {single_disc}')
-        smpl_packs = [
-            sp for sp in smpl_packs if sp['discipline'] == single_disc
-        ]
 
     dev_size_min_smpls = dev_test_size
     test_size_min_smpls = dev_test_size
     splits = ['test', 'dev', 'train']  # in fill order
-    smpls_split = {}
+    num_smpls_split = {}
     for split in splits:
-        smpls_split[split] = []
+        num_smpls_split[split] = 0
 
-    # determine sample and label key
-    for key in ['imrad_smpls', 'citrec_smpls']:
-        if key in smpl_packs[0]:
-            sample_key = key
+    def add_to_split(split, smpls):
+        num_smpls_split[split] += write_samples(smpls, split_files[split])
 
     # calculate sample allocation goals
     print('calculating sample allocation goals')
@@ -65,7 +208,6 @@ def split(fn_to_split, fn_license_info, dev_test_size, single_disc):
     dev_fill_curr = {}
     test_fill_curr = {}
     strat_dimensions = ['year', 'discipline', 'label']
-    num_packets_for_label = defaultdict(int)
     for strat in strat_dimensions:
         dists_abs[strat] = defaultdict(int)
         dev_fill_min[strat] = defaultdict(int)
@@ -75,88 +217,83 @@ def split(fn_to_split, fn_license_info, dev_test_size, single_disc):
     train_fill_curr_label = defaultdict(int)  # only used in pre-fill
     # # determine usable labels
     print('determining usable labels')
-    for ppr in smpl_packs:
-        # determine set of unique labels for which we have
-        # samples for the current paper
-        uniq_lbls = set()
-        for smpl in ppr[sample_key]:
-            uniq_lbls.add(smpl['label'])
-        # for each unique label, increase count of papers
-        # for label by 1
-        for lbl in uniq_lbls:
-            num_packets_for_label[lbl] += 1
+    offsets, num_packets_for_label, sample_key = index_packets(
+        fn_packets,
+        single_disc
+    )
     # usable labels are those for which we have samples
     # from at least <num_splits> (i.e. 3) papers
-    usable_labels = [
+    usable_labels = set(
         k for (k, v) in num_packets_for_label.items()
         if v >= len(splits)
-    ]
+    )
     # # filter samples to only contain usable labels
     print('filtering out unusable labels')
-    smpl_packs_usable = []
+    # (usable packets are kept in a temporary file for the allocation
+    #  pass below)
+    fn_packets_usable = os.path.join(tmp_dir_path, 'packets_usable.jsonl')
+    num_smpl_packs_usable = 0
     # # shuffle b/c we’ll already pre-assign some sample to splits
-    random.seed(42)
-    random.shuffle(smpl_packs)
-    for ppr in smpl_packs:
-        # prepare usable subset of paper samples
-        smpls_usable = []
-        for smpl in ppr[sample_key]:
-            lbl = smpl['label']
-            if lbl in usable_labels:
-                # pre-allocation to ensure each usable sample appears
-                # at least once in each split
-                pre_allocated = False
-                for (split_key, fill_counter) in [
-                    ('test', test_fill_curr['label']),
-                    ('dev', dev_fill_curr['label']),
-                    ('train', train_fill_curr_label),
-                ]:
-                    if fill_counter[lbl] == 0:
-                        clean_smpls = clean_samples(
-                            [smpl],  # function expects a list of samples
-                            paper_license_dict,
-                            license_dict_dist
-                        )
-                        smpls_split[split_key].extend(clean_smpls)
-                        fill_counter[lbl] += 1
-                        pre_allocated = True
-                        break  # don’t assign to other splits
-                # rest is used for stratified samples
-                if not pre_allocated:
-                    smpls_usable.append(smpl)
-        # if paper contains any usable samples
-        if len(smpls_usable) > 0:
-            # re-create paper with only usable samples
-            ppr_usable = {}
-            for k, v in ppr.items():
-                if k != sample_key:
-                    ppr_usable[k] = v
-            ppr_usable[sample_key] = smpls_usable
-            smpl_packs_usable.append(ppr_usable)
+    with open(fn_packets_usable, 'w') as f_usable:
+        for ppr in iter_packets_shuffled(fn_packets, offsets, seed=42):
+            add_sample_ids(ppr[sample_key])
+            # prepare usable subset of paper samples
+            smpls_usable = []
+            smpls_pre_allocated = defaultdict(list)
+            for smpl in ppr[sample_key]:
+                lbl = smpl['label']
+                if lbl in usable_labels:
+                    # pre-allocation to ensure each usable sample appears
+                    # at least once in each split
+                    pre_allocated = False
+                    for (split_key, fill_counter) in [
+                        ('test', test_fill_curr['label']),
+                        ('dev', dev_fill_curr['label']),
+                        ('train', train_fill_curr_label),
+                    ]:
+                        if fill_counter[lbl] == 0:
+                            smpls_pre_allocated[split_key].append(smpl)
+                            fill_counter[lbl] += 1
+                            pre_allocated = True
+                            break  # don’t assign to other splits
+                    # rest is used for stratified samples
+                    if not pre_allocated:
+                        smpls_usable.append(smpl)
+            for split_key, smpls in smpls_pre_allocated.items():
+                add_to_split(split_key, smpls)
+            # all usable samples end up in one of the splits (now or in
+            # the allocation pass below)
+            write_license_record(
+                [s for s in ppr[sample_key] if s['label'] in usable_labels],
+                paper_license_dict,
+                license_file
+            )
+            # if paper contains any usable samples
+            if len(smpls_usable) > 0:
+                # re-create paper with only usable samples
+                ppr_usable = {}
+                for k, v in ppr.items():
+                    if k != sample_key:
+                        ppr_usable[k] = v
+                ppr_usable[sample_key] = smpls_usable
+                f_usable.write(json.dumps(ppr_usable) + '\n')
+                num_smpl_packs_usable += 1
+                # # determine total distribution of stratification
+                # # dimensions
+                dists_abs['year'][ppr_usable['year']] += len(smpls_usable)
+                dists_abs['discipline'][ppr_usable['discipline']] += len(
+                    smpls_usable
+                )
+                for smpl in smpls_usable:
+                    dists_abs['label'][smpl['label']] += 1
     print('num usable labels:')
     print(len(usable_labels))
     print('num smpl packs:')
-    print(len(smpl_packs))
+    print(len(offsets))
     print('num usable smpl packs:')
-    print(len(smpl_packs_usable))
-    # import pprint
-    # for (split_key, fill_counter) in [
-    #     ('test', test_fill_curr['label']),
-    #     ('dev', dev_fill_curr['label']),
-    #     ('train', train_fill_curr_label),
-    # ]:
-    #     print(f'{split_key}:')
-    #     pprint.pprint(fill_counter)
-    for split_name, smpls in smpls_split.items():
-        print(f'#{split_name} samples: {len(smpls)}')
-    # sys.exit()
-    smpl_packs = smpl_packs_usable
-    # # determine total distribution of stratification dimensions
-    for ppr in smpl_packs:
-        dists_abs['year'][ppr['year']] += len(ppr[sample_key])
-        dists_abs['discipline'][ppr['discipline']] += len(ppr[sample_key])
-        for smpl in ppr[sample_key]:
-            dists_abs['label'][smpl['label']] += 1
+    print(num_smpl_packs_usable)
+    for split_name, num_smpls in num_smpls_split.items():
+        print(f'#{split_name} samples: {num_smpls}')
     # # determine relative distribution of stratification dimensions
     # # and calculate allocation minima
     smpls_total = sum(n for n in dists_abs['year'].values())
@@ -178,138 +315,247 @@ def split(fn_to_split, fn_license_info, dev_test_size, single_disc):
         'test': test_fill_curr,
         'dev': dev_fill_curr,
     }
-    for ppr in smpl_packs:
-        added = False
-        for i, split in enumerate(splits[:-1]):  # put in test or dev
-            # check if labels to be allocated have enough remaining samples
-            num_other_splits = len(splits) - i - 1
-            cant_use = False
-            for smpl in ppr[sample_key]:
-                if num_packets_for_label[smpl['label']] <= num_other_splits:
-                    cant_use = True
+    with open(fn_packets_usable) as f_usable:
+        for line in f_usable:
+            ppr = json.loads(line)
+            added = False
+            for i, split in enumerate(splits[:-1]):  # put in test or dev
+                # check if labels to be allocated have enough remaining
+                # samples
+                num_other_splits = len(splits) - i - 1
+                cant_use = False
+                for smpl in ppr[sample_key]:
+                    if num_packets_for_label[smpl['label']] <= \
+                            num_other_splits:
+                        cant_use = True
+                        break
+                if cant_use:
+                    continue
+                # check if current paper samples are useful to add to split
+                num_strat_dims_needed = 0
+                for strat in strat_dimensions:  # for all dims
+                    needed = False
+                    for k in dists_abs[strat].keys():  # for all vals
+                        n_curr = split_currs[split][strat][k]
+                        n_min = split_mins[split][strat][k]
+                        if n_curr < n_min:
+                            needed = True
+                            break
+                    if needed:
+                        num_strat_dims_needed += 1
+                # add if useful
+                if num_strat_dims_needed == len(strat_dimensions):
+                    add_to_split(split, ppr[sample_key])
+                    added = True
+                    # keep track of allocation numbers
+                    split_currs[split]['year'][ppr['year']] += len(
+                        ppr[sample_key]
+                    )
+                    split_currs[split]['discipline'][ppr['discipline']] += \
+                        len(ppr[sample_key])
+                    for smpl in ppr[sample_key]:
+                        split_currs[split]['label'][smpl['label']] += 1
+                    # keep track of packets left per label
+                    for lbl in set([s['label'] for s in ppr[sample_key]]):
+                        num_packets_for_label[lbl] -= 1
+                    # don’t add to other splits
                     break
-            if cant_use:
+            # add to train if “not needed” in tran/dev
+            if not added:
+                add_to_split('train', ppr[sample_key])
+
+
+def iter_packets(fp):
+    """ Iterate over sample packets in JSONL (streamed) or JSON format.
+    """
+
+    if os.path.splitext(fp)[1] == '.jsonl':
+        with open(fp) as f:
+            for line in f:
+                yield json.loads(line)
+    else:
+        yield from iter_json_array(fp)
+
+
+def get_hashed_split(paper_id, dev_frac, test_frac, seed=42):
+    """ Determine the split of a paper from a stable hash of its ID.
+
+        The hash is mapped to a uniformly distributed value in [0, 1),
+        so each paper ends up in test with probability test_frac, in
+        dev with probability dev_frac, and in train otherwise —
+        independently of all other papers.
+    """
+
+    hash_hex = sha1(f'{seed}:{paper_id}'.encode('utf-8')).hexdigest()
+    hash_val = int(hash_hex[:13], 16) / 16**13
+    if hash_val < test_frac:
+        return 'test'
+    if hash_val < test_frac + dev_frac:
+        return 'dev'
+    return 'train'
+
+
+def split_hashed(
+        fn_to_split, fn_license_info, dev_test_frac, single_disc, seed=42
+):
+    """ Create train/dev/test splits by assigning each paper (i.e. all
+        of its samples) based on a hash of its arXiv ID (see
+        get_hashed_split).
+
+        Because the assignment of a paper does not depend on any other
+        paper, data can be split in shards (e.g. on different machines)
+        and the results concatenated, and splitting additional data does
+        not change the assignment of already split papers. Every
+        discipline × publication year stratum is split with the same
+        fixed fractions, so stratification is given in expectation; small
+        strata can end up without dev or test papers. Unlike split(),
+        this does not ensure that each label occurs in each split.
+    """
+
+    if not 0 < 2 * dev_test_frac < 1:
+        raise ValueError(
+            'dev/test fraction has to be greater than 0 and less than 0.5'
+        )
+
+    print('reading license data')
+    with open(fn_license_info) as f:
+        paper_license_dict = json.load(f)
+
+    if single_disc is not None:
+        print(f'only using samples from discipline {single_disc}')
+
+    splits = ['test', 'dev', 'train']
+    fn_base, ext = os.path.splitext(os.path.split(fn_to_split)[-1])
+    num_smpls_strat = {}
+    for split in splits:
+        num_smpls_strat[split] = defaultdict(int)
+    with contextlib.ExitStack() as stack:
+        split_files = {}
+        for split in splits:
+            split_files[split] = stack.enter_context(
+                open(f'{fn_base}_{split}.jsonl', 'w')
+            )
+        license_file = stack.enter_context(
+            open(f'{fn_base}_license_info.jsonl', 'w')
+        )
+        sample_key = None
+        for ppr in iter_packets(fn_to_split):
+            if single_disc is not None and \
+                    ppr['discipline'] != single_disc:
                 continue
-            # check if current paper samples are useful to add to split
-            num_strat_dims_needed = 0
-            for strat in strat_dimensions:  # for all dims
-                needed = False
-                for k in dists_abs[strat].keys():  # for all vals
-                    n_curr = split_currs[split][strat][k]
-                    n_min = split_mins[split][strat][k]
-                    if n_curr < n_min:
-                        needed = True
-                        break
-                if needed:
-                    num_strat_dims_needed += 1
-            # add if useful
-            if num_strat_dims_needed == len(strat_dimensions):
-                clean_smpls = clean_samples(
-                    ppr[sample_key],
-                    paper_license_dict,
-                    license_dict_dist
-                )
-                smpls_split[split].extend(clean_smpls)
-                added = True
-                # keep track of allocation numbers
-                split_currs[split]['year'][ppr['year']] += len(
-                    ppr[sample_key]
-                )
-                split_currs[split]['discipline'][ppr['discipline']] += len(
-                    ppr[sample_key]
-                )
-                for smpl in ppr[sample_key]:
-                    split_currs[split]['label'][smpl['label']] += 1
-                # keep track of packets left per label
-                for lbl in set([s['label'] for s in ppr[sample_key]]):
-                    num_packets_for_label[lbl] -= 1
-                # don’t add to other splits
-                break
-        # add to train if “not needed” in tran/dev
-        if not added:
-            clean_smpls = clean_samples(
-                ppr[sample_key],
-                paper_license_dict,
-                license_dict_dist
+            # determine sample and label key
+            if sample_key is None:
+                for key in ['imrad_smpls', 'citrec_smpls']:
+                    if key in ppr:
+                        sample_key = key
+            smpls = ppr[sample_key]
+            if len(smpls) == 0:
+                continue
+            split = get_hashed_split(
+                smpls[0]['_paper_id'],
+                dev_test_frac,
+                dev_test_frac,
+                seed
             )
-            smpls_split['train'].extend(clean_smpls)
-
-    # for split in splits[:-1]:
-    #     print(split)
-    #     split_total = len(smpls_split[split])
-    #     print(f'\tsamples total: {split_total}')
-    #     for strat in strat_dimensions:
-    #         for k in dists_abs[strat].keys():
-    #             rel_of_total = dists_abs[strat][k] / smpls_total
-    #             rel_of_split = split_currs[split][strat][k] / split_total
-    #             print((
-    #                 f'\t\t{strat}-{k}: {rel_of_total:.4f} '
-    #                 f'-> {rel_of_split:.4f}'
-    #                 f' ({split_currs[split][strat][k]})'
-    #             ))
-
-    # save samples
-    fn_base, ext = os.path.splitext(os.path.split(fn_to_split)[-1])
-    for split, smpls in smpls_split.items():
-        fn = f'{fn_base}_{split}.jsonl'
-        with open(fn, 'w') as f:
-            for smpl in smpls:
-                f.write(json.dumps(smpl) + '\n')
-    # save license info
-    fn_license = f'{fn_base}_license_info.jsonl'
-    with open(fn_license, 'w') as f:
-        for arxiv_id, license_info in license_dict_dist.items():
-            line = json.dumps(license_info)
-            f.write(f'{line}\n')
-
-
-def clean_samples(smpls, paper_license_dict, license_dict_dist):
-    """ Prepare samples and their license info for distribution
+            add_sample_ids(smpls)
+            num_smpls = write_samples(smpls, split_files[split])
+            write_license_record(smpls, paper_license_dict, license_file)
+            strat_key = '{}-{}'.format(ppr['discipline'], ppr['year'])
+            num_smpls_strat[split][strat_key] += num_smpls
+
+    for split, strat_counts in num_smpls_strat.items():
+        print(f'#{split} samples: {sum(strat_counts.values())}')
+        for strat_key, num_smpls in sorted(strat_counts.items()):
+            print(f'\t{strat_key}: {num_smpls}')
+
+
+def add_sample_ids(smpls):
+    """ Add IDs (_smpl_id) to the samples of a paper, derived from their
+        content and position within the paper, so that reruns yield the
+        same IDs and samples with identical content (e.g. repeated
+        paragraphs) get distinct IDs.
+    """
+
+    for smpl_idx, smpl in enumerate(smpls):
+        smpl['_smpl_id'] = str(uuid.uuid5(
+            SAMPLE_ID_NAMESPACE,
+            json.dumps([smpl_idx, smpl], sort_keys=True)
+        ))
+
+
+def clean_samples(smpls):
+    """ Prepare samples for distribution
 
         - remove debug information from samples
           (=dict fields starting with an underscore)
-        - generate per sample lincense info
+        - use the IDs given by add_sample_ids
     """
 
     clean_smpls = []
     for smpl in smpls:
-        smpl_id = str(uuid.uuid4())
-        # generate clean sample
-        clean_smpl = OrderedDict()
-        clean_smpl['_id'] = smpl_id
-        clean_smpl['text'] = smpl['text']
+        clean_smpl = {'_id': smpl['_smpl_id'], 'text': smpl['text']}
         for k, v in smpl.items():
             if k[0] != '_' and k not in ['text', 'label']:
                 clean_smpl[k] = v
         clean_smpl['label'] = smpl['label']
-        # note sample IDs for license info
-        ppr_id = smpl['_paper_id']
-        license_info = paper_license_dict[ppr_id]
-        if ppr_id not in license_dict_dist:
-            ld = OrderedDict()
-            ld['paper_arxiv_id'] = ppr_id
-            ld['authors'] = license_info['authors']
-            ld['license'] = license_info['license']
-            ld['sample_ids'] = []
-            license_dict_dist[ppr_id] = ld
-        license_dict_dist[ppr_id]['sample_ids'].append(smpl_id)
-
         clean_smpls.append(clean_smpl)
     return clean_smpls
 
 
+def write_samples(smpls, split_file):
+    """ Clean samples and write them to a split file.
+
+        Returns the number of samples written.
+    """
+
+    for smpl in clean_samples(smpls):
+        split_file.write(json.dumps(smpl) + '\n')
+    return len(smpls)
+
+
+def write_license_record(smpls, paper_license_dict, license_file):
+    """ Write the license info of a paper, listing the IDs of its samples
+        (given as a whole, so that there is one record per paper).
+    """
+
+    if len(smpls) == 0:
+        return
+    ppr_id = smpls[0]['_paper_id']
+    license_info = paper_license_dict[ppr_id]
+    license_record = {
+        'paper_arxiv_id': ppr_id,
+        'authors': license_info['authors'],
+        'license': license_info['license'],
+        'sample_ids': [smpl['_smpl_id'] for smpl in smpls]
+    }
+    license_file.write(json.dumps(license_record) + '\n')
+
+
 if __name__ == '__main__':
-    if len(sys.argv) not in [4, 5]:
+    hashed = '--hashed' in sys.argv
+    args = [a for a in sys.argv if a != '--hashed']
+    if len(args) not in [4, 5]:
         print((
             'Usage: python3 ml_tasks_split_data.py '
             '<ml_data_file> <license_info_file> <dev/test set size> '
-            '[discipline filter]'
+            '[discipline filter] [--hashed]\n\n'
+            'With --hashed, papers are assigned to splits based on a hash '
+            'of their arXiv ID and dev/test set size is given as a '
+            'fraction (e.g. 0.05).'
         ))
     else:
-        to_split = sys.argv[1]
-        license_info = sys.argv[2]
-        dev_test_size = int(sys.argv[3])
+        to_split = args[1]
+        license_info = args[2]
         single_disc = None
-        if len(sys.argv) == 5:
-            single_disc = sys.argv[4]
-        split(to_split, license_info, dev_test_size, single_disc=single_disc)
+        if len(args) == 5:
+            single_disc = args[4]
+        if hashed:
+            dev_test_frac = float(args[3])
+            split_hashed(
+                to_split, license_info, dev_test_frac, single_disc=single_disc
+            )
+        else:
+            dev_test_size = int(args[3])
+            split(
+                to_split, license_info, dev_test_size, single_disc=single_disc
+            )
@@ -0,0 +1,301 @@
+""" Stats cube for flexible breakdowns of dataset stats.
+
+    Instead of one category × month matrix per stat (see calc_stats.py),
+    stats are aggregated into a columnar table with one row per
+    combination of
+    - main fine category
+    - month
+    - license (URL)
+    and one column per measure (number of papers, references, citation
+    markers, paragraphs per content type, figures, tables, formulae).
+
+    Queries can group by and filter on the stored dimensions as well as
+    on dimensions derived from them (see DERIVED_DIMS), e.g.
+    group × year, license_coarse × discipline, archive × month, ...
+    without recalculating anything.
+
+    Example:
+
+        cube = calc_stats_cube('/path/to/unarXive', num_workers=8)
+        query_cube(
+            cube,
+            ['num_pprs', 'num_refs'],
+            group_by=['license_coarse', 'discipline'],
+            where={'year': ['2020', '2021']}
+        )
+
+    Query results can be printed with print_cube_query.
+"""
+
+import os
+import sys
+import numpy as np
+from collections import OrderedDict
+from arxiv_taxonomy import CATEGORIES
+from calc_stats import (
+    STATS_KEY_IDX, PPR_STATS_KEYS, paper_stats_row, get_save_dir,
+    get_coarse_arxiv_category, get_coarse_arxiv_group_name,
+    get_license_fine_name, get_license_coarse_name
+)
+from unarxive_reader import get_jsonl_fps, iter_chunk_papers, map_chunks
+
+STORED_DIMS = ['category', 'month', 'license']
+MEASURES = ['num_pprs'] + PPR_STATS_KEYS
+MEASURE_IDXS = [STATS_KEY_IDX[m] for m in MEASURES]
+
+
+def _get_archive(cat_id):
+    cat = CATEGORIES.get(cat_id, None)
+    if cat is not None:
+        return cat['in_archive']
+    return None
+
+
+def _get_discipline(cat_id):
+    return get_coarse_arxiv_group_name(get_coarse_arxiv_category(cat_id))
+
+
+# dimension name -> (stored dimension, function mapping stored values)
+# (missing values, e.g. papers without license, are represented as '')
+DERIVED_DIMS = {
+    'archive': ('category', _get_archive),
+    'group': ('category', get_coarse_arxiv_category),
+    'discipline': ('category', _get_discipline),
+    'year': ('month', lambda m: m[:4]),
+    'license_name': (
+        'license', lambda lic: get_license_fine_name(lic or None)
+    ),
+    'license_coarse': (
+        'license', lambda lic: get_license_coarse_name(lic or None)
+    ),
+}
+
+
+def get_cube_fn():
+    return 'stats_cube{}npz'.format(os.path.extsep)
+
+
+def chunk_cube_cells(fp):
+    """ Aggregate the papers of a single JSONL into cube cells.
+
+        Returns a dict mapping (category, month, license) tuples
+        to measure vectors (ordered as MEASURES).
+    """
+
+    cells = {}
+    ppr_row = np.zeros(len(STATS_KEY_IDX), dtype=np.int64)
+    for ppr in iter_chunk_papers(fp):
+        cat, mon = paper_stats_row(ppr, ppr_row)
+        license_url = (ppr.get('metadata') or {}).get('license', None)
+        cell_key = (cat or '', mon, license_url or '')
+        measure_vals = ppr_row[MEASURE_IDXS]
+        if cell_key in cells:
+            cells[cell_key] += measure_vals
+        else:
+            cells[cell_key] = measure_vals
+    return cells
+
+
+def cube_from_cells(cells):
+    """ Convert aggregated cells into the columnar cube representation
+
+        {
+            'dims': {<dim>: {'codes': <int array>, 'values': <str array>}},
+            'measures': {<measure>: <int array>}
+        }
+
+        where the values of dimension <dim> in row i are
+        values[codes[i]].
+    """
+
+    cell_keys = sorted(cells.keys())
+    cube = {'dims': {}, 'measures': {}}
+    for i, dim in enumerate(STORED_DIMS):
+        dim_vals = np.array([k[i] for k in cell_keys], dtype=str)
+        values, codes = np.unique(dim_vals, return_inverse=True)
+        cube['dims'][dim] = {
+            'codes': codes.astype(np.int32),
+            'values': values
+        }
+    if len(cell_keys) > 0:
+        measure_mtrx = np.stack([cells[k] for k in cell_keys])
+    else:
+        measure_mtrx = np.zeros((0, len(MEASURES)), dtype=np.int64)
+    for j, measure in enumerate(MEASURES):
+        cube['measures'][measure] = measure_mtrx[:, j].copy()
+    return cube
+
+
+def calc_stats_cube(root_dir, num_workers=1, save_fp=None):
+    """ Calculate the stats cube of all JSONLs in root_dir, processing
+        chunks in parallel if num_workers > 1.
+    """
+
+    jsonl_fps = get_jsonl_fps(root_dir)
+    print('found {} JSONLs to parse'.format(len(jsonl_fps)))
+    cells = {}
+    for chunk_cells in map_chunks(
+        chunk_cube_cells,
+        jsonl_fps,
+        num_workers=num_workers,
+        ordered=False
+    ):
+        for cell_key, measure_vals in chunk_cells.items():
+            if cell_key in cells:
+                cells[cell_key] += measure_vals
+            else:
+                cells[cell_key] = measure_vals
+    cube = cube_from_cells(cells)
+
+    if save_fp is None:
+        save_fp = os.path.join(get_save_dir(), get_cube_fn())
+    save_cube(cube, save_fp)
+
+    return cube
+
+
+def get_stats_cube(root_dir, num_workers=1, save_fp=None, force_calc=False):
+    """ Get the stats cube of the JSONLs in root_dir, using a previously
+        persisted cube if there is one (unless force_calc is True).
+    """
+
+    if not force_calc:
+        cube = load_cube(save_fp)
+        if cube is not None:
+            return cube
+    return calc_stats_cube(root_dir, num_workers, save_fp)
+
+
+def save_cube(cube, fp):
+    save_dir = os.path.dirname(fp)
+    if len(save_dir) > 0 and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    print('persisting stats cube in `{}`'.format(fp))
+    arrays = {}
+    for dim, col in cube['dims'].items():
+        arrays['dim.{}.codes'.format(dim)] = col['codes']
+        arrays['dim.{}.values'.format(dim)] = col['values']
+    for measure, col in cube['measures'].items():
+        arrays['measure.{}'.format(measure)] = col
+    np.savez_compressed(fp, **arrays)
+
+
+def load_cube(fp=None):
+    """ Load a stats cube from disk (None if not previously persisted).
+    """
+
+    if fp is None:
+        fp = os.path.join(get_save_dir(), get_cube_fn())
+    if not os.path.isfile(fp):
+        return None
+    cube = {'dims': {}, 'measures': {}}
+    with np.load(fp) as npz:
+        for name in npz.files:
+            parts = name.split('.')
+            if parts[0] == 'dim':
+                cube['dims'].setdefault(parts[1], {})[parts[2]] = npz[name]
+            elif parts[0] == 'measure':
+                cube['measures'][parts[1]] = npz[name]
+    return cube
+
+
+def get_dim_codes(cube, dim):
+    """ Get the per row codes and the values of a stored or derived
+        dimension.
+    """
+
+    if dim in cube['dims']:
+        return cube['dims'][dim]['codes'], cube['dims'][dim]['values']
+    if dim not in DERIVED_DIMS:
+        raise ValueError('unknown stats cube dimension "{}"'.format(dim))
+    base_dim, derive = DERIVED_DIMS[dim]
+    base_codes, base_values = get_dim_codes(cube, base_dim)
+    # derive once per distinct value rather than once per row
+    derived = np.array(
+        [derive(str(v)) or '' for v in base_values],
+        dtype=str
+    )
+    values, value_codes = np.unique(derived, return_inverse=True)
+    return value_codes[base_codes], values
+
+
+def query_cube(cube, measures=None, group_by=(), where=None):
+    """ Sum up measures grouped by arbitrary (stored or derived)
+        dimensions, optionally restricted to rows whose dimension values
+        are within given sets.
+
+        e.g.
+            query_cube(
+                cube,
+                ['num_refs', 'num_refs_linked'],
+                group_by=['group', 'year'],
+                where={'license_coarse': ['Creative Commons']}
+            )
+
+        Returns an OrderedDict mapping tuples of dimension values
+        (ordered like group_by) to dicts of measure sums.
+    """
+
+    if measures is None:
+        measures = list(cube['measures'].keys())
+    num_rows = len(next(iter(cube['measures'].values())))
+    mask = np.ones(num_rows, dtype=bool)
+    for dim, allowed in (where or {}).items():
+        codes, values = get_dim_codes(cube, dim)
+        allowed = ['' if a is None else a for a in allowed]
+        mask &= np.isin(values, allowed)[codes]
+    # combine the codes of all group by dimensions into a single code
+    combined = np.zeros(mask.sum(), dtype=np.int64)
+    dims_values = []
+    for dim in group_by:
+        codes, values = get_dim_codes(cube, dim)
+        combined = combined * len(values) + codes[mask]
+        dims_values.append(values)
+    groups, group_idxs = np.unique(combined, return_inverse=True)
+    sums = {}
+    for measure in measures:
+        measure_sums = np.zeros(len(groups), dtype=np.int64)
+        np.add.at(measure_sums, group_idxs, cube['measures'][measure][mask])
+        sums[measure] = measure_sums
+    # decode groups
+    if len(group_by) > 0:
+        group_codes = np.unravel_index(
+            groups,
+            [len(values) for values in dims_values]
+        )
+    result = OrderedDict()
+    for i in range(len(groups)):
+        group_key = tuple(
+            str(values[group_codes[d][i]])
+            for d, values in enumerate(dims_values)
+        )
+        result[group_key] = {m: int(sums[m][i]) for m in measures}
+    return result
+
+
+def print_cube_query(cube, measures=None, group_by=('group',), where=None):
+    """ Print the result of query_cube, one block per measure.
+    """
+
+    if measures is None:
+        measures = list(cube['measures'].keys())
+    result = query_cube(cube, measures, group_by, where)
+    for measure in measures:
+        print('\n- - - {} - - -'.format(measure))
+        for group_key, measure_sums in result.items():
+            print('\t{}: {}'.format(
+                ' / '.join(group_key),
+                measure_sums[measure]
+            ))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        print('Usage: stats_cube.py </path/to/data> [num_workers]')
+        sys.exit()
+    root_dir = sys.argv[1]
+    num_workers = 1
+    if len(sys.argv) == 3:
+        num_workers = int(sys.argv[2])
+    cube = calc_stats_cube(root_dir, num_workers=num_workers)
+    print_cube_query(cube, group_by=('discipline', 'license_coarse'))
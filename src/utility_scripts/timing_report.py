@@ -0,0 +1,196 @@
+""" Summarize per paper timings recorded by the processing pipeline
+    (prepare.py / normalize_arxiv_dump.py / parse_latex_tralics.py and
+    match_references_openalex.py run with timing enabled, see
+    pipeline_log.py).
+
+    Reports for each pipeline step (normalize, parse, match)
+    - number of papers, failures, and throughput in papers/sec
+    - p50/p95/p99 of the wall clock and CPU time per paper of each stage
+      (e.g. tralics, xml_processing, grobid) and its share of the total
+    - throughput per archive/chunk
+    - the slowest papers
+
+    Example:
+
+        python3 timing_report.py /path/to/out/dir [/path/to/match/logs]
+"""
+
+import json
+import os
+import sys
+import numpy as np
+from collections import defaultdict, OrderedDict
+
+LOG_FN = 'log.jsonl'  # see pipeline_log.py
+PERCENTILES = [50, 95, 99]
+
+
+def get_log_fps(paths):
+    """ Get the paths of all pipeline logs given directly or contained
+        in the given directories.
+    """
+
+    log_fps = []
+    for path in paths:
+        if os.path.isfile(path):
+            log_fps.append(path)
+            continue
+        for path_to_file, subdirs, files in os.walk(path):
+            subdirs.sort()
+            if LOG_FN in files:
+                log_fps.append(os.path.join(path_to_file, LOG_FN))
+    return log_fps
+
+
+def iter_paper_records(log_fps):
+    """ Lazily iterate over the per paper records (with timings) of the
+        given logs.
+    """
+
+    for fp in log_fps:
+        with open(fp) as f:
+            for line in f:
+                record = json.loads(line)
+                if 'paper_id' in record and 'timings' in record:
+                    yield record
+
+
+def _throughput(records):
+    """ Papers per second between the start of the first and the end of
+        the last record (i.e. across parallel workers).
+    """
+
+    if len(records) == 0:
+        return 0
+    start = min(r['time'] for r in records)
+    end = max(r['time'] + r['seconds'] for r in records)
+    if end <= start:
+        return 0
+    return len(records) / (end - start)
+
+
+def _percentiles(vals):
+    return np.percentile(vals, PERCENTILES) if len(vals) > 0 else \
+        [0] * len(PERCENTILES)
+
+
+def summarize_timings(records, num_slowest=10):
+    """ Aggregate per paper records by pipeline step.
+    """
+
+    by_step = defaultdict(list)
+    for record in records:
+        by_step[record['stage']].append(record)
+    summary = OrderedDict()
+    for step, step_records in sorted(by_step.items()):
+        failures = defaultdict(int)
+        stage_walls = defaultdict(list)
+        stage_cpus = defaultdict(list)
+        stage_bytes = defaultdict(int)
+        by_archive = defaultdict(list)
+        for record in step_records:
+            if record['failure'] is not None:
+                failures[record['failure']] += 1
+            for stage, timing in record['timings'].items():
+                stage_walls[stage].append(timing['wall'])
+                stage_cpus[stage].append(timing['cpu'])
+                stage_bytes[stage] += timing['bytes'] or 0
+            by_archive[record.get('archive')].append(record)
+        paper_secs = [record['seconds'] for record in step_records]
+        total_secs = sum(paper_secs)
+        stages = OrderedDict()
+        for stage, walls in stage_walls.items():
+            stage_secs = sum(walls)
+            stages[stage] = {
+                'num_papers': len(walls),
+                'wall': _percentiles(walls),
+                'cpu': _percentiles(stage_cpus[stage]),
+                'share': stage_secs / total_secs if total_secs > 0 else 0,
+                'mb_per_sec': (
+                    stage_bytes[stage] / 2**20 / stage_secs
+                    if stage_secs > 0 and stage_bytes[stage] > 0 else None
+                )
+            }
+        archives = OrderedDict()
+        for archive, archive_records in sorted(
+            by_archive.items(), key=lambda a: str(a[0])
+        ):
+            archives[archive] = {
+                'num_papers': len(archive_records),
+                'seconds': sum(r['seconds'] for r in archive_records),
+                'papers_per_sec': _throughput(archive_records)
+            }
+        slowest = sorted(
+            step_records, key=lambda r: r['seconds'], reverse=True
+        )[:num_slowest]
+        summary[step] = {
+            'num_papers': len(step_records),
+            'failures': dict(failures),
+            'papers_per_sec': _throughput(step_records),
+            'paper_seconds': _percentiles(paper_secs),
+            'stages': stages,
+            'archives': archives,
+            'slowest': slowest
+        }
+    return summary
+
+
+def print_timing_report(summary):
+    for step, step_summary in summary.items():
+        print('\n- - - {} - - -'.format(step))
+        print('{} papers, {:.2f} papers/sec'.format(
+            step_summary['num_papers'],
+            step_summary['papers_per_sec']
+        ))
+        for failure, count in sorted(step_summary['failures'].items()):
+            print('\tfailed ({}): {}'.format(failure, count))
+        print('seconds per paper p50/p95/p99: {}'.format(
+            ' / '.join('{:.3f}'.format(v)
+                       for v in step_summary['paper_seconds'])
+        ))
+        print('\nstage\tpapers\twall p50/p95/p99\tcpu p50/p95/p99\t'
+              'share\tMB/s')
+        for stage, stage_summary in step_summary['stages'].items():
+            mb_per_sec = stage_summary['mb_per_sec']
+            print('{}\t{}\t{}\t{}\t{:.1%}\t{}'.format(
+                stage,
+                stage_summary['num_papers'],
+                ' / '.join('{:.3f}'.format(v) for v in stage_summary['wall']),
+                ' / '.join('{:.3f}'.format(v) for v in stage_summary['cpu']),
+                stage_summary['share'],
+                '-' if mb_per_sec is None else '{:.2f}'.format(mb_per_sec)
+            ))
+        print('\narchive\tpapers\tseconds\tpapers/sec')
+        for archive, archive_summary in step_summary['archives'].items():
+            print('{}\t{}\t{:.1f}\t{:.2f}'.format(
+                archive,
+                archive_summary['num_papers'],
+                archive_summary['seconds'],
+                archive_summary['papers_per_sec']
+            ))
+        print('\nslowest papers')
+        for record in step_summary['slowest']:
+            slowest_stage = None
+            if len(record['timings']) > 0:
+                slowest_stage = max(
+                    record['timings'].items(),
+                    key=lambda t: t[1]['wall']
+                )[0]
+            print('\t{}\t{:.2f}s\t{}{}'.format(
+                record['paper_id'],
+                record['seconds'],
+                '' if slowest_stage is None
+                else '(mostly {})'.format(slowest_stage),
+                '' if record['failure'] is None
+                else ' failed: {}'.format(record['failure'])
+            ))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: timing_report.py </path/to/log/or/dir> [...]')
+        sys.exit()
+    summary = summarize_timings(
+        iter_paper_records(get_log_fps(sys.argv[1:]))
+    )
+    print_timing_report(summary)
@@ -0,0 +1,460 @@
+""" Read access to unarXive JSONL data.
+
+    Provides lazy iteration over the papers of a data set directory with
+    optional filtering by
+    - paper ID
+    - publication month range
+    - arXiv category, archive or group (see arxiv_taxonomy.py)
+    - license
+    optional projection to a subset of top level fields, parallel
+    iteration over JSONL chunks, lookup of single papers by ID, and
+    expansion of formulae interned in a formula store (see
+    parse_latex_tralics.py).
+
+    Example:
+
+        from unarxive_reader import iter_papers
+
+        for ppr in iter_papers(
+            '/path/to/unarXive',
+            from_month='2020-01',
+            categories=['cs.CL', 'stat.ML'],
+            fields=['bib_entries']
+        ):
+            print(ppr['paper_id'], len(ppr['bib_entries']))
+"""
+
+import json
+import os
+import sqlite3
+from multiprocessing import Pool
+from arxiv_taxonomy import GROUPS, ARCHIVES, CATEGORIES
+
+JSON_DECODER = json.JSONDecoder()
+# max number of parameters per SQLite lookup
+FORMULA_LOOKUP_SIZE = 500
+
+
+def get_jsonl_fps(root_dir):
+    """ Get the paths of all non-empty JSONL files within root_dir.
+    """
+
+    jsonl_fps = []
+    for path_to_file, subdirs, files in os.walk(root_dir):
+        subdirs.sort()
+        for fn in sorted(files):
+            fn_base, ext = os.path.splitext(fn)
+            if ext == '.jsonl':
+                fp = os.path.join(path_to_file, fn)
+                if os.path.getsize(fp) > 0:
+                    jsonl_fps.append(fp)
+    return jsonl_fps
+
+
+def get_paper_month(paper_id):
+    """ Determine the publication month of a paper based on its arXiv ID.
+
+        e.g.
+            hep-th/9901001 -> 1999-01
+            2105.05862 -> 2021-05
+    """
+
+    pid = paper_id
+    if '/' in pid:
+        # old format ID
+        pref, pid = pid.split('/')
+    if pid[0] == '9':
+        # years 1991–1999
+        year = '19' + pid[:2]
+    else:
+        # years 2000–2099
+        year = '20' + pid[:2]
+    return '{}-{}'.format(year, pid[2:4])
+
+
+def get_paper_id_from_line(line):
+    """ Get the paper ID of a JSONL line without decoding the whole line.
+
+        Relies on paper_id being the first key of a paper object, and
+        falls back to fully decoding the line otherwise.
+    """
+
+    prefix = '{"paper_id": '
+    if line.startswith(prefix):
+        paper_id, end = JSON_DECODER.raw_decode(line, len(prefix))
+        return paper_id
+    return json.loads(line).get('paper_id')
+
+
+def get_metadata_from_line(line):
+    """ Get the metadata of a JSONL line without decoding the whole line.
+
+        Only the metadata object is decoded, which precedes the (much
+        larger) full text, references, and ref_entries of a paper.
+        Falls back to fully decoding the line if no metadata key is found.
+        Lines can be given as str or bytes.
+    """
+
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    # JSON string values can't contain an unescaped double quote, so the
+    # first occurrence of the key is the top level metadata key
+    key = '"metadata": '
+    key_idx = line.find(key)
+    if key_idx < 0:
+        return json.loads(line).get('metadata') or {}
+    metadata, end = JSON_DECODER.raw_decode(line, key_idx + len(key))
+    return metadata or {}
+
+
+def get_license_from_line(line):
+    """ Get the license URL of a JSONL line without decoding the whole
+        line (None if the paper has no license).
+    """
+
+    return get_metadata_from_line(line).get('license')
+
+
+def resolve_categories(cat_ids):
+    """ Resolve a list of arXiv category, archive, and/or group IDs
+        (e.g. cs.CL, hep-th, grp_math) to the set of fine grained
+        category IDs they cover.
+    """
+
+    fine_cats = set()
+    for cat_id in cat_ids:
+        if cat_id in CATEGORIES:
+            fine_cats.add(cat_id)
+        elif cat_id in ARCHIVES:
+            fine_cats.update(
+                k for k, v in CATEGORIES.items()
+                if v['in_archive'] == cat_id
+            )
+        elif cat_id in GROUPS:
+            fine_cats.update(
+                k for k, v in CATEGORIES.items()
+                if ARCHIVES[v['in_archive']]['in_group'] == cat_id
+            )
+        else:
+            raise ValueError(
+                'unknown arXiv category "{}"'.format(cat_id)
+            )
+    return fine_cats
+
+
+def get_paper_filter(
+        paper_ids=None, from_month=None, until_month=None,
+        categories=None, licenses=None
+):
+    """ Create a paper filter for use with iter_chunk_papers.
+
+        paper_ids: collection of arXiv IDs
+        from_month, until_month: inclusive bounds given as YYYY-MM
+        categories: collection of arXiv category, archive, or group IDs,
+                    matched against all categories of a paper
+        licenses: collection of license URLs (None for no license)
+
+        Returns None if no filtering is to be done.
+    """
+
+    if all(
+        v is None for v in
+        [paper_ids, from_month, until_month, categories, licenses]
+    ):
+        return None
+    ppr_filter = {
+        'paper_ids': None,
+        'from_month': from_month,
+        'until_month': until_month,
+        'categories': None,
+        'licenses': None
+    }
+    if paper_ids is not None:
+        ppr_filter['paper_ids'] = set(paper_ids)
+    if categories is not None:
+        ppr_filter['categories'] = resolve_categories(categories)
+    if licenses is not None:
+        ppr_filter['licenses'] = set(licenses)
+    return ppr_filter
+
+
+def paper_id_matches(paper_id, ppr_filter):
+    """ Check the ID based parts of a paper filter.
+    """
+
+    if ppr_filter is None:
+        return True
+    if ppr_filter['paper_ids'] is not None and \
+            paper_id not in ppr_filter['paper_ids']:
+        return False
+    if ppr_filter['from_month'] is None and \
+            ppr_filter['until_month'] is None:
+        return True
+    month = get_paper_month(paper_id)
+    if ppr_filter['from_month'] is not None and \
+            month < ppr_filter['from_month']:
+        return False
+    if ppr_filter['until_month'] is not None and \
+            month > ppr_filter['until_month']:
+        return False
+    return True
+
+
+def metadata_matches(metadata, ppr_filter):
+    """ Check the metadata based parts of a paper filter.
+    """
+
+    if ppr_filter is None:
+        return True
+    if ppr_filter['categories'] is not None:
+        cats = (metadata.get('categories') or '').split(' ')
+        if ppr_filter['categories'].isdisjoint(cats):
+            return False
+    if ppr_filter['licenses'] is not None and \
+            metadata.get('license') not in ppr_filter['licenses']:
+        return False
+    return True
+
+
+def paper_matches(ppr, ppr_filter):
+    """ Check if a paper matches a filter created with get_paper_filter.
+    """
+
+    if ppr_filter is None:
+        return True
+    if not paper_id_matches(ppr['paper_id'], ppr_filter):
+        return False
+    return metadata_matches(ppr.get('metadata') or {}, ppr_filter)
+
+
+def project_paper(ppr, fields):
+    """ Reduce a paper to its ID and the given top level fields.
+    """
+
+    if fields is None:
+        return ppr
+    ppr_proj = {'paper_id': ppr['paper_id']}
+    for field in fields:
+        ppr_proj[field] = ppr.get(field)
+    return ppr_proj
+
+
+def lookup_formulae(formula_db_conn, latex_hashes):
+    """ Look up the LaTeX of interned formulae. Returns a dict mapping
+        hashes to LaTeX.
+    """
+
+    latex_hashes = list(set(latex_hashes))
+    found = {}
+    for i in range(0, len(latex_hashes), FORMULA_LOOKUP_SIZE):
+        batch = latex_hashes[i:i+FORMULA_LOOKUP_SIZE]
+        rows = formula_db_conn.execute(
+            'select hash, latex from formula where hash in ({})'.format(
+                ','.join(['?'] * len(batch))
+            ),
+            batch
+        )
+        for latex_hash, latex in rows:
+            found[latex_hash] = latex
+    return found
+
+
+def expand_formulae(ppr, formula_db_conn):
+    """ Fill in the LaTeX of the interned formulae of a paper (in place).
+
+        Formulae not found in the formula store get NO_LATEX_CONTENT.
+    """
+
+    ref_entries = (ppr.get('ref_entries') or {}).values()
+    interned = [
+        ref_entry for ref_entry in ref_entries
+        if 'latex_hash' in ref_entry
+    ]
+    if len(interned) == 0:
+        return ppr
+    latexs = lookup_formulae(
+        formula_db_conn,
+        [ref_entry['latex_hash'] for ref_entry in interned]
+    )
+    for ref_entry in interned:
+        ref_entry['latex'] = latexs.get(
+            ref_entry['latex_hash'],
+            'NO_LATEX_CONTENT'
+        )
+    return ppr
+
+
+def iter_chunk_papers(fp, ppr_filter=None, fields=None, formula_db_fp=None):
+    """ Lazily iterate over the papers in a single JSONL chunk.
+
+        If formula_db_fp is given, interned formulae are expanded (only
+        if ref_entries are part of the projection).
+    """
+
+    check_ids = ppr_filter is not None and (
+        ppr_filter['paper_ids'] is not None or
+        ppr_filter['from_month'] is not None or
+        ppr_filter['until_month'] is not None
+    )
+    check_metadata = ppr_filter is not None and (
+        ppr_filter['categories'] is not None or
+        ppr_filter['licenses'] is not None
+    )
+    formula_db_conn = None
+    if formula_db_fp is not None and \
+            (fields is None or 'ref_entries' in fields):
+        formula_db_conn = sqlite3.connect(formula_db_fp)
+    with open(fp) as f:
+        for line in f:
+            # skip decoding papers we can rule out by ID or metadata alone
+            if check_ids and not paper_id_matches(
+                get_paper_id_from_line(line), ppr_filter
+            ):
+                continue
+            if check_metadata and not metadata_matches(
+                get_metadata_from_line(line), ppr_filter
+            ):
+                continue
+            ppr = project_paper(json.loads(line), fields)
+            if formula_db_conn is not None:
+                expand_formulae(ppr, formula_db_conn)
+            yield ppr
+    if formula_db_conn is not None:
+        formula_db_conn.close()
+
+
+def _read_chunk_papers(params):
+    fp, ppr_filter, fields, formula_db_fp = params
+    return list(iter_chunk_papers(fp, ppr_filter, fields, formula_db_fp))
+
+
+def map_chunks(
+        func, jsonl_fps, num_workers=1, ordered=True, initializer=None,
+        initargs=()
+):
+    """ Apply func to each JSONL chunk path, yielding the results.
+
+        With num_workers > 1 chunks are processed in a process pool,
+        in which case func has to be picklable (i.e. defined at module
+        level). Results are yielded in the order of jsonl_fps unless
+        ordered is False. initializer(*initargs) is called in each worker
+        process (e.g. to set up module state, which workers don’t inherit
+        with the spawn start method).
+    """
+
+    if num_workers <= 1:
+        for fp in jsonl_fps:
+            yield func(fp)
+        return
+    with Pool(num_workers, initializer, initargs) as pool:
+        if ordered:
+            results = pool.imap(func, jsonl_fps)
+        else:
+            results = pool.imap_unordered(func, jsonl_fps)
+        for result in results:
+            yield result
+
+
+def iter_papers(
+        root_dir, paper_ids=None, from_month=None, until_month=None,
+        categories=None, licenses=None, fields=None, num_workers=1,
+        formula_db_fp=None
+):
+    """ Lazily iterate over all papers within root_dir.
+
+        See get_paper_filter for the filter parameters. If fields is
+        given, papers are reduced to their paper_id and those fields.
+        See iter_chunk_papers for formula_db_fp.
+
+        With num_workers > 1 chunks are decoded, filtered, and projected
+        in parallel. Each worker then holds the (projected) papers of one
+        chunk in memory at a time.
+    """
+
+    ppr_filter = get_paper_filter(
+        paper_ids, from_month, until_month, categories, licenses
+    )
+    jsonl_fps = get_jsonl_fps(root_dir)
+    if num_workers <= 1:
+        for fp in jsonl_fps:
+            for ppr in iter_chunk_papers(
+                fp, ppr_filter, fields, formula_db_fp
+            ):
+                yield ppr
+        return
+    params = [(fp, ppr_filter, fields, formula_db_fp) for fp in jsonl_fps]
+    with Pool(num_workers) as pool:
+        for pprs in pool.imap(_read_chunk_papers, params):
+            for ppr in pprs:
+                yield ppr
+
+
+def gen_offset_index(root_dir, index_fp):
+    """ Generate an SQLite index of the file path and byte offset
+        of each paper within root_dir for fast lookup by paper ID.
+    """
+
+    conn = sqlite3.connect(index_fp)
+    db_cur = conn.cursor()
+    db_cur.execute('drop table if exists paper')
+    db_cur.execute("""
+        create table paper(
+            'aid' text primary key,
+            'fp' text,
+            'offset' integer
+        )
+    """)
+    for fp in get_jsonl_fps(root_dir):
+        rel_fp = os.path.relpath(fp, root_dir)
+        with open(fp, 'rb') as f:
+            offset = 0
+            for line in f:
+                aid = get_paper_id_from_line(line.decode('utf-8'))
+                db_cur.execute(
+                    "insert or replace into paper "
+                    "('aid','fp','offset') values(?,?,?)",
+                    (aid, rel_fp, offset)
+                )
+                offset += len(line)
+    conn.commit()
+    conn.close()
+
+
+def get_paper(
+        root_dir, paper_id, index_fp=None, fields=None, formula_db_fp=None
+):
+    """ Look up a single paper by its ID.
+
+        Uses an index created with gen_offset_index if given, and
+        scans root_dir otherwise. Returns None if the paper is not found.
+        See iter_chunk_papers for formula_db_fp.
+    """
+
+    if index_fp is None:
+        for ppr in iter_papers(
+            root_dir, paper_ids=[paper_id], fields=fields,
+            formula_db_fp=formula_db_fp
+        ):
+            return ppr
+        return None
+    conn = sqlite3.connect(index_fp)
+    db_cur = conn.cursor()
+    db_cur.execute(
+        'select fp, offset from paper where aid=?',
+        (paper_id,)
+    )
+    loc = db_cur.fetchone()
+    conn.close()
+    if loc is None:
+        return None
+    rel_fp, offset = loc
+    with open(os.path.join(root_dir, rel_fp), 'rb') as f:
+        f.seek(offset)
+        ppr = json.loads(f.readline())
+    ppr = project_paper(ppr, fields)
+    if formula_db_fp is not None and \
+            (fields is None or 'ref_entries' in fields):
+        formula_db_conn = sqlite3.connect(formula_db_fp)
+        expand_formulae(ppr, formula_db_conn)
+        formula_db_conn.close()
+    return ppr
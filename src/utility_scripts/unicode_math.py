@@ -0,0 +1,191 @@
+""" Plain text (unicode) rendition of mathematical notation in LaTeX.
+
+    Conversion is done with unicodeit, which is slow. Because the same
+    formulae (e.g. x, n, \\alpha) occur over and over again across
+    papers, conversions are memoized in memory and, optionally, in a
+    persistent SQLite cache shared by runs and worker processes.
+
+    Example:
+
+        set_cache('unicode_math_cache.db')
+        latex_to_unicode_batch(['x', '\\alpha', '\\mathbb{R}^2'])
+        # ['x', 'α', 'ℝ²']
+        flush_cache()
+"""
+
+import os
+import re
+import sqlite3
+from collections import OrderedDict
+
+try:
+    import unicodeit
+except ImportError:
+    unicodeit = None
+
+mathfont_patt = re.compile(
+    r'\\math(cal|frak|bb|normal|rm|it|bf|sf|tt)\s*{([^}]+)}'
+)
+# number of conversions memoized in memory (least recently used first out)
+MEMO_SIZE = 2**18
+# number of new conversions after which the persistent cache is written
+CACHE_COMMIT_SIZE = 1000
+# max number of parameters per SQLite lookup
+CACHE_LOOKUP_SIZE = 500
+
+_cache = {
+    'fp': None,
+    'pid': None,
+    'conn': None,
+    'pending': []
+}
+_memo = OrderedDict()
+
+
+def _convert(latex):
+    """ Uncached conversion.
+    """
+
+    if unicodeit is None:
+        raise ImportError(
+            'unicode math requires the package unicodeit '
+            '(pip install unicodeit)'
+        )
+    math_unicode = unicodeit.replace(latex)
+    # math font command replacement
+    return mathfont_patt.sub(r'\2', math_unicode)
+
+
+def set_cache(cache_fp):
+    """ Use a persistent cache at cache_fp (None to disable).
+
+        The setting is per process. For worker pools, call it in the
+        pool initializer (see ml_tasks_prep_data.prep), as workers don’t
+        inherit it with the spawn start method.
+    """
+
+    flush_cache()
+    _close_cache()
+    _cache['fp'] = cache_fp
+
+
+def _get_cache_conn():
+    """ Get the connection to the persistent cache, (re)opened lazily
+        per process so that forked workers don’t share a connection.
+    """
+
+    if _cache['fp'] is None:
+        return None
+    if _cache['conn'] is None or _cache['pid'] != os.getpid():
+        _cache['conn'] = sqlite3.connect(_cache['fp'], timeout=60)
+        _cache['pid'] = os.getpid()
+        _cache['pending'] = []
+        _cache['conn'].execute("""
+            create table if not exists formula(
+                'latex' text primary key,
+                'unicode' text
+            )
+        """)
+    return _cache['conn']
+
+
+def _close_cache():
+    if _cache['conn'] is not None and _cache['pid'] == os.getpid():
+        _cache['conn'].close()
+    _cache['conn'] = None
+    _cache['pid'] = None
+    _cache['pending'] = []
+
+
+def flush_cache():
+    """ Write pending conversions to the persistent cache.
+    """
+
+    conn = _get_cache_conn()
+    if conn is None or len(_cache['pending']) == 0:
+        return
+    conn.executemany(
+        "insert or ignore into formula ('latex','unicode') values(?,?)",
+        _cache['pending']
+    )
+    conn.commit()
+    _cache['pending'] = []
+
+
+def _lookup_persistent(latexs):
+    """ Look up formulae in the persistent cache. Returns a dict of
+        those found.
+    """
+
+    conn = _get_cache_conn()
+    found = {}
+    if conn is None:
+        return found
+    for i in range(0, len(latexs), CACHE_LOOKUP_SIZE):
+        batch = latexs[i:i+CACHE_LOOKUP_SIZE]
+        rows = conn.execute(
+            'select latex, unicode from formula where latex in ({})'.format(
+                ','.join(['?'] * len(batch))
+            ),
+            batch
+        )
+        for latex, math_unicode in rows:
+            found[latex] = math_unicode
+    return found
+
+
+def _store_persistent(conversions):
+    if _get_cache_conn() is None:
+        return
+    _cache['pending'].extend(conversions)
+    if len(_cache['pending']) >= CACHE_COMMIT_SIZE:
+        flush_cache()
+
+
+def _memo_get(latex):
+    math_unicode = _memo.get(latex, None)
+    if math_unicode is not None:
+        _memo.move_to_end(latex)
+    return math_unicode
+
+
+def _memo_put(latex, math_unicode):
+    _memo[latex] = math_unicode
+    _memo.move_to_end(latex)
+    if len(_memo) > MEMO_SIZE:
+        _memo.popitem(last=False)
+
+
+def latex_to_unicode_batch(latexs):
+    """ Convert a list of formulae.
+
+        Formulae not memoized are looked up in the persistent cache
+        together, and only those not found there are converted.
+    """
+
+    math_unicodes = [_memo_get(latex) for latex in latexs]
+    missing = list(OrderedDict.fromkeys(
+        latex for latex, math_unicode in zip(latexs, math_unicodes)
+        if math_unicode is None
+    ))
+    if len(missing) == 0:
+        return math_unicodes
+    converted = _lookup_persistent(missing)
+    new_conversions = []
+    for latex in missing:
+        if latex not in converted:
+            converted[latex] = _convert(latex)
+            new_conversions.append((latex, converted[latex]))
+        _memo_put(latex, converted[latex])
+    _store_persistent(new_conversions)
+    return [
+        converted[latex] if math_unicode is None else math_unicode
+        for latex, math_unicode in zip(latexs, math_unicodes)
+    ]
+
+
+def latex_to_unicode(latex):
+    """ Convert a single formula.
+    """
+
+    return latex_to_unicode_batch([latex])[0]
@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+import tarfile
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(SRC_DIR, 'utility_scripts'))
+
+DATA_SAMPLE_FP = os.path.join(REPO_DIR, 'doc', 'unarXive_data_sample.tar.gz')
+NUM_CHUNKS = 4
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    """ Directory with the bundled unarXive data sample (a single JSONL).
+    """
+
+    extract_dir = tmp_path_factory.mktemp('data_sample')
+    with tarfile.open(DATA_SAMPLE_FP) as tar:
+        tar.extractall(extract_dir, filter='data')
+    return os.path.join(extract_dir, 'unarXive_data_sample')
+
+
+@pytest.fixture(scope='session')
+def sample_pprs(data_dir):
+    from unarxive_reader import get_jsonl_fps
+    pprs = []
+    for fp in get_jsonl_fps(data_dir):
+        with open(fp) as f:
+            for line in f:
+                pprs.append(json.loads(line))
+    return pprs
+
+
+@pytest.fixture(scope='session')
+def chunked_data_dir(tmp_path_factory, sample_pprs):
+    """ The data sample split into several JSONL chunks, so that there is
+        something to process in parallel.
+    """
+
+    root_dir = tmp_path_factory.mktemp('data_chunked')
+    year_dir = os.path.join(root_dir, '22')
+    os.makedirs(year_dir)
+    for i in range(NUM_CHUNKS):
+        fp = os.path.join(year_dir, 'arXiv_src_2212_{:03d}.jsonl'.format(i))
+        with open(fp, 'w') as f:
+            for ppr in sample_pprs[i::NUM_CHUNKS]:
+                f.write(json.dumps(ppr) + '\n')
+    return str(root_dir)
+
+
+@pytest.fixture(scope='session')
+def prep_dirs(tmp_path_factory, chunked_data_dir):
+    """ Output of ml_tasks_prep_data.prep for the data sample, written as
+        JSON arrays and as JSONL (keys 'json' and 'jsonl').
+    """
+
+    from ml_tasks_prep_data import prep
+    prep_dirs = {}
+    cwd = os.getcwd()
+    try:
+        for ext, stream in [('json', False), ('jsonl', True)]:
+            prep_dirs[ext] = str(tmp_path_factory.mktemp('prep_' + ext))
+            os.chdir(prep_dirs[ext])
+            prep(chunked_data_dir, stream=stream)
+    finally:
+        os.chdir(cwd)
+    return prep_dirs
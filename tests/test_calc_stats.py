@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import numpy as np
+from calc_stats import (
+    calc_stats, load_from_disk, save_stats_archive, load_stats_archive,
+    LazyStatsMatrices, paper_stats, paper_stats_row, get_chunk_cache_dir,
+    get_chunk_manifest_fn, STATS_KEYS, STATS_KEY_IDX, PPR_STATS_KEYS
+)
+
+
+def assert_same_stats(stats_a, stats_b):
+    mtrxs_a, idxs_a = stats_a
+    mtrxs_b, idxs_b = stats_b
+    assert idxs_a == idxs_b
+    assert sorted(mtrxs_a.keys()) == sorted(mtrxs_b.keys())
+    for k in mtrxs_a:
+        assert np.array_equal(mtrxs_a[k], mtrxs_b[k]), k
+
+
+def test_serial_parallel_incremental(chunked_data_dir, sample_pprs, tmp_path):
+    serial = calc_stats(
+        chunked_data_dir, force_calc=True,
+        save_dir=os.path.join(tmp_path, 'serial')
+    )
+    assert serial[0]['num_pprs'].sum() == len(sample_pprs)
+    parallel = calc_stats(
+        chunked_data_dir, force_calc=True, num_workers=2,
+        save_dir=os.path.join(tmp_path, 'parallel')
+    )
+    assert_same_stats(serial, parallel)
+    incremental = calc_stats(
+        chunked_data_dir, incremental=True,
+        save_dir=os.path.join(tmp_path, 'incremental')
+    )
+    assert_same_stats(serial, incremental)
+
+
+def test_incremental_update(chunked_data_dir, tmp_path):
+    data_dir = os.path.join(tmp_path, 'data')
+    shutil.copytree(chunked_data_dir, data_dir)
+    save_dir = os.path.join(tmp_path, 'incremental')
+    calc_stats(data_dir, incremental=True, save_dir=save_dir)
+    # drop a paper from one chunk and a whole other chunk
+    chunk_dir = os.path.join(data_dir, '22')
+    chunk_fps = sorted(
+        os.path.join(chunk_dir, fn) for fn in os.listdir(chunk_dir)
+    )
+    with open(chunk_fps[0]) as f:
+        lines = f.readlines()
+    with open(chunk_fps[0], 'w') as f:
+        f.writelines(lines[1:])
+    os.remove(chunk_fps[1])
+    updated = calc_stats(data_dir, incremental=True, save_dir=save_dir)
+    recalculated = calc_stats(
+        data_dir, force_calc=True, save_dir=os.path.join(tmp_path, 'full')
+    )
+    assert_same_stats(recalculated, updated)
+    # unchanged input gives the same result (from the chunk cache)
+    assert_same_stats(
+        recalculated,
+        calc_stats(data_dir, incremental=True, save_dir=save_dir)
+    )
+
+
+def test_load_from_disk(chunked_data_dir, tmp_path):
+    save_dir = os.path.join(tmp_path, 'stats')
+    stats = calc_stats(chunked_data_dir, force_calc=True, save_dir=save_dir)
+    loaded = load_from_disk(save_dir)
+    assert isinstance(loaded[0], LazyStatsMatrices)
+    assert_same_stats(stats, loaded)
+    loaded[0].close()
+
+
+def test_stats_archive(tmp_path):
+    mtrxs = {
+        'num_pprs': np.array([[0, 2], [0, 0], [5, 0]], dtype=np.int64),
+        'num_refs': np.zeros((3, 2), dtype=np.int64)
+    }
+    idxs = {'cat_to_idx': {'cs.CL': 0}}
+    for sparse in [True, False]:
+        fp = os.path.join(tmp_path, 'stats_{}.npz'.format(sparse))
+        save_stats_archive(fp, mtrxs, idxs, sparse=sparse)
+        with LazyStatsMatrices(fp) as loaded:
+            assert loaded.indices == idxs
+            assert sorted(loaded) == sorted(mtrxs)
+            for k, mtrx in mtrxs.items():
+                assert np.array_equal(loaded[k], mtrx)
+            if not sparse:
+                # dense matrices are memory-mapped
+                assert isinstance(loaded['num_pprs'], np.memmap)
+        # matrices accessed before closing remain usable
+        assert loaded['num_pprs'][2, 0] == 5
+    # archives written compressed (by earlier versions) are read as is
+    fp = os.path.join(tmp_path, 'stats_compressed.npz')
+    np.savez_compressed(
+        fp, num_pprs=mtrxs['num_pprs'], _indices=np.array('{}')
+    )
+    loaded, loaded_idxs = load_stats_archive(fp)
+    assert loaded_idxs == {}
+    assert np.array_equal(loaded['num_pprs'], mtrxs['num_pprs'])
+    loaded.close()
+
+
+def test_cache_discarded_on_version_change(chunked_data_dir, tmp_path):
+    save_dir = os.path.join(tmp_path, 'incremental')
+    stats = calc_stats(chunked_data_dir, incremental=True, save_dir=save_dir)
+    # make the cache look like one of an earlier stats version with
+    # different counts
+    cache_dir = get_chunk_cache_dir(save_dir)
+    manifest_fp = os.path.join(cache_dir, get_chunk_manifest_fn())
+    with open(manifest_fp) as f:
+        manifest = json.load(f)
+    manifest['version'] = 1
+    with open(manifest_fp, 'w') as f:
+        json.dump(manifest, f)
+    for cached in manifest['chunks'].values():
+        save_stats_archive(
+            os.path.join(cache_dir, cached['partial_fn']),
+            {k: np.ones_like(m) for k, m in stats[0].items()}
+        )
+    assert_same_stats(
+        stats, calc_stats(chunked_data_dir, incremental=True, save_dir=save_dir)
+    )
+
+
+def test_paper_stats_row(sample_pprs):
+    for ppr in sample_pprs:
+        stats = paper_stats(ppr)
+        row = np.zeros(len(STATS_KEYS), dtype=np.int64)
+        cat, mon = paper_stats_row(ppr, row)
+        assert cat == stats['main_fine_cat']
+        assert mon == stats['month']
+        for k in PPR_STATS_KEYS:
+            assert row[STATS_KEY_IDX[k]] == stats[k], k
+        assert row[STATS_KEY_IDX['num_pprs']] == 1
+        num_cite_spans = sum(
+            len(para['cite_spans']) for para in ppr['body_text']
+        )
+        assert stats['num_cit_markers'] == num_cite_spans
+
+
+def test_num_cit_markers():
+    # each cite span is one marker, no matter how often its reference is
+    # cited within the paragraph
+    ppr = {
+        'paper_id': '2212.00001',
+        'metadata': {'categories': 'cs.CL', 'license': None},
+        'bib_entries': {
+            'a': {'ids': {'open_alex_id': 'https://openalex.org/W1'}},
+            'b': {'ids': {'open_alex_id': ''}}
+        },
+        'ref_entries': {},
+        'body_text': [{
+            'text': '{{cite:a}} x {{cite:a}} y {{cite:b}}',
+            'content_type': 'paragraph',
+            'cite_spans': [
+                {'ref_id': 'a', 'text': '{{cite:a}}'},
+                {'ref_id': 'a', 'text': '{{cite:a}}'},
+                {'ref_id': 'b', 'text': '{{cite:b}}'}
+            ],
+            'ref_spans': []
+        }]
+    }
+    stats = paper_stats(ppr)
+    assert stats['num_cit_markers'] == 3
+    assert stats['num_cit_markers_linked'] == 2
+    assert stats['num_refs'] == 2
+    assert stats['num_refs_linked'] == 1
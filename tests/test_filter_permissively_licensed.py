@@ -0,0 +1,76 @@
+import json
+import os
+import pytest
+import filter_permissively_livensed
+from filter_permissively_livensed import main, is_permissive
+
+RESTRICTIVE_LICENSE = 'http://creativecommons.org/licenses/by-nc-nd/4.0/'
+
+
+def write_month_dirs(root_dir, sample_pprs):
+    """ Write the data sample into two month directories with chunks of
+        the same name, making every third paper restrictively licensed.
+        Returns the expected output lines per relative chunk path.
+    """
+
+    expected = {}
+    for month_idx, month in enumerate(['2211', '2212']):
+        month_dir = os.path.join(root_dir, month)
+        os.makedirs(month_dir)
+        fp = os.path.join(month_dir, 'arXiv_src_000.jsonl')
+        expected_lines = []
+        with open(fp, 'wb') as f:
+            for i, ppr in enumerate(sample_pprs[month_idx::2]):
+                if i % 3 == 0:
+                    ppr = dict(ppr, metadata=dict(
+                        ppr['metadata'], license=RESTRICTIVE_LICENSE
+                    ))
+                line = (json.dumps(ppr) + '\n').encode('utf-8')
+                f.write(line)
+                if is_permissive(ppr['metadata']['license']):
+                    expected_lines.append(line)
+        expected[os.path.join(month, 'arXiv_src_000.jsonl')] = \
+            expected_lines
+    return expected
+
+
+def read_outputs(out_dir):
+    outputs = {}
+    for dir_path, _, fns in os.walk(out_dir):
+        for fn in fns:
+            fp = os.path.join(dir_path, fn)
+            with open(fp, 'rb') as f:
+                outputs[os.path.relpath(fp, out_dir)] = f.readlines()
+    return outputs
+
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_filter_permissive(sample_pprs, tmp_path, num_workers):
+    root_dir = str(tmp_path)
+    expected = write_month_dirs(root_dir, sample_pprs)
+    main(root_dir, num_workers)
+    # lines are copied as is, chunks of the same name are kept apart
+    assert read_outputs(os.path.join(root_dir, 'permissive_subset')) == \
+        expected
+
+
+def test_filter_permissive_error(sample_pprs, tmp_path, monkeypatch):
+    root_dir = str(tmp_path)
+    write_month_dirs(root_dir, sample_pprs)
+    get_license = filter_permissively_livensed.get_license_from_line
+    num_calls = []
+
+    def failing_get_license(line):
+        num_calls.append(1)
+        if len(num_calls) == 5:
+            raise ValueError('broken line')
+        return get_license(line)
+
+    monkeypatch.setattr(
+        filter_permissively_livensed, 'get_license_from_line',
+        failing_get_license
+    )
+    with pytest.raises(ValueError):
+        main(root_dir)
+    # no partially written output is left behind
+    assert read_outputs(os.path.join(root_dir, 'permissive_subset')) == {}
@@ -0,0 +1,124 @@
+import json
+import os
+import pytest
+from ml_tasks_prep_data import (
+    prep, prep_para, prep_paper, get_empty_prep_counts
+)
+from ml_tasks_split_data import iter_json_array
+
+PREP_FNS = ['license_information.json', 'imrad_data', 'citrec_data']
+
+
+def get_test_paper():
+    text = (
+        'See {{cite:b1}} and {{cite:b2}}, also {{cite:b1}} for '
+        '{{formula:f1}} in {{figure:g1}} and {{table:t1}}.'
+    )
+    cite_spans = []
+    ref_spans = []
+    for marker, ref_id, spans in [
+        ('{{cite:b1}}', 'b1', cite_spans),
+        ('{{cite:b2}}', 'b2', cite_spans),
+        ('{{cite:b1}}', 'b1', cite_spans),
+        ('{{formula:f1}}', 'f1', ref_spans),
+        ('{{figure:g1}}', 'g1', ref_spans),
+        ('{{table:t1}}', 't1', ref_spans),
+    ]:
+        start = text.index(marker, spans[-1]['end'] if spans else 0)
+        spans.append({
+            'start': start,
+            'end': start + len(marker),
+            'text': marker,
+            'ref_id': ref_id
+        })
+    ppr = {
+        'paper_id': '2212.00001',
+        'bib_entries': {
+            'b1': {
+                'bib_entry_raw': 'A. Author. First title.',
+                'ids': {'open_alex_id': 'https://openalex.org/W1'}
+            },
+            'b2': {
+                'bib_entry_raw': 'B. Author. Second title.',
+                'ids': {'open_alex_id': ''}
+            },
+        },
+        'ref_entries': {
+            'f1': {'type': 'formula', 'latex': 'x^2'},
+            'g1': {'type': 'figure', 'caption': 'A figure'},
+            't1': {'type': 'table', 'caption': 'A table'},
+        }
+    }
+    para = {'text': text, 'cite_spans': cite_spans, 'ref_spans': ref_spans}
+    return ppr, para
+
+
+def test_prep_para_markers():
+    ppr, para = get_test_paper()
+    para_prepd, cit_mrk_links = prep_para(ppr, para)
+    # (the closing brace of citation markers is kept, see prep_para)
+    assert para_prepd == (
+        'See [1]} and [2]}, also [1]} for \\(x^2\\) in <FIGURE> and '
+        '<TABLE>.'
+    )
+    # only references linked to OpenAlex get offsets
+    assert list(cit_mrk_links.keys()) == ['[1]']
+    link = cit_mrk_links['[1]']
+    assert link['id'] == 'https://openalex.org/W1'
+    assert link['ref'] == 'A. Author. First title.'
+    assert len(link['offsets']) == 2
+    for start, end in link['offsets']:
+        assert para_prepd[start:end] == '[1]'
+
+
+def test_prep_para_unlisted_markers():
+    # markers without a span are left as they are
+    ppr, para = get_test_paper()
+    para['cite_spans'] = para['cite_spans'][:1]
+    para_prepd, cit_mrk_links = prep_para(ppr, para)
+    assert para_prepd.startswith('See [1]} and {{cite:b2}}, also {{cite:b1}}')
+    assert cit_mrk_links['[1]']['offsets'] == [(4, 7)]
+
+
+def read_prep_output(dir_path, fn, ext):
+    fp = os.path.join(dir_path, fn)
+    if fn == 'license_information.json':
+        with open(fp) as f:
+            return json.load(f)
+    fp = '{}.{}'.format(fp, ext)
+    if ext == 'jsonl':
+        with open(fp) as f:
+            return [json.loads(line) for line in f]
+    return list(iter_json_array(fp))
+
+
+def test_prep_stream_same_as_json(prep_dirs):
+    for fn in PREP_FNS:
+        from_json = read_prep_output(prep_dirs['json'], fn, 'json')
+        from_jsonl = read_prep_output(prep_dirs['jsonl'], fn, 'jsonl')
+        assert len(from_json) > 0, fn
+        assert from_json == from_jsonl, fn
+
+
+def test_prep_paper_missing_categories(sample_pprs):
+    ppr = json.loads(json.dumps(sample_pprs[0]))
+    ppr['metadata']['categories'] = None
+    packets = prep_paper(ppr, get_empty_prep_counts())
+    assert packets is not None
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_prep_parallel_same_as_serial(
+        prep_dirs, chunked_data_dir, tmp_path, monkeypatch, stream
+):
+    ext = 'jsonl' if stream else 'json'
+    monkeypatch.chdir(tmp_path)
+    prep(chunked_data_dir, stream=stream, num_workers=2)
+    for fn in PREP_FNS:
+        if fn != 'license_information.json':
+            fn = '{}.{}'.format(fn, ext)
+        with open(os.path.join(prep_dirs[ext], fn), 'rb') as f:
+            serial = f.read()
+        with open(os.path.join(tmp_path, fn), 'rb') as f:
+            parallel = f.read()
+        assert parallel == serial, fn
@@ -0,0 +1,233 @@
+import json
+import os
+import random
+import pytest
+from ml_tasks_split_data import (
+    iter_json_array, split, split_hashed, add_sample_ids
+)
+
+SPLITS = ['train', 'dev', 'test']
+DEV_TEST_SIZE = 20
+DEV_TEST_FRAC = 0.1
+
+
+def random_json_value(rng, depth=0):
+    choice = rng.randint(0, 7 if depth < 3 else 4)
+    if choice == 0:
+        return rng.randint(-10**6, 10**6)
+    if choice == 1:
+        return rng.uniform(-1000, 1000)
+    if choice == 2:
+        return rng.choice([True, False, None])
+    if choice in [3, 4]:
+        return ''.join(rng.choice('ab ,[]{}"\\\né') for _ in range(5))
+    if choice == 5:
+        return [random_json_value(rng, depth+1) for _ in range(3)]
+    return {
+        str(i): random_json_value(rng, depth+1)
+        for i in range(rng.randint(0, 3))
+    }
+
+
+def test_iter_json_array(tmp_path):
+    rng = random.Random(42)
+    fp = os.path.join(tmp_path, 'array.json')
+    for i in range(100):
+        array = [random_json_value(rng) for _ in range(rng.randint(0, 10))]
+        with open(fp, 'w') as f:
+            if i % 2 == 0:
+                json.dump(array, f)
+            else:
+                json.dump(array, f, indent=2)
+        for read_size in [1, 2, 3, 7, 2**16]:
+            assert list(iter_json_array(fp, read_size)) == array
+
+
+@pytest.mark.parametrize('content', ['{"a": 1}', '[1, 2', '[{"a": 1}, '])
+def test_iter_json_array_invalid(tmp_path, content):
+    fp = os.path.join(tmp_path, 'invalid.json')
+    with open(fp, 'w') as f:
+        f.write(content)
+    with pytest.raises(ValueError):
+        list(iter_json_array(fp, 4))
+
+
+def run_split(out_dir, prep_dir, task, ext, hashed=False, to_split=None):
+    """ Split the prepared data of a task (imrad or citrec) within
+        out_dir, returning the contents of all output files.
+    """
+
+    if to_split is None:
+        to_split = os.path.join(prep_dir, '{}_data.{}'.format(task, ext))
+    license_fp = os.path.join(prep_dir, 'license_information.json')
+    os.makedirs(out_dir, exist_ok=True)
+    cwd = os.getcwd()
+    try:
+        os.chdir(out_dir)
+        if hashed:
+            split_hashed(to_split, license_fp, DEV_TEST_FRAC, None)
+        else:
+            split(to_split, license_fp, DEV_TEST_SIZE, None)
+    finally:
+        os.chdir(cwd)
+    outputs = {}
+    for fn in sorted(os.listdir(out_dir)):
+        with open(os.path.join(out_dir, fn)) as f:
+            outputs[fn.split('_data_')[-1]] = f.read()
+    return outputs
+
+
+def check_split_outputs(outputs):
+    """ Check that each split got samples, that sample IDs are unique,
+        and that there is one license record per paper, together listing
+        all samples. Returns the split of each sample ID.
+    """
+
+    smpl_splits = {}
+    for split_name in SPLITS:
+        lines = outputs['{}.jsonl'.format(split_name)].splitlines()
+        assert len(lines) > 0, split_name
+        for line in lines:
+            smpl_id = json.loads(line)['_id']
+            assert smpl_id not in smpl_splits
+            smpl_splits[smpl_id] = split_name
+    license_records = [
+        json.loads(line)
+        for line in outputs['license_info.jsonl'].splitlines()
+    ]
+    ppr_ids = [rec['paper_arxiv_id'] for rec in license_records]
+    assert len(ppr_ids) == len(set(ppr_ids))
+    license_smpl_ids = [
+        smpl_id for rec in license_records for smpl_id in rec['sample_ids']
+    ]
+    assert sorted(license_smpl_ids) == sorted(smpl_splits.keys())
+    return smpl_splits
+
+
+def test_sample_ids():
+    smpls = [
+        {'_paper_id': '2212.00001', 'text': 'same', 'label': 'i'},
+        {'_paper_id': '2212.00001', 'text': 'same', 'label': 'i'},
+        {'_paper_id': '2212.00001', 'text': 'other', 'label': 'm'}
+    ]
+    add_sample_ids(smpls)
+    smpl_ids = [smpl['_smpl_id'] for smpl in smpls]
+    # samples with identical content get distinct IDs
+    assert len(set(smpl_ids)) == 3
+    # IDs only depend on the samples
+    rerun_smpls = [
+        {k: v for k, v in smpl.items() if k != '_smpl_id'} for smpl in smpls
+    ]
+    add_sample_ids(rerun_smpls)
+    assert [smpl['_smpl_id'] for smpl in rerun_smpls] == smpl_ids
+
+
+def test_split_deterministic(prep_dirs, tmp_path):
+    # (in the data sample no cited document is cited by enough papers to
+    # be a usable citrec label)
+    task = 'imrad'
+    outputs = run_split(
+        os.path.join(tmp_path, 'a'), prep_dirs['jsonl'], task, 'jsonl'
+    )
+    check_split_outputs(outputs)
+    assert run_split(
+        os.path.join(tmp_path, 'b'), prep_dirs['jsonl'], task, 'jsonl'
+    ) == outputs
+    # JSON input gives the same splits
+    assert run_split(
+        os.path.join(tmp_path, 'c'), prep_dirs['json'], task, 'json'
+    ) == outputs
+
+
+def get_paper_splits(outputs):
+    """ Determine the split of each paper from split outputs.
+    """
+
+    smpl_splits = {}
+    for split_name in SPLITS:
+        for line in outputs['{}.jsonl'.format(split_name)].splitlines():
+            smpl_splits[json.loads(line)['_id']] = split_name
+    ppr_splits = {}
+    for line in outputs['license_info.jsonl'].splitlines():
+        rec = json.loads(line)
+        rec_splits = set(smpl_splits[i] for i in rec['sample_ids'])
+        # all samples of a paper are in the same split
+        assert len(rec_splits) == 1
+        ppr_splits[rec['paper_arxiv_id']] = rec_splits.pop()
+    return ppr_splits
+
+
+def run_split_hashed_lines(out_dir, prep_dir, task, lines):
+    """ Hashed split of the given packet lines within out_dir.
+    """
+
+    os.makedirs(out_dir)
+    to_split = os.path.join(out_dir, f'{task}_data.jsonl')
+    with open(to_split, 'w') as f:
+        f.writelines(lines)
+    return run_split(
+        os.path.join(out_dir, 'out'), prep_dir, task, 'jsonl',
+        hashed=True, to_split=to_split
+    )
+
+
+@pytest.mark.parametrize('task', ['imrad', 'citrec'])
+def test_split_hashed_deterministic(prep_dirs, tmp_path, task):
+    outputs = run_split(
+        os.path.join(tmp_path, 'a'), prep_dirs['jsonl'], task, 'jsonl',
+        hashed=True
+    )
+    check_split_outputs(outputs)
+    get_paper_splits(outputs)
+    assert run_split(
+        os.path.join(tmp_path, 'b'), prep_dirs['json'], task, 'json',
+        hashed=True
+    ) == outputs
+    # the assignment does not depend on the order of the input
+    with open(os.path.join(prep_dirs['jsonl'], f'{task}_data.jsonl')) as f:
+        lines = f.readlines()
+    random.Random(42).shuffle(lines)
+    shuffled_outputs = run_split_hashed_lines(
+        os.path.join(tmp_path, 'c'), prep_dirs['jsonl'], task, lines
+    )
+    for fn, output in outputs.items():
+        assert sorted(shuffled_outputs[fn].splitlines()) == \
+            sorted(output.splitlines()), fn
+
+
+def test_split_hashed_append(prep_dirs, tmp_path):
+    task = 'imrad'
+    with open(os.path.join(prep_dirs['jsonl'], f'{task}_data.jsonl')) as f:
+        lines = f.readlines()
+    full_splits = get_paper_splits(run_split(
+        os.path.join(tmp_path, 'full'), prep_dirs['jsonl'], task, 'jsonl',
+        hashed=True
+    ))
+    # appending papers never changes the split of existing papers
+    for num_lines in [5, 10, 25, len(lines) - 1]:
+        ppr_splits = get_paper_splits(run_split_hashed_lines(
+            os.path.join(tmp_path, f'first{num_lines}'), prep_dirs['jsonl'],
+            task, lines[:num_lines]
+        ))
+        assert len(ppr_splits) == num_lines
+        for ppr_id, split_name in ppr_splits.items():
+            assert split_name == full_splits[ppr_id], ppr_id
+    # shards split separately give the same splits
+    shard_splits = {}
+    for i, shard_lines in enumerate([lines[:20], lines[20:]]):
+        shard_splits.update(get_paper_splits(run_split_hashed_lines(
+            os.path.join(tmp_path, f'shard{i}'), prep_dirs['jsonl'], task,
+            shard_lines
+        )))
+    assert shard_splits == full_splits
+
+
+@pytest.mark.parametrize('frac', [0, 0.5, -0.1, 0.7])
+def test_split_hashed_invalid_frac(prep_dirs, frac):
+    with pytest.raises(ValueError):
+        split_hashed(
+            os.path.join(prep_dirs['jsonl'], 'imrad_data.jsonl'),
+            os.path.join(prep_dirs['jsonl'], 'license_information.json'),
+            frac,
+            None
+        )
@@ -0,0 +1,186 @@
+import json
+import os
+import re
+import pytest
+from lxml import etree
+from benchmark import _paper_to_tralics_xml
+from parse_latex_tralics import (
+    _process_tralics_xml, _open_formula_db, _intern_formulae,
+    _tralics_timeout, _iter_parse_queue, FORMULA_INTERN_MIN_LEN,
+    TRALICS_TIMEOUT_MAX, TRALICS_RETRY_TIMEOUT_FACTOR,
+    TRALICS_RETRY_TIMEOUT_MAX
+)
+from unarxive_reader import iter_papers
+
+MARKER_PATT = re.compile(r'{{(cite|formula|figure|table):([^}]+)}}')
+
+TEST_XML = '''<std>
+<title>A <formula><texmath>t</texmath></formula> title</title>
+<div0 id-text="1"><head>Introduction</head>
+<p>Text <formula><texmath>x^2</texmath></formula> more <cit><ref target="bid0"/></cit> and <cit><ref target="bid9"/></cit> end <ref target="uid3"/>.<unexpected/> gone</p>
+<figure><head>A figure with <formula><texmath>y</texmath></formula></head></figure>
+<float type="table"><caption>A table</caption></float>
+</div0>
+<Bibliography><p><bibitem id="bid0"/>A. Author. A title <formula><texmath>z_1</texmath></formula>. <xref url="https://arxiv.org/abs/2101.00001">arXiv:2101.00001</xref></p></Bibliography>
+</std>'''
+
+
+def process_xml(xml, aid='2212.00001'):
+    warnings = []
+    tree = etree.ElementTree(etree.fromstring(xml))
+    result = _process_tralics_xml(tree, aid, warnings.append)
+    return result, warnings
+
+
+def test_process_tralics_xml():
+    result, warnings = process_xml(TEST_XML)
+    ref_entries, bib_entries, paras, num_cits, num_cits_notfound = result
+    assert num_cits == 2
+    assert num_cits_notfound == 1
+    assert warnings == ['unmatched bibliography key bid9']
+    # formulae within figures are part of the caption, formulae within
+    # the title and bib entries are ref entries
+    by_content = {
+        e.get('latex', e.get('caption')): (ref_id, e['type'])
+        for ref_id, e in ref_entries.items()
+    }
+    assert sorted(by_content.keys()) == \
+        ['A figure with y', 'A table', 't', 'x^2', 'z_1']
+    assert by_content['A figure with y'][1] == 'figure'
+    assert by_content['A table'][1] == 'table'
+    # bib entries
+    assert len(bib_entries) == 1
+    bib_id, bib_entry = next(iter(bib_entries.items()))
+    assert bib_entry['bib_entry_raw'] == (
+        'A. Author. A title {{{{formula:{}}}}} . arXiv:2101.00001'
+    ).format(by_content['z_1'][0])
+    assert [i['id'] for i in bib_entry['contained_arXiv_ids']] == \
+        ['2101.00001']
+    # body text (the title is removed, as is the tail of <unexpected/>)
+    assert len(paras) == 1
+    para = paras[0]
+    assert para['section'] == 'Introduction'
+    assert para['text'] == (
+        'Text {{{{formula:{}}}}}  more {{{{cite:{}}}}} and  end REF .\n'
+        '{{{{figure:{}}}}}{{{{table:{}}}}}'
+    ).format(
+        by_content['x^2'][0], bib_id, by_content['A figure with y'][0],
+        by_content['A table'][0]
+    )
+    assert [s['ref_id'] for s in para['cite_spans']] == [bib_id]
+    for span in para['cite_spans'] + para['ref_spans']:
+        assert para['text'][span['start']:span['end']] == span['text']
+
+
+def test_process_tralics_xml_ids_deterministic(sample_pprs):
+    assert process_xml(TEST_XML) == process_xml(TEST_XML)
+    # IDs depend on the paper
+    ref_entries_a = process_xml(TEST_XML)[0][0]
+    ref_entries_b = process_xml(TEST_XML, '2212.00002')[0][0]
+    assert set(ref_entries_a).isdisjoint(ref_entries_b)
+    # and are the same on reruns for real papers
+    for ppr in sample_pprs[:10]:
+        xml = _paper_to_tralics_xml(ppr)
+        assert process_xml(xml, ppr['paper_id']) == \
+            process_xml(xml, ppr['paper_id'])
+
+
+def test_process_tralics_xml_sample(sample_pprs):
+    for ppr in sample_pprs:
+        xml = _paper_to_tralics_xml(ppr)
+        result, warnings = process_xml(xml, ppr['paper_id'])
+        ref_entries, bib_entries, paras, num_cits, num_cits_notfound = \
+            result
+        assert num_cits == xml.count(b'<cit>')
+        assert len(paras) > 0
+        # all markers in the text refer to entries of the paper
+        for para in paras:
+            for m in MARKER_PATT.finditer(para['text']):
+                if m.group(1) == 'cite':
+                    assert m.group(2) in bib_entries
+                else:
+                    assert ref_entries[m.group(2)]['type'] == m.group(1)
+
+
+def test_intern_formulae(tmp_path):
+    formula_db_fp = os.path.join(tmp_path, 'formulae.db')
+    conn = _open_formula_db(formula_db_fp)
+    long_latex = 'x' * FORMULA_INTERN_MIN_LEN
+    ref_entries = {
+        'f1': {'type': 'formula', 'latex': long_latex},
+        'f2': {'type': 'formula', 'latex': long_latex},
+        'f3': {'type': 'formula', 'latex': 'x'},
+        'f4': {'type': 'formula', 'latex': 'NO_LATEX_CONTENT'},
+        'f5': {'type': 'formula', 'latex': long_latex + 'y'},
+        'g1': {'type': 'figure', 'caption': long_latex},
+    }
+    bib_entries = {
+        'b1': {'bib_entry_raw': 'A title with {{formula:f5}} in it.'}
+    }
+    _intern_formulae(ref_entries, bib_entries, conn.cursor())
+    conn.commit()
+    latex_hash = ref_entries['f1']['latex_hash']
+    assert 'latex' not in ref_entries['f1']
+    assert ref_entries['f2'] == ref_entries['f1']
+    # short formulae, missing LaTeX, formulae within bib entries, and
+    # other ref entries are left as they are
+    assert ref_entries['f3'] == {'type': 'formula', 'latex': 'x'}
+    assert ref_entries['f4']['latex'] == 'NO_LATEX_CONTENT'
+    assert ref_entries['f5']['latex'] == long_latex + 'y'
+    assert ref_entries['g1'] == {'type': 'figure', 'caption': long_latex}
+    assert conn.execute('select hash, latex from formula').fetchall() == \
+        [(latex_hash, long_latex)]
+    conn.close()
+
+
+def test_formula_store_round_trip(sample_pprs, tmp_path):
+    # interned papers read with the formula store equal the originals
+    formula_db_fp = os.path.join(tmp_path, 'formulae.db')
+    conn = _open_formula_db(formula_db_fp)
+    data_dir = os.path.join(tmp_path, 'data')
+    os.makedirs(data_dir)
+    num_interned = 0
+    with open(os.path.join(data_dir, 'arXiv_src_2212_000.jsonl'), 'w') as f:
+        for ppr in sample_pprs:
+            ppr = json.loads(json.dumps(ppr))
+            _intern_formulae(
+                ppr['ref_entries'], ppr['bib_entries'], conn.cursor()
+            )
+            num_interned += len([
+                e for e in ppr['ref_entries'].values() if 'latex_hash' in e
+            ])
+            f.write(json.dumps(ppr) + '\n')
+    conn.commit()
+    conn.close()
+    assert num_interned > 0
+    expanded = list(iter_papers(data_dir, formula_db_fp=formula_db_fp))
+    for ppr in expanded:
+        for ref_entry in ppr['ref_entries'].values():
+            ref_entry.pop('latex_hash', None)
+    assert expanded == sample_pprs
+
+
+def test_tralics_timeout():
+    # small papers get at least the fixed timeout of earlier versions
+    assert _tralics_timeout(0) >= 5
+    assert _tralics_timeout(10 * 2**10) < _tralics_timeout(500 * 2**10)
+    assert _tralics_timeout(100 * 2**20) == TRALICS_TIMEOUT_MAX
+    assert _tralics_timeout(10 * 2**10, retry=True) == pytest.approx(
+        _tralics_timeout(10 * 2**10) * TRALICS_RETRY_TIMEOUT_FACTOR
+    )
+    assert _tralics_timeout(100 * 2**20, retry=True) == \
+        TRALICS_RETRY_TIMEOUT_MAX
+
+
+def test_iter_parse_queue():
+    fns = ['a.tex', 'b.tex', 'c.tex']
+    retry_fns = []
+    queued = []
+    for fn, retry in _iter_parse_queue(fns, retry_fns):
+        queued.append((fn, retry))
+        if fn == 'b.tex' and not retry:
+            retry_fns.append(fn)
+    assert queued == [
+        ('a.tex', False), ('b.tex', False), ('c.tex', False),
+        ('b.tex', True)
+    ]
@@ -0,0 +1,126 @@
+import gzip
+import json
+import os
+import pytest
+from multiprocessing import Pool
+from pipeline_log import (
+    open_log, write_log, flush_log, close_log, start_paper_log,
+    end_paper_log, start_stage, end_stage, LOG_FN
+)
+
+
+def read_log(log_dir):
+    with open(os.path.join(log_dir, LOG_FN)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_buffered(tmp_path):
+    log = open_log(tmp_path, buffer_size=3)
+    write_log(log, {'i': 0})
+    write_log(log, {'i': 1})
+    assert not os.path.exists(os.path.join(tmp_path, LOG_FN))
+    write_log(log, {'i': 2})
+    assert read_log(tmp_path) == [{'i': 0}, {'i': 1}, {'i': 2}]
+    write_log(log, {'i': 3})
+    close_log(log)
+    assert read_log(tmp_path) == [{'i': i} for i in range(4)]
+    # flushing an empty buffer doesn’t touch the file
+    flush_log(log)
+    assert len(read_log(tmp_path)) == 4
+
+
+def test_disabled(tmp_path):
+    log = open_log(tmp_path, enabled=False, buffer_size=1)
+    write_log(log, {'i': 0})
+    close_log(log)
+    assert os.listdir(tmp_path) == []
+
+
+def test_paper_log(tmp_path):
+    log = open_log(tmp_path)
+    ppr_log = start_paper_log('2105.05862', 'parse')
+    assert start_stage(ppr_log) is None
+    end_stage(ppr_log, 'tralics', None)
+    ppr_log['warnings'].append('unmatched bibliography key bid3')
+    end_paper_log(log, ppr_log, failure='tralics_timeout', failure_detail=5)
+    close_log(log)
+    [record] = read_log(tmp_path)
+    assert record['paper_id'] == '2105.05862'
+    assert record['stage'] == 'parse'
+    assert record['seconds'] >= 0
+    assert record['warnings'] == ['unmatched bibliography key bid3']
+    assert record['failure'] == 'tralics_timeout'
+    assert record['failure_detail'] == '5'
+    assert 'timings' not in record and 'archive' not in record
+    assert '_start' not in record
+
+
+def test_paper_log_timing(tmp_path):
+    log = open_log(tmp_path)
+    ppr_log = start_paper_log(
+        'hep-th0309136', 'normalize', archive='arXiv_src_0309_001.tar',
+        timing=True
+    )
+    for num_bytes in [10, 20]:
+        started = start_stage(ppr_log)
+        end_stage(ppr_log, 'hash', started, num_bytes=num_bytes)
+    end_stage(ppr_log, 'extract', start_stage(ppr_log))
+    end_paper_log(log, ppr_log)
+    close_log(log)
+    [record] = read_log(tmp_path)
+    assert record['archive'] == 'arXiv_src_0309_001.tar'
+    assert record['failure'] is None
+    timings = record['timings']
+    assert list(timings) == ['hash', 'extract']
+    # stages timed multiple times are summed up
+    assert timings['hash']['count'] == 2
+    assert timings['hash']['bytes'] == 30
+    assert timings['extract']['count'] == 1
+    assert timings['extract']['bytes'] is None
+    for stage_timing in timings.values():
+        assert stage_timing['wall'] >= 0 and stage_timing['cpu'] >= 0
+
+
+def write_records(args):
+    log_dir, worker = args
+    log = open_log(log_dir, buffer_size=7)
+    for i in range(100):
+        write_log(log, {'worker': worker, 'i': i, 'pad': 'x' * 1000})
+    close_log(log)
+
+
+def test_multiple_processes(tmp_path):
+    with Pool(4) as pool:
+        pool.map(write_records, [(str(tmp_path), w) for w in range(4)])
+    records = read_log(tmp_path)
+    # no records lost or interleaved
+    assert sorted((r['worker'], r['i']) for r in records) == \
+        [(w, i) for w in range(4) for i in range(100)]
+
+
+def test_normalize_closes_logs_on_error(tmp_path, monkeypatch):
+    pytest.importorskip('chardet')
+    pytest.importorskip('magic')
+    import normalize_arxiv_dump
+    in_dir = os.path.join(tmp_path, 'in')
+    out_dir = os.path.join(tmp_path, 'out')
+    os.makedirs(in_dir)
+    for aid in ['2212.00001', '2212.00002']:
+        with gzip.open(os.path.join(in_dir, aid + '.gz'), 'wt') as f:
+            f.write('\\begin{document}\nfoo\n\\end{document}\n')
+    read_gzipped_file = normalize_arxiv_dump.read_gzipped_file
+    num_calls = []
+
+    def failing_read_gzipped_file(fp):
+        num_calls.append(1)
+        if len(num_calls) == 2:
+            raise OSError('broken archive')
+        return read_gzipped_file(fp)
+
+    monkeypatch.setattr(
+        normalize_arxiv_dump, 'read_gzipped_file', failing_read_gzipped_file
+    )
+    with pytest.raises(OSError):
+        normalize_arxiv_dump.normalize(in_dir, out_dir)
+    # the record of the paper processed before the error is written
+    assert len(read_log(out_dir)) == 1
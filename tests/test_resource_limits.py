@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+from resource_limits import run_limited, get_limit_failure, get_limits
+
+
+def run(args, limits, tmp_path):
+    stderr_fp = os.path.join(tmp_path, 'stderr.txt')
+    with open(stderr_fp, 'w') as err:
+        proc = run_limited(
+            args, limits, stdout=subprocess.DEVNULL, stderr=err,
+            cwd=tmp_path, timeout=30
+        )
+    return get_limit_failure('tool', proc, limits, stderr_fp)
+
+
+def test_no_failure(tmp_path):
+    limits = get_limits()
+    assert run(['true'], limits, tmp_path) is None
+    # exiting with an error is not a limit failure
+    assert run(['sh', '-c', 'exit 1'], limits, tmp_path) is None
+
+
+def test_cpu_limit(tmp_path):
+    limits = get_limits(cpu=1)
+    busy_loop = 'while True: pass'
+    # SIGXCPU at the soft limit
+    assert run([sys.executable, '-c', busy_loop], limits, tmp_path) == \
+        'tool_cpu_limit'
+    # SIGKILL at the hard limit
+    assert run(
+        [
+            sys.executable, '-c',
+            'import signal\n'
+            'signal.signal(signal.SIGXCPU, signal.SIG_IGN)\n' + busy_loop
+        ],
+        limits,
+        tmp_path
+    ) == 'tool_cpu_limit'
+
+
+def test_killed(tmp_path):
+    limits = get_limits(cpu=10)
+    # killed before reaching the CPU limit
+    assert run(['sh', '-c', 'kill -9 $$'], limits, tmp_path) == 'tool_killed'
+    # (through a shell)
+    assert run(
+        ['sh', '-c', 'sh -c "kill -9 \\$\\$"; exit $?'], limits, tmp_path
+    ) == 'tool_killed'
+    assert run(
+        ['sh', '-c', 'kill -9 $$'], get_limits(None, None, None), tmp_path
+    ) == 'tool_killed'
+
+
+def test_output_limit(tmp_path):
+    limits = get_limits(output=2**16)
+    assert run(
+        ['sh', '-c', 'head -c 1000000 /dev/zero > out'], limits, tmp_path
+    ) == 'tool_output_limit'
+
+
+def test_memory_limit(tmp_path):
+    limits = get_limits(memory=2**28)
+    assert run(
+        [sys.executable, '-c', 'x = bytearray(2**30)'], limits, tmp_path
+    ) == 'tool_memory_limit'
@@ -0,0 +1,102 @@
+import os
+import pytest
+from collections import defaultdict
+from calc_stats import (
+    paper_stats, refmatch_rate, get_coarse_arxiv_category,
+    get_coarse_arxiv_group_name, get_license_coarse_name
+)
+from stats_cube import (
+    calc_stats_cube, get_stats_cube, load_cube, query_cube, MEASURES
+)
+
+
+@pytest.fixture(scope='module')
+def cube_fp(chunked_data_dir, tmp_path_factory):
+    fp = os.path.join(tmp_path_factory.mktemp('cube'), 'stats_cube.npz')
+    calc_stats_cube(chunked_data_dir, save_fp=fp)
+    return fp
+
+
+def expected_sums(sample_pprs, get_group_key, measures, keep=None):
+    """ Aggregate paper_stats of the sample papers the slow way.
+    """
+
+    sums = defaultdict(lambda: defaultdict(int))
+    for ppr in sample_pprs:
+        stats = paper_stats(ppr)
+        if keep is not None and not keep(stats):
+            continue
+        group_sums = sums[get_group_key(stats)]
+        for measure in measures:
+            if measure == 'num_pprs':
+                group_sums[measure] += 1
+            else:
+                group_sums[measure] += stats[measure]
+    return {k: dict(v) for k, v in sums.items()}
+
+
+def get_discipline(stats):
+    return get_coarse_arxiv_group_name(
+        get_coarse_arxiv_category(stats['main_fine_cat'])
+    ) or ''
+
+
+def get_license_coarse(stats):
+    return get_license_coarse_name(stats['license_url']) or ''
+
+
+def test_query_derived_dims(cube_fp, sample_pprs):
+    cube = load_cube(cube_fp)
+    measures = ['num_pprs', 'num_refs', 'num_cit_markers']
+    result = query_cube(
+        cube, measures, group_by=['discipline', 'year', 'license_coarse']
+    )
+    assert result == expected_sums(
+        sample_pprs,
+        lambda s: (get_discipline(s), s['month'][:4], get_license_coarse(s)),
+        measures
+    )
+    # filtering on a derived dimension
+    disc = get_discipline(paper_stats(sample_pprs[0]))
+    result = query_cube(
+        cube, measures, group_by=['group'], where={'discipline': [disc]}
+    )
+    assert result == expected_sums(
+        sample_pprs,
+        lambda s: (get_coarse_arxiv_category(s['main_fine_cat']) or '',),
+        measures,
+        keep=lambda s: get_discipline(s) == disc
+    )
+    # no grouping sums up everything
+    assert query_cube(cube)[()] == expected_sums(
+        sample_pprs, lambda s: (), MEASURES
+    )[()]
+
+
+def test_query_unknown_dim(cube_fp):
+    with pytest.raises(ValueError):
+        query_cube(load_cube(cube_fp), group_by=['color'])
+
+
+def test_cube_parallel_same_as_serial(chunked_data_dir, cube_fp, tmp_path):
+    parallel = calc_stats_cube(
+        chunked_data_dir, num_workers=2,
+        save_fp=os.path.join(tmp_path, 'stats_cube.npz')
+    )
+    assert query_cube(parallel, group_by=['category', 'month', 'license']) \
+        == query_cube(
+            load_cube(cube_fp), group_by=['category', 'month', 'license']
+        )
+
+
+def test_refmatch_rate(chunked_data_dir, sample_pprs, tmp_path):
+    save_fp = os.path.join(tmp_path, 'stats_cube.npz')
+    sums = expected_sums(
+        sample_pprs, lambda s: (), ['num_refs', 'num_refs_linked']
+    )[()]
+    expected_rate = sums['num_refs_linked'] / sums['num_refs']
+    assert refmatch_rate(chunked_data_dir, save_fp=save_fp) == expected_rate
+    # answered from the persisted cube
+    assert os.path.isfile(save_fp)
+    assert get_stats_cube('/nonexistent', save_fp=save_fp) is not None
+    assert refmatch_rate('/nonexistent', save_fp=save_fp) == expected_rate
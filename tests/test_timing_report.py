@@ -0,0 +1,152 @@
+import os
+import pytest
+from pipeline_log import (
+    open_log, write_log, close_log, start_paper_log, end_paper_log,
+    start_stage, end_stage
+)
+from timing_report import (
+    get_log_fps, iter_paper_records, summarize_timings, print_timing_report,
+    LOG_FN
+)
+
+
+def paper_record(paper_id, stage, time, timings, archive=None, failure=None):
+    record = {
+        'paper_id': paper_id,
+        'stage': stage,
+        'time': time,
+        'seconds': sum(t['wall'] for t in timings.values()),
+        'warnings': [],
+        'failure': failure,
+        'failure_detail': None,
+        'timings': timings
+    }
+    if archive is not None:
+        record['archive'] = archive
+    return record
+
+
+def timing(wall, cpu=None, num_bytes=None):
+    return {
+        'count': 1, 'wall': wall, 'cpu': wall if cpu is None else cpu,
+        'bytes': num_bytes
+    }
+
+
+@pytest.fixture
+def log_dirs(tmp_path):
+    """ Logs of a normalize and a parse run in two output directories (the
+        latter with a nested one).
+    """
+
+    norm_dir = os.path.join(tmp_path, 'normalized')
+    parse_dir = os.path.join(tmp_path, 'parsed')
+    nested_dir = os.path.join(parse_dir, 'sub')
+    for d in [norm_dir, nested_dir]:
+        os.makedirs(d)
+    log = open_log(norm_dir)
+    for i in range(4):
+        write_log(log, paper_record(
+            '2212.0000{}'.format(i), 'normalize', 100 + i,
+            {'hash': timing(0.5, num_bytes=2**20), 'latexpand': timing(0.5)},
+            archive='arXiv_src_2212_00{}.tar'.format(i % 2)
+        ))
+    # records without timings are ignored
+    write_log(log, {'paper_id': '2212.00009', 'stage': 'normalize'})
+    write_log(log, {'note': 'not a paper record'})
+    close_log(log)
+    for log_dir, offset in [(parse_dir, 0), (nested_dir, 2)]:
+        log = open_log(log_dir)
+        for i in range(2):
+            write_log(log, paper_record(
+                '2212.0000{}'.format(i + offset), 'parse', 200,
+                {'tralics': timing(i + offset + 1, cpu=1)},
+                failure='tralics_timeout' if i + offset == 3 else None
+            ))
+        close_log(log)
+    return [norm_dir, parse_dir]
+
+
+def test_get_log_fps(log_dirs, tmp_path):
+    assert get_log_fps(log_dirs) == [
+        os.path.join(log_dirs[0], LOG_FN),
+        os.path.join(log_dirs[1], LOG_FN),
+        os.path.join(log_dirs[1], 'sub', LOG_FN)
+    ]
+    # log files can be given directly, other directories contribute none
+    log_fp = os.path.join(log_dirs[0], LOG_FN)
+    assert get_log_fps([log_fp, str(tmp_path / 'nonexistent')]) == [log_fp]
+
+
+def test_iter_paper_records(log_dirs):
+    records = list(iter_paper_records(get_log_fps(log_dirs)))
+    assert [(r['stage'], r['paper_id']) for r in records] == \
+        [('normalize', '2212.0000{}'.format(i)) for i in range(4)] + \
+        [('parse', '2212.0000{}'.format(i)) for i in range(4)]
+
+
+def test_summarize_timings(log_dirs):
+    summary = summarize_timings(
+        iter_paper_records(get_log_fps(log_dirs)), num_slowest=2
+    )
+    assert list(summary) == ['normalize', 'parse']
+    norm = summary['normalize']
+    assert norm['num_papers'] == 4
+    assert norm['failures'] == {}
+    # papers started at 100 … 103, each taking 1s
+    assert norm['papers_per_sec'] == pytest.approx(4 / 4)
+    assert list(norm['paper_seconds']) == [1, 1, 1]
+    assert list(norm['stages']) == ['hash', 'latexpand']
+    hash_summary = norm['stages']['hash']
+    assert hash_summary['num_papers'] == 4
+    assert list(hash_summary['wall']) == [0.5, 0.5, 0.5]
+    assert hash_summary['share'] == pytest.approx(0.5)
+    assert hash_summary['mb_per_sec'] == pytest.approx(2)
+    assert norm['stages']['latexpand']['mb_per_sec'] is None
+    assert list(norm['archives']) == \
+        ['arXiv_src_2212_000.tar', 'arXiv_src_2212_001.tar']
+    assert norm['archives']['arXiv_src_2212_000.tar']['num_papers'] == 2
+    assert norm['archives']['arXiv_src_2212_000.tar']['seconds'] == 2
+    parse = summary['parse']
+    assert parse['failures'] == {'tralics_timeout': 1}
+    # all parse papers started at 200, the slowest taking 4s
+    assert parse['papers_per_sec'] == pytest.approx(4 / 4)
+    assert parse['paper_seconds'][0] == pytest.approx(2.5)
+    assert parse['stages']['tralics']['share'] == 1
+    assert list(parse['stages']['tralics']['cpu']) == [1, 1, 1]
+    assert list(parse['archives']) == [None]
+    assert [r['paper_id'] for r in parse['slowest']] == \
+        ['2212.00003', '2212.00002']
+
+
+def test_summarize_no_records():
+    assert summarize_timings([]) == {}
+
+
+def test_print_timing_report(log_dirs, capsys):
+    print_timing_report(summarize_timings(
+        iter_paper_records(get_log_fps(log_dirs))
+    ))
+    out = capsys.readouterr().out
+    assert '- - - normalize - - -' in out
+    assert '4 papers, 1.00 papers/sec' in out
+    assert 'failed (tralics_timeout): 1' in out
+    assert '2212.00003\t4.00s\t(mostly tralics) failed: tralics_timeout' \
+        in out
+
+
+def test_pipeline_log_records(tmp_path):
+    log = open_log(tmp_path)
+    for paper_id in ['2212.00001', '2212.00002']:
+        ppr_log = start_paper_log(
+            paper_id, 'parse', archive='arXiv_src_2212_001.tar', timing=True
+        )
+        end_stage(ppr_log, 'tralics', start_stage(ppr_log), num_bytes=1)
+        end_paper_log(log, ppr_log)
+    # records without timings are skipped
+    end_paper_log(log, start_paper_log('2212.00003', 'parse'))
+    close_log(log)
+    summary = summarize_timings(iter_paper_records(get_log_fps([tmp_path])))
+    assert summary['parse']['num_papers'] == 2
+    assert summary['parse']['stages']['tralics']['num_papers'] == 2
+    assert list(summary['parse']['archives']) == ['arXiv_src_2212_001.tar']
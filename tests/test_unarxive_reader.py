@@ -0,0 +1,106 @@
+import json
+import os
+import pytest
+from unarxive_reader import (
+    get_paper_filter, paper_matches, iter_papers, get_paper,
+    gen_offset_index, get_license_from_line, get_metadata_from_line
+)
+
+
+def paper_ids(pprs):
+    return sorted(ppr['paper_id'] for ppr in pprs)
+
+
+def test_no_filter(data_dir, sample_pprs):
+    assert get_paper_filter() is None
+    assert paper_ids(iter_papers(data_dir)) == paper_ids(sample_pprs)
+
+
+def test_paper_id_filter(data_dir, sample_pprs):
+    wanted = paper_ids(sample_pprs)[:3]
+    assert paper_ids(iter_papers(data_dir, paper_ids=wanted)) == wanted
+
+
+def test_month_filter(data_dir, sample_pprs):
+    # the sample only contains papers from 2022-12
+    assert len(list(iter_papers(data_dir, from_month='2022-12'))) == \
+        len(sample_pprs)
+    assert len(list(iter_papers(data_dir, until_month='2022-12'))) == \
+        len(sample_pprs)
+    assert list(iter_papers(data_dir, from_month='2023-01')) == []
+    assert list(iter_papers(data_dir, until_month='2022-11')) == []
+
+
+def test_category_filter(data_dir, sample_pprs):
+    expected = [
+        ppr for ppr in sample_pprs
+        if 'hep-ph' in ppr['metadata']['categories'].split(' ')
+    ]
+    assert len(expected) > 0
+    assert paper_ids(iter_papers(data_dir, categories=['hep-ph'])) == \
+        paper_ids(expected)
+    # archives and groups are resolved to their categories
+    cs_pprs = list(iter_papers(data_dir, categories=['cs']))
+    assert len(cs_pprs) > 0
+    for ppr in cs_pprs:
+        assert any(
+            c.startswith('cs.')
+            for c in ppr['metadata']['categories'].split(' ')
+        )
+    with pytest.raises(ValueError):
+        get_paper_filter(categories=['no-such-category'])
+
+
+def test_license_filter(data_dir, sample_pprs):
+    lic = 'http://creativecommons.org/licenses/by-sa/4.0/'
+    expected = [
+        ppr for ppr in sample_pprs if ppr['metadata']['license'] == lic
+    ]
+    assert paper_ids(iter_papers(data_dir, licenses=[lic])) == \
+        paper_ids(expected)
+
+
+def test_missing_metadata_values():
+    ppr_filter = get_paper_filter(
+        categories=['cs.CL'], licenses=[None]
+    )
+    ppr = {
+        'paper_id': '2212.00001',
+        'metadata': {'categories': None, 'license': None}
+    }
+    assert not paper_matches(ppr, ppr_filter)
+    ppr['metadata']['categories'] = 'cs.CL'
+    assert paper_matches(ppr, ppr_filter)
+    ppr_filter = get_paper_filter(licenses=[None])
+    assert paper_matches({'paper_id': '2212.00001'}, ppr_filter)
+
+
+def test_projection(data_dir, sample_pprs):
+    pprs = list(iter_papers(data_dir, fields=['bib_entries']))
+    assert len(pprs) == len(sample_pprs)
+    for ppr in pprs:
+        assert set(ppr.keys()) == {'paper_id', 'bib_entries'}
+
+
+def test_parallel_same_as_serial(chunked_data_dir):
+    kwargs = {'categories': ['physics'], 'fields': ['metadata']}
+    serial = list(iter_papers(chunked_data_dir, **kwargs))
+    parallel = list(iter_papers(chunked_data_dir, num_workers=2, **kwargs))
+    assert len(serial) > 0
+    assert parallel == serial
+
+
+def test_get_paper(data_dir, sample_pprs, tmp_path):
+    ppr = sample_pprs[len(sample_pprs) // 2]
+    assert get_paper(data_dir, ppr['paper_id']) == ppr
+    index_fp = os.path.join(tmp_path, 'index.db')
+    gen_offset_index(data_dir, index_fp)
+    assert get_paper(data_dir, ppr['paper_id'], index_fp) == ppr
+    assert get_paper(data_dir, '0000.00000', index_fp) is None
+
+
+def test_metadata_from_line(sample_pprs):
+    ppr = sample_pprs[0]
+    line = json.dumps(ppr)
+    assert get_metadata_from_line(line) == ppr['metadata']
+    assert get_license_from_line(line) == ppr['metadata']['license']
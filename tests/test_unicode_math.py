@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import pytest
+import unarxive_reader
+import unicode_math
+from ml_tasks_prep_data import prep
+from unicode_math import latex_to_unicode_batch, set_cache, flush_cache
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    """ Record the formulae actually converted (i.e. not cached), starting
+        with empty caches.
+    """
+
+    set_cache(None)
+    unicode_math._memo.clear()
+    converted = []
+    convert = unicode_math._convert
+
+    def recording_convert(latex):
+        converted.append(latex)
+        return convert(latex)
+
+    monkeypatch.setattr(unicode_math, '_convert', recording_convert)
+    yield converted
+    set_cache(None)
+    unicode_math._memo.clear()
+
+
+def test_memoized(conversions):
+    assert latex_to_unicode_batch(['x', '\\alpha', 'x', '\\mathbb{R}^2']) \
+        == ['x', 'α', 'x', 'ℝ²']
+    assert conversions == ['x', '\\alpha', '\\mathbb{R}^2']
+    assert latex_to_unicode_batch(['\\alpha', 'x']) == ['α', 'x']
+    assert len(conversions) == 3
+
+
+def test_persistent_cache(conversions, tmp_path):
+    cache_fp = os.path.join(tmp_path, 'cache.db')
+    set_cache(cache_fp)
+    latex_to_unicode_batch(['\\alpha', '\\beta'])
+    flush_cache()
+    # a new run (empty memo) reads conversions from the persistent cache
+    set_cache(None)
+    unicode_math._memo.clear()
+    set_cache(cache_fp)
+    assert latex_to_unicode_batch(['\\beta', '\\alpha', '\\gamma']) == \
+        ['β', 'α', 'γ']
+    assert conversions == ['\\alpha', '\\beta', '\\gamma']
+
+
+def test_prep_workers_use_cache(
+        sample_pprs, tmp_path, monkeypatch, conversions
+):
+    # two small chunks (unicodeit is slow)
+    data_dir = os.path.join(tmp_path, 'data')
+    os.makedirs(data_dir)
+    for i in range(2):
+        fp = os.path.join(data_dir, 'arXiv_src_2212_{:03d}.jsonl'.format(i))
+        with open(fp, 'w') as f:
+            for ppr in sample_pprs[i*3:i*3+3]:
+                f.write(json.dumps(ppr) + '\n')
+    # workers started with spawn don’t inherit module state
+    monkeypatch.setattr(
+        unarxive_reader, 'Pool', multiprocessing.get_context('spawn').Pool
+    )
+    outputs = {}
+    for num_workers in [1, 2]:
+        out_dir = os.path.join(tmp_path, str(num_workers))
+        os.makedirs(out_dir)
+        monkeypatch.chdir(out_dir)
+        cache_fp = os.path.join(out_dir, 'cache.db')
+        prep(
+            data_dir, stream=True, num_workers=num_workers,
+            unicode_math=True, unicode_math_cache_fp=cache_fp
+        )
+        set_cache(None)
+        conn = sqlite3.connect(cache_fp)
+        cached = conn.execute('select latex, unicode from formula').fetchall()
+        conn.close()
+        assert len(cached) > 0
+        with open(os.path.join(out_dir, 'imrad_data.jsonl')) as f:
+            outputs[num_workers] = (sorted(cached), f.read())
+    # (conversions in the main process were those of the serial run)
+    assert len(conversions) == len(outputs[1][0])
+    assert outputs[2] == outputs[1]